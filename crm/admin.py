@@ -1,5 +1,14 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import BusinessProfile, Client, Order, Comment, Employee, Message, WorkLog, EmployeeInvitation
+from django.core.exceptions import PermissionDenied
+from django.db.models import Avg, Count, Max, Sum
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import BusinessProfile, Client, Order, Comment, Employee, Message, WorkLog, EmployeeInvitation, ExportJob, SlowQuery
+from .profiling import SORT_KEYS, list_profiles, load_meta, profile_path, top_functions
 
 
 @admin.register(BusinessProfile)
@@ -12,7 +21,7 @@ class BusinessProfileAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Основное', {
-            'fields': ('user', 'business_name', 'phone', 'language')
+            'fields': ('user', 'business_name', 'phone', 'language', 'timezone')
         }),
         ('Подписка', {
             'fields': ('is_active', 'subscription_end')
@@ -81,4 +90,117 @@ class WorkLogAdmin(admin.ModelAdmin):
     
     def get_duration(self, obj):
         return f"{obj.duration}"
-    get_duration.short_description = 'Длительность'
\ No newline at end of file
+    get_duration.short_description = 'Длительность'
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'business', 'status', 'rows_done', 'rows_total', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = ['fingerprint', 'file', 'error', 'created_at', 'started_at', 'finished_at']
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """Журнал медленных запросов; /grouped/ — сводка по отпечатку SQL"""
+    list_display = ['created_at', 'duration_ms', 'view', 'business_id', 'short_sql', 'fingerprint_link']
+    list_filter = ['view', 'created_at']
+    search_fields = ['sql', 'view']
+    readonly_fields = ['fingerprint', 'sql', 'params_shape', 'duration_ms', 'view', 'business_id', 'stack', 'created_at']
+    change_list_template = 'admin/crm/slowquery/change_list.html'
+    
+    def short_sql(self, obj):
+        return obj.sql[:120]
+    short_sql.short_description = 'SQL'
+    
+    def fingerprint_link(self, obj):
+        url = reverse('admin:crm_slowquery_changelist')
+        return format_html('<a href="{}?fingerprint={}">{}</a>', url, obj.fingerprint, obj.fingerprint[:8])
+    fingerprint_link.short_description = 'Отпечаток'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('grouped/', self.admin_site.admin_view(self.grouped_view), name='crm_slowquery_grouped'),
+        ] + super().get_urls()
+    
+    def grouped_view(self, request):
+        """Отпечатки SQL по суммарному времени: что сильнее всего грузит БД"""
+        groups = (
+            SlowQuery.objects.values('fingerprint')
+            .annotate(
+                count=Count('pk'),
+                total_ms=Sum('duration_ms'),
+                avg_ms=Avg('duration_ms'),
+                max_ms=Max('duration_ms'),
+                sql=Max('sql'),
+                last_seen=Max('created_at'),
+                views=Count('view', distinct=True),
+                example_view=Max('view'),
+            )
+            .order_by('-total_ms')[:200]
+        )
+        return render(request, 'admin/crm/slowquery/grouped.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Медленные запросы по отпечатку',
+            'groups': groups,
+        })
+
+
+# Профили запросов (crm.profiling): хранятся файлами, а не в БД,
+# поэтому это отдельные страницы админки, а не ModelAdmin
+
+def superuser_view(view):
+    """Страница админки только для суперпользователей"""
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        return view(request, *args, **kwargs)
+    return admin.site.admin_view(wrapped)
+
+
+def profile_list_view(request):
+    return render(request, 'admin/crm/profile_list.html', {
+        **admin.site.each_context(request),
+        'title': 'Профили запросов',
+        'profiles': list_profiles(),
+        'header': settings.PROFILING_HEADER,
+    })
+
+
+def profile_detail_view(request, profile_id):
+    meta = load_meta(profile_id)
+    if meta is None:
+        raise Http404
+    sort = request.GET.get('sort', 'cumulative')
+    functions = top_functions(profile_id, sort)
+    if functions is None:
+        raise Http404
+    return render(request, 'admin/crm/profile_detail.html', {
+        **admin.site.each_context(request),
+        'title': f"Профиль {meta['view'] or meta['path']}",
+        'profile': meta,
+        'sort': sort,
+        'sort_keys': SORT_KEYS,
+        'functions': functions,
+    })
+
+
+def profile_download_view(request, profile_id):
+    path = profile_path(profile_id)
+    if path is None or not path.exists():
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
+
+
+profile_urls = [
+    path('', superuser_view(profile_list_view), name='crm_profile_list'),
+    path('<str:profile_id>/', superuser_view(profile_detail_view), name='crm_profile_detail'),
+    path('<str:profile_id>/download/', superuser_view(profile_download_view), name='crm_profile_download'),
+]
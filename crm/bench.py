@@ -0,0 +1,284 @@
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models import Count
+from django.test import Client as TestClient
+from django.urls import URLPattern, reverse
+
+from . import urls
+from .models import BusinessProfile, Client, Employee, Order
+
+
+# Маршруты, которые меняют состояние, требуют POST/токена или держат
+# соединение открытым — их GET-замер бессмыслен
+SKIP_VIEWS = {
+    'logout', 'change_language', 'password_reset_confirm', 'register_by_invitation',
+    'chat_send', 'chat_stream', 'chat_poll', 'start_work', 'end_work',
+    'export_job_create', 'export_job_status', 'export_job_download',
+}
+
+# Какой объект бизнеса подставлять в параметр маршрута
+ROUTE_ARGS = {
+    'client_detail': {'pk': 'client'},
+    'client_edit': {'pk': 'client'},
+    'client_delete': {'pk': 'client'},
+    'order_add': {'client_pk': 'client'},
+    'order_detail': {'pk': 'order'},
+    'order_edit': {'pk': 'order'},
+    'order_delete': {'pk': 'order'},
+    'employee_edit': {'pk': 'employee'},
+    'employee_delete': {'pk': 'employee'},
+    'chat_detail': {'employee_pk': 'employee'},
+    'chat_history': {'employee_pk': 'employee'},
+    'employee_work_time': {'employee_pk': 'employee'},
+}
+
+DEFAULT_REPEAT = 20
+DEFAULT_WARMUP = 2
+# Допустимый рост p95 относительно базовой линии (0.2 = +20%)
+DEFAULT_THRESHOLD = 0.2
+
+# Сравнение пропускной способности gunicorn в режимах WSGI и ASGI
+SERVER_MODES = ('wsgi', 'asgi')
+# Страницы, переведённые на async-views
+SERVER_VIEWS = ('dashboard', 'order_list', 'analytics', 'chat_list', 'chat_detail')
+DEFAULT_CONCURRENCY = 16
+DEFAULT_DURATION = 10.0
+DEFAULT_WORKERS = 2
+SERVER_START_TIMEOUT = 30
+
+
+def _sample_objects(profile):
+    """Типичные объекты бизнеса для параметров маршрутов: самый «тяжёлый» клиент и т.п."""
+    client = (
+        Client.objects.filter(business=profile)
+        .annotate(orders_count=Count('orders')).order_by('-orders_count', 'pk').first()
+    )
+    order = Order.objects.filter(business=profile).order_by('-created_at').first()
+    employee = Employee.objects.filter(business=profile).exclude(user=profile.user).order_by('pk').first()
+    return {
+        'client': client and client.pk,
+        'order': order and order.pk,
+        'employee': employee and employee.pk,
+    }
+
+
+def bench_routes(profile):
+    """[(имя маршрута, url)] для всех GET-страниц crm/urls.py, которые можно замерить"""
+    objects = _sample_objects(profile)
+    routes = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in SKIP_VIEWS:
+            continue
+        kwargs = {param: objects[kind] for param, kind in ROUTE_ARGS.get(pattern.name, {}).items()}
+        if any(value is None for value in kwargs.values()):
+            continue
+        routes.append((pattern.name, reverse(pattern.name, kwargs=kwargs)))
+    return routes
+
+
+def _host():
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0] if hosts else 'localhost'
+
+
+def _percentile(sorted_samples, share):
+    index = min(len(sorted_samples) - 1, max(0, round(share * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """p50/p95/p99 в миллисекундах"""
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(samples) * 1000, 2),
+        'p95_ms': round(_percentile(samples, 0.95) * 1000, 2),
+        'p99_ms': round(_percentile(samples, 0.99) * 1000, 2),
+    }
+
+
+def run_bench(profile, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, only=None):
+    """
+    Прогоняет каждую страницу через тестовый клиент от имени владельца
+    бизнеса и возвращает {имя: {p50_ms, p95_ms, p99_ms, queries, status}}.
+    Число запросов берётся из QueryStatsMiddleware (request.query_stats).
+    """
+    client = TestClient(HTTP_HOST=_host(), raise_request_exception=False)
+    client.force_login(profile.user)
+    secure = not settings.DEBUG
+
+    results = {}
+    for name, url in bench_routes(profile):
+        if only and name not in only:
+            continue
+        samples, queries, status = [], None, None
+        for attempt in range(warmup + repeat):
+            start = time.perf_counter()
+            response = client.get(url, secure=secure)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            elapsed = time.perf_counter() - start
+            if attempt < warmup:
+                continue
+            samples.append(elapsed)
+            status = response.status_code
+            stats = getattr(response.wsgi_request, 'query_stats', None)
+            if stats is not None:
+                queries = stats.count
+        results[name] = {**summarize(samples), 'queries': queries, 'status': status, 'url': url}
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Регрессии относительно базовой линии: p95 вырос больше чем на
+    threshold или запросов стало больше. [(имя, описание)]
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append((name, f"p95 {previous['p95_ms']} → {current['p95_ms']} мс"))
+        if (current.get('queries') or 0) > (previous.get('queries') or 0):
+            regressions.append((name, f"запросов {previous.get('queries')} → {current.get('queries')}"))
+    return regressions
+
+
+def default_profile(prefix='load'):
+    """Первый бизнес, созданный seed_load с этим префиксом"""
+    return (
+        BusinessProfile.objects.select_related('user')
+        .filter(user__username__startswith=f'{prefix}-')
+        .order_by('pk').first()
+    )
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _session_cookie(user):
+    """Cookie сессии пользователя: сессии в БД, поэтому её видит и gunicorn"""
+    client = TestClient()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+@contextmanager
+def serve(mode, port, workers=DEFAULT_WORKERS):
+    """
+    Запускает gunicorn с gunicorn.conf.py в режиме mode (SERVER_MODE) на
+    127.0.0.1:port и ждёт, пока он начнёт принимать соединения.
+    """
+    # Число воркеров — через WEB_CONCURRENCY, чтобы его видели и настройки
+    env = {
+        **os.environ, 'SERVER_MODE': mode, 'SECURE_SSL_REDIRECT': 'False',
+        'WEB_CONCURRENCY': str(workers),
+    }
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '-c', str(settings.BASE_DIR / 'gunicorn.conf.py'),
+        '--bind', f'127.0.0.1:{port}',
+    ]
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while True:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    log.seek(0)
+                    tail = log.read().decode(errors='replace')[-2000:]
+                    raise RuntimeError(f'gunicorn ({mode}) не запустился:\n{tail}')
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def _load(port, paths, headers, concurrency, duration):
+    """
+    concurrency потоков в течение duration секунд по кругу запрашивают
+    paths. Возвращает (длительности успешных ответов, ошибки, секунды).
+    """
+    deadline = time.monotonic() + duration
+
+    def worker(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        samples, errors, index = [], 0, offset
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                errors += 1
+                continue
+            if response.status == 200:
+                samples.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        connection.close()
+        return samples, errors
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.monotonic() - start
+    samples = [sample for worker_samples, _ in results for sample in worker_samples]
+    return samples, sum(errors for _, errors in results), elapsed
+
+
+def run_server_bench(profile, modes=SERVER_MODES, concurrency=DEFAULT_CONCURRENCY,
+                     duration=DEFAULT_DURATION, workers=DEFAULT_WORKERS, warmup=2.0):
+    """
+    Нагружает async-страницы (SERVER_VIEWS) настоящим gunicorn в каждом
+    режиме с одинаковым числом воркеров и возвращает
+    {режим: {requests_per_sec, requests, errors, p50_ms, p95_ms, p99_ms}}.
+    Нагрузка — concurrency параллельных соединений от имени владельца.
+    Статика должна быть собрана (collectstatic): без манифеста страницы
+    отвечают 500 и считаются ошибками.
+    """
+    paths = [url for name, url in bench_routes(profile) if name in SERVER_VIEWS]
+    headers = {'Host': _host(), 'Cookie': _session_cookie(profile.user)}
+
+    results = {}
+    for mode in modes:
+        port = _free_port()
+        with serve(mode, port, workers):
+            _load(port, paths, headers, concurrency, warmup)
+            samples, errors, elapsed = _load(port, paths, headers, concurrency, duration)
+        results[mode] = {
+            'requests_per_sec': round(len(samples) / elapsed, 1),
+            'requests': len(samples),
+            'errors': errors,
+            **(summarize(samples) if samples else {}),
+        }
+    return results
@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Сколько хранить вычисленные цифры (сек.); инвалидация — через поколение
+ANALYTICS_CACHE_TIMEOUT = getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 600)
+
+
+def _generation_key(business_id):
+    return f'crm:gen:{business_id}'
+
+
+def _fresh_generation():
+    # Начальное значение из времени: если ключ поколения вытеснен из кэша,
+    # новое поколение не совпадёт ни с одним из старых
+    return time.time_ns()
+
+
+def get_generation(business_id):
+    """Текущее поколение данных бизнеса"""
+    key = _generation_key(business_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _fresh_generation(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+async def aget_generation(business_id):
+    key = _generation_key(business_id)
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, _fresh_generation(), timeout=None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def bump_generation(business_id):
+    """Новое поколение: все закэшированные цифры бизнеса становятся неактуальны"""
+    key = _generation_key(business_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _fresh_generation(), timeout=None)
+
+
+def cached_for_business(business_id, name, compute, timeout=ANALYTICS_CACHE_TIMEOUT):
+    """Значение compute() из кэша текущего поколения бизнеса"""
+    key = f'crm:{name}:{business_id}:{get_generation(business_id)}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+async def acached_for_business(business_id, name, compute, timeout=ANALYTICS_CACHE_TIMEOUT):
+    """cached_for_business для async-views; compute — корутинная функция"""
+    key = f'crm:{name}:{business_id}:{await aget_generation(business_id)}'
+    value = await cache.aget(key)
+    if value is None:
+        value = await compute()
+        await cache.aset(key, value, timeout)
+    return value
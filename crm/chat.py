@@ -0,0 +1,218 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Substr
+from django.utils.timezone import localtime
+
+from .models import Employee, Message
+from .pubsub import employee_channel, get_pubsub
+
+
+# Раз в сколько секунд слать комментарий-пинг в SSE, чтобы прокси не рвали соединение
+STREAM_HEARTBEAT = 15
+# Сколько живёт одно SSE-соединение; браузер переподключится сам с Last-Event-ID
+STREAM_LIFETIME = 300
+# Сколько long-poll запрос ждёт новых сообщений
+LONG_POLL_TIMEOUT = 25
+# Сколько сообщений отдавать за одну выборку
+FETCH_BATCH_SIZE = 100
+# Сколько последних сообщений показывать при открытии чата и подгружать за раз
+HISTORY_PAGE_SIZE = 50
+# Длина превью последнего сообщения во входящих
+PREVIEW_LENGTH = 100
+
+
+def realtime_enabled():
+    """
+    SSE и long-poll включены только под ASGI: WSGI-сервер дочитывает
+    асинхронный поток до конца, держа синхронный воркер всё это время.
+    Без них страница чата опрашивает chat_history по таймеру.
+    """
+    return settings.SERVER_MODE == 'asgi'
+
+
+def conversation(first_id, second_id):
+    """Условие на переписку двух сотрудников в обе стороны"""
+    return (
+        Q(sender_id=first_id, recipient_id=second_id)
+        | Q(sender_id=second_id, recipient_id=first_id)
+    )
+
+
+def inbox(current):
+    """
+    Коллеги текущего сотрудника с последним сообщением переписки и числом
+    непрочитанных входящих — одним запросом через коррелированные подзапросы.
+    Сначала свежие переписки, затем коллеги без сообщений.
+    """
+    last_message = (
+        Message.objects.filter(conversation(OuterRef('pk'), current.pk))
+        .order_by('-created_at', '-pk')
+    )
+    unread = (
+        Message.objects.filter(recipient_id=current.pk, sender_id=OuterRef('pk'), is_read=False)
+        .order_by()
+        .values('sender_id')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return (
+        Employee.objects.filter(business_id=current.business_id)
+        .exclude(pk=current.pk)
+        .annotate(
+            last_message_text=Subquery(
+                last_message.annotate(preview=Substr('text', 1, PREVIEW_LENGTH)).values('preview')[:1]
+            ),
+            last_message_at=Subquery(last_message.values('created_at')[:1]),
+            last_message_sender_id=Subquery(last_message.values('sender_id')[:1]),
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0),
+        )
+        .order_by(F('last_message_at').desc(nulls_last=True), 'first_name', 'last_name')
+    )
+
+
+def message_payload(message):
+    return {
+        'id': message.pk,
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'text': message.text,
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat(),
+        'time': localtime(message.created_at).strftime('%H:%M'),
+    }
+
+
+def parse_message_id(value, default=0):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def _unread_incoming(current, messages):
+    return [m.pk for m in messages if m.recipient_id == current.pk and not m.is_read]
+
+
+def mark_delivered(current, messages):
+    """Отмечает прочитанными только входящие из уже отданных сообщений"""
+    incoming = _unread_incoming(current, messages)
+    if incoming:
+        Message.objects.filter(pk__in=incoming).update(is_read=True)
+
+
+def history_page(current, other, before_id=None, after_id=None, limit=None):
+    """
+    Страница переписки в хронологическом порядке и флаг has_more.
+
+    before_id — сообщения старше указанного (подгрузка вверх), after_id —
+    новее указанного; без курсоров — последние limit сообщений.
+    """
+    limit = limit or HISTORY_PAGE_SIZE
+    query = _history_query(current, other, before_id, after_id, limit)
+    page, has_more = _history_result(list(query), after_id, limit)
+    mark_delivered(current, page)
+    return page, has_more
+
+
+async def ahistory_page(current, other, before_id=None, after_id=None, limit=None):
+    """history_page для async-views"""
+    limit = limit or HISTORY_PAGE_SIZE
+    query = _history_query(current, other, before_id, after_id, limit)
+    page, has_more = _history_result([m async for m in query], after_id, limit)
+    incoming = _unread_incoming(current, page)
+    if incoming:
+        await Message.objects.filter(pk__in=incoming).aupdate(is_read=True)
+    return page, has_more
+
+
+def _history_query(current, other, before_id, after_id, limit):
+    messages = Message.objects.filter(conversation(current.pk, other.pk))
+    if after_id is not None:
+        return messages.filter(pk__gt=after_id).order_by('pk')[:limit + 1]
+    if before_id is not None:
+        messages = messages.filter(pk__lt=before_id)
+    return messages.order_by('-pk')[:limit + 1]
+
+
+def _history_result(rows, after_id, limit):
+    """(страница в хронологическом порядке, есть ли ещё)"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return (rows if after_id is not None else rows[::-1]), has_more
+
+
+async def fetch_new(current, other, after_id):
+    """
+    Сообщения переписки с id больше after_id. Входящие из выборки сразу
+    отмечаются прочитанными — они доставлены в открытый чат.
+    """
+    messages = [
+        message async for message in
+        Message.objects.filter(conversation(current.pk, other.pk), pk__gt=after_id)
+        .order_by('pk')[:FETCH_BATCH_SIZE]
+    ]
+    incoming = _unread_incoming(current, messages)
+    if incoming:
+        await Message.objects.filter(pk__in=incoming).aupdate(is_read=True)
+    return messages
+
+
+def _release_connection():
+    """
+    Закрывает соединение с БД в потоке, где async ORM выполняет запросы
+    чата. Поток SSE или long-poll живёт минутами, а соединение нужно ему
+    только на время выборки: между выборками открытые вкладки чата не
+    держат подключений к БД. Внутри транзакции (тесты) не трогаем.
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+async def wait_for_messages(current, other, after_id, timeout=LONG_POLL_TIMEOUT):
+    """Long-poll: новые сообщения или пустой список по истечении timeout"""
+    # Подписываемся до первой выборки, чтобы не пропустить уведомление между ними
+    async with get_pubsub().subscribe(employee_channel(current.pk)) as subscription:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            messages = await fetch_new(current, other, after_id)
+            remaining = deadline - loop.time()
+            if messages or remaining <= 0:
+                return messages
+            await sync_to_async(_release_connection)()
+            await subscription.wait(remaining)
+
+
+def _sse_event(message):
+    data = json.dumps(message_payload(message), ensure_ascii=False)
+    return f'id: {message.pk}\nevent: message\ndata: {data}\n\n'
+
+
+async def event_stream(current, other, after_id):
+    """Поток Server-Sent Events с новыми сообщениями переписки"""
+    async with get_pubsub().subscribe(employee_channel(current.pk)) as subscription:
+        yield 'retry: 3000\n\n'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_LIFETIME
+        last_sent = loop.time()
+        while loop.time() < deadline:
+            messages = await fetch_new(current, other, after_id)
+            for message in messages:
+                after_id = message.pk
+                yield _sse_event(message)
+            if messages:
+                last_sent = loop.time()
+            if len(messages) == FETCH_BATCH_SIZE:
+                continue
+            # Пинг по времени, а не по таймауту wait(): DatabasePollingPubSub
+            # просыпается каждые CHAT_POLL_INTERVAL и таймаута не сообщает
+            if loop.time() - last_sent >= STREAM_HEARTBEAT:
+                yield ': ping\n\n'
+                last_sent = loop.time()
+            await sync_to_async(_release_connection)()
+            await subscription.wait(max(0, min(last_sent + STREAM_HEARTBEAT, deadline) - loop.time()))
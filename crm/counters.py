@@ -0,0 +1,76 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import BusinessProfile, Client, Order
+
+
+STATUS_COUNTERS = {
+    'new': 'orders_new_count',
+    'in_progress': 'orders_in_progress_count',
+    'done': 'orders_done_count',
+}
+
+
+def add(business_id, **deltas):
+    """UPDATE businessprofile SET x = x + d — атомарно, без чтения строки"""
+    changes = {name: F(name) + value for name, value in deltas.items() if value}
+    if business_id is not None and changes:
+        BusinessProfile.objects.filter(pk=business_id).update(**changes)
+
+
+def _counters(business_id):
+    return BusinessProfile.objects.filter(pk=business_id).values(*BusinessProfile.COUNTER_FIELDS)
+
+
+def _no_counters():
+    return {name: 0 for name in BusinessProfile.COUNTER_FIELDS}
+
+
+def live_counters(business_id):
+    """Текущие значения счётчиков одним запросом по первичному ключу"""
+    return _counters(business_id).first() or _no_counters()
+
+
+async def alive_counters(business_id):
+    """live_counters для async-views"""
+    return await _counters(business_id).afirst() or _no_counters()
+
+
+def status_deltas(old_status, new_status):
+    """Изменения счётчиков при смене статуса заявки (None — нет заявки)"""
+    deltas = {}
+    if old_status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[old_status]] = -1
+    if new_status in STATUS_COUNTERS:
+        field = STATUS_COUNTERS[new_status]
+        deltas[field] = deltas.get(field, 0) + 1
+    return deltas
+
+
+def _count_subquery(queryset, business_field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{business_field: OuterRef('pk')})
+            .order_by()
+            .values(business_field)
+            .annotate(n=Count('pk'))
+            .values('n'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def repair_counters(business_ids=None):
+    """Пересчитывает все счётчики одним UPDATE с подзапросами"""
+    profiles = BusinessProfile.objects.all()
+    if business_ids is not None:
+        profiles = profiles.filter(pk__in=business_ids)
+    orders = Order.objects.all()
+    return profiles.update(
+        clients_count=_count_subquery(Client.objects.all(), 'business'),
+        **{
+            field: _count_subquery(orders.filter(Q(status=status)), 'business')
+            for status, field in STATUS_COUNTERS.items()
+        },
+    )
@@ -0,0 +1,453 @@
+import csv
+import hashlib
+import tempfile
+from datetime import date, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Count, Max, Sum
+from django.http import StreamingHttpResponse
+from django.utils.timezone import now
+from openpyxl import Workbook
+
+from .models import Client, Employee, Order, ExportJob, WorkDay
+
+
+# Сколько строк читать из БД за один раз (и сколько класть в record batch)
+EXPORT_CHUNK_SIZE = 2000
+# Размер блока при отдаче готового файла
+STREAM_BLOCK_SIZE = 64 * 1024
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STATUS_MAP = {'new': 'Новая', 'in_progress': 'В работе', 'done': 'Завершена'}
+
+
+class ExportSpec:
+    """
+    Описание экспорта: колонки (заголовок, тип) и генератор строк.
+
+    Строки содержат «сырые» значения (str, float/None, date), а каждый
+    формат сам решает, как их записать.
+    """
+
+    def __init__(self, name, title, columns, rows, queryset):
+        self.name = name
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.queryset = queryset
+
+    @property
+    def header(self):
+        return [title for title, _ in self.columns]
+
+
+def client_export(profile):
+    """Клиенты бизнеса"""
+    queryset = Client.objects.filter(business=profile).order_by('-created_at', '-id')
+
+    def rows():
+        for client in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [client.name, client.phone, client.notes, client.created_at.date()]
+
+    columns = [('Имя', 'string'), ('Телефон', 'string'), ('Заметки', 'string'), ('Дата добавления', 'date')]
+    return ExportSpec('clients', 'Клиенты', columns, rows, queryset)
+
+
+def order_export(profile):
+    """Заявки бизнеса вместе с клиентом (один запрос с JOIN)"""
+    queryset = (
+        Order.objects.filter(business=profile)
+        .select_related('client')
+        .order_by('-created_at', '-id')
+    )
+
+    def rows():
+        for order in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [
+                order.client.name,
+                order.client.phone,
+                order.service,
+                STATUS_MAP.get(order.status, order.status),
+                float(order.price) if order.price is not None else None,
+                order.created_at.date(),
+            ]
+
+    columns = [
+        ('Клиент', 'string'), ('Телефон', 'string'), ('Услуга', 'string'),
+        ('Статус', 'string'), ('Цена', 'float'), ('Дата', 'date'),
+    ]
+    return ExportSpec('orders', 'Заявки', columns, rows, queryset)
+
+
+EXPORTS = {
+    'clients': client_export,
+    'orders': order_export,
+}
+
+
+class WorkbookSpec:
+    """Экспорт из нескольких листов; sheets() отдаёт ExportSpec по очереди"""
+
+    def __init__(self, name, sheets):
+        self.name = name
+        self.sheets = sheets
+
+
+def _hours(seconds):
+    return round(seconds / 3600, 2)
+
+
+def _sheet_title(employee, used):
+    """Имя листа Excel: до 31 символа, без []:*?/\\ и без повторов"""
+    base = ''.join(c for c in f'{employee.last_name} {employee.first_name}'.strip() if c not in '[]:*?/\\')
+    base = (base or f'#{employee.pk}')[:31]
+    title, n = base, 1
+    while title.lower() in used:
+        n += 1
+        suffix = f' ({n})'
+        title = base[:31 - len(suffix)] + suffix
+    used.add(title.lower())
+    return title
+
+
+def payroll_export(profile, start, end):
+    """
+    Табель всех сотрудников за [start, end] (даты включительно): лист
+    «Итого» и по листу на сотрудника с часами по дням.
+
+    Сотрудники читаются одним запросом (их десятки, а не тысячи), итоги —
+    один GROUP BY по WorkDay, дни — один поток строк WorkDay,
+    отсортированный как сотрудники; листы заполняются слиянием этого
+    потока со списком сотрудников, поэтому память не зависит от длины
+    периода. Учитываются завершённые сессии.
+    """
+    employees = Employee.objects.filter(business=profile).order_by('last_name', 'first_name', 'id')
+    work_days = WorkDay.objects.filter(employee__business=profile, day__gte=start, day__lte=end)
+    period = f"{start.strftime('%d.%m.%Y')}–{end.strftime('%d.%m.%Y')}"
+
+    def sheets():
+        staff = list(employees)
+        totals = {
+            row['employee_id']: row
+            for row in work_days.order_by().values('employee_id').annotate(days=Count('id'), seconds=Sum('seconds'))
+        }
+
+        def summary_rows():
+            for employee in staff:
+                total = totals.get(employee.pk, {})
+                yield [
+                    f'{employee.first_name} {employee.last_name}'.strip(),
+                    employee.get_role_display(),
+                    total.get('days', 0),
+                    _hours(total.get('seconds') or 0),
+                ]
+
+        yield ExportSpec(
+            'summary', 'Итого',
+            [('Сотрудник', 'string'), ('Должность', 'string'), ('Дней', 'float'), (f'Часов ({period})', 'float')],
+            summary_rows, employees,
+        )
+
+        days = (
+            work_days.order_by('employee__last_name', 'employee__first_name', 'employee_id', 'day')
+            .values_list('employee_id', 'day', 'seconds')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        pending = next(days, None)
+        used_titles = {'итого'}
+        for employee in staff:
+
+            def employee_rows(employee_id=employee.pk):
+                nonlocal pending
+                while pending is not None and pending[0] == employee_id:
+                    _, day, seconds = pending
+                    yield [day, _hours(seconds)]
+                    pending = next(days, None)
+
+            yield ExportSpec(
+                f'employee-{employee.pk}', _sheet_title(employee, used_titles),
+                [('Дата', 'date'), ('Часов', 'float')],
+                employee_rows, None,
+            )
+
+    return WorkbookSpec(f"payroll-{start.isoformat()}-{end.isoformat()}", sheets)
+
+
+def text_rows(spec):
+    """Строки для табличных форматов: даты как дд.мм.гггг, пустая цена как ''"""
+    for row in spec.rows():
+        yield [
+            value.strftime('%d.%m.%Y') if isinstance(value, date) else ('' if value is None else value)
+            for value in row
+        ]
+
+
+# ==================== ФОРМАТЫ ====================
+
+def _append_sheet(wb, spec):
+    ws = wb.create_sheet(spec.title)
+    ws.append(spec.header)
+    for row in text_rows(spec):
+        ws.append(row)
+
+
+def write_xlsx(spec, fileobj):
+    """
+    Пишет XLSX в write-only режиме: openpyxl сбрасывает строки листа
+    во временный файл, поэтому память не растёт с числом строк.
+    """
+    wb = Workbook(write_only=True)
+    _append_sheet(wb, spec)
+    wb.save(fileobj)
+
+
+def write_workbook_xlsx(workbook, fileobj):
+    """Многолистовой XLSX, листы пишутся по одному в write-only режиме"""
+    wb = Workbook(write_only=True)
+    for spec in workbook.sheets():
+        _append_sheet(wb, spec)
+    wb.save(fileobj)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: write() просто возвращает строку"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(spec):
+    """CSV построчно из генератора, без буферизации всего файла"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(spec.header).encode('utf-8')
+    for row in text_rows(spec):
+        yield writer.writerow(row).encode('utf-8')
+
+
+def iter_workbook_csv(workbook):
+    """Листы подряд в одном CSV: строка с названием, заголовок, данные, пустая строка"""
+    writer = csv.writer(Echo())
+    for spec in workbook.sheets():
+        yield writer.writerow([spec.title]).encode('utf-8')
+        yield writer.writerow(spec.header).encode('utf-8')
+        for row in text_rows(spec):
+            yield writer.writerow(row).encode('utf-8')
+        yield writer.writerow([]).encode('utf-8')
+
+
+def write_parquet(spec, fileobj):
+    """Parquet, записанный record batch'ами по EXPORT_CHUNK_SIZE строк"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {'string': pa.string(), 'float': pa.float64(), 'date': pa.date32()}
+    schema = pa.schema([(title, arrow_types[kind]) for title, kind in spec.columns])
+
+    rows = spec.rows()
+    with pq.ParquetWriter(fileobj, schema, compression='snappy') as writer:
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            arrays = [
+                pa.array([row[i] for row in chunk], type=schema.field(i).type)
+                for i in range(len(spec.columns))
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+def iter_file(fileobj, block_size=STREAM_BLOCK_SIZE):
+    """Отдаёт файл блоками и закрывает его в конце"""
+    try:
+        fileobj.seek(0)
+        while True:
+            block = fileobj.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        fileobj.close()
+
+
+def _file_stream(writer):
+    def stream(spec):
+        tmp = tempfile.TemporaryFile()
+        writer(spec, tmp)
+        return iter_file(tmp)
+    return stream
+
+
+# формат -> (content type, функция spec -> итератор байтов)
+FORMATS = {
+    'xlsx': (XLSX_CONTENT_TYPE, _file_stream(write_xlsx)),
+    'csv': ('text/csv; charset=utf-8', iter_csv),
+    'parquet': ('application/vnd.apache.parquet', _file_stream(write_parquet)),
+}
+
+
+# То же для многолистовых экспортов (parquet — одна таблица, не подходит)
+WORKBOOK_FORMATS = {
+    'xlsx': (XLSX_CONTENT_TYPE, _file_stream(write_workbook_xlsx)),
+    'csv': ('text/csv; charset=utf-8', iter_workbook_csv),
+}
+
+
+def _take(iterator, block_size):
+    """Куски итератора, пока не наберётся block_size байт (b'' — поток кончился)"""
+    parts, size = [], 0
+    for part in iterator:
+        parts.append(part)
+        size += len(part)
+        if size >= block_size:
+            break
+    return b''.join(parts)
+
+
+async def aiter_stream(iterator, block_size=STREAM_BLOCK_SIZE):
+    """
+    Синхронный поток байтов как async-итератор для ASGI: синхронный
+    итератор StreamingHttpResponse ASGI-обработчик Django сначала целиком
+    собирает в память. Куски читаются блоками по block_size в потоке
+    sync_to_async (том же, где работает ORM запроса); исходный генератор
+    закрывается и при обрыве соединения.
+    """
+    try:
+        while True:
+            chunk = await sync_to_async(_take)(iterator, block_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def export_response(spec, fmt='xlsx', formats=FORMATS):
+    """StreamingHttpResponse с экспортом (ExportSpec или WorkbookSpec) в нужном формате"""
+    content_type, stream = formats[fmt]
+    content = stream(spec)
+    if settings.SERVER_MODE == 'asgi':
+        content = aiter_stream(iter(content))
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename={spec.name}.{fmt}'
+    return response
+
+
+# ==================== ФОНОВЫЕ ЭКСПОРТЫ ====================
+
+def export_storage():
+    """Локальное хранилище готовых файлов экспорта"""
+    return FileSystemStorage(location=settings.EXPORT_ROOT)
+
+
+def data_fingerprint(profile, kind):
+    """
+    Отпечаток данных, попадающих в экспорт: число строк, последний id и
+    последнее изменение. Любое добавление, правка или удаление его меняет.
+    """
+    if kind == 'clients':
+        state = Client.objects.filter(business=profile).aggregate(
+            count=Count('id'), last_id=Max('id'), changed=Max('updated_at'),
+        )
+    else:
+        state = Order.objects.filter(business=profile).aggregate(
+            count=Count('id'), last_id=Max('id'), changed=Max('updated_at'),
+            client_changed=Max('client__updated_at'),
+        )
+    raw = repr(sorted(state.items())).encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def fail_stale_jobs(jobs=None):
+    """
+    Помечает failed задачи, которые выполняются дольше EXPORT_JOB_TIMEOUT:
+    воркер упал или был перезапущен посреди экспорта и уже их не закончит.
+    Следующий запрос того же экспорта создаст новую задачу. Возвращает число.
+    """
+    jobs = ExportJob.objects.all() if jobs is None else jobs
+    deadline = now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    return jobs.filter(status='running', started_at__lt=deadline).update(
+        status='failed', error='Воркер остановился во время экспорта', finished_at=now(),
+    )
+
+
+def request_export(profile, kind):
+    """
+    Ставит экспорт в очередь или возвращает уже готовую/идущую задачу
+    для тех же данных.
+    """
+    fail_stale_jobs(ExportJob.objects.filter(business=profile, kind=kind))
+    fingerprint = data_fingerprint(profile, kind)
+    existing = (
+        ExportJob.objects
+        .filter(business=profile, kind=kind, fingerprint=fingerprint, status__in=['pending', 'running', 'done'])
+        .order_by('-created_at')
+        .first()
+    )
+    if existing and (existing.status != 'done' or (existing.file and export_storage().exists(existing.file))):
+        return existing
+    return ExportJob.objects.create(business=profile, kind=kind, fingerprint=fingerprint)
+
+
+def claim_next_job():
+    """
+    Забирает следующую задачу из очереди. Переход pending -> running
+    делается условным UPDATE, поэтому два воркера не возьмут одну задачу.
+    """
+    while True:
+        job = ExportJob.objects.filter(status='pending').order_by('created_at').first()
+        if job is None:
+            return None
+        claimed = ExportJob.objects.filter(pk=job.pk, status='pending').update(status='running', started_at=now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """Строит файл экспорта, обновляя прогресс после каждой пачки строк"""
+    spec = EXPORTS[job.kind](job.business)
+    total = spec.queryset.count()
+    ExportJob.objects.filter(pk=job.pk).update(rows_total=total)
+
+    source_rows = spec.rows
+
+    def tracked_rows():
+        done = 0
+        for row in source_rows():
+            yield row
+            done += 1
+            if done % EXPORT_CHUNK_SIZE == 0:
+                ExportJob.objects.filter(pk=job.pk).update(rows_done=done)
+
+    spec.rows = tracked_rows
+
+    storage = export_storage()
+    with tempfile.TemporaryFile() as tmp:
+        write_xlsx(spec, tmp)
+        tmp.seek(0)
+        name = storage.save(f'{job.business_id}/{job.kind}-{job.pk}.xlsx', File(tmp))
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='done', file=name, rows_done=total, finished_at=now(),
+    )
+
+    # Старые файлы этого же экспорта больше не нужны
+    stale = ExportJob.objects.filter(business_id=job.business_id, kind=job.kind, status='done').exclude(pk=job.pk).exclude(file='')
+    for old in stale:
+        storage.delete(old.file)
+    stale.update(file='')
+
+
+def process_job(job):
+    """Выполняет задачу и фиксирует ошибку, не роняя воркер"""
+    try:
+        run_job(job)
+    except Exception as exc:
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=str(exc), finished_at=now())
@@ -0,0 +1,190 @@
+import codecs
+import csv
+import io
+from itertools import islice
+from zipfile import BadZipFile
+
+from django.db import transaction
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from . import counters
+from .cache import bump_generation
+from .forms import ClientForm
+from .models import Client
+
+
+# Сколько строк проверять и вставлять за одну транзакцию
+IMPORT_BATCH_SIZE = 500
+# Сколько ошибок хранить в отчёте (остальные только считаются)
+MAX_REPORTED_ERRORS = 1000
+# По скольким первым байтам CSV определять кодировку
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_ERROR = 'CSV-файл должен быть в кодировке UTF-8 или Windows-1251'
+
+# Заголовки колонок -> поля ClientForm (в т.ч. заголовки нашего же экспорта)
+COLUMN_ALIASES = {
+    'name': 'name', 'имя': 'name', 'клиент': 'name', 'at': 'name',
+    'phone': 'phone', 'телефон': 'phone', 'telefon': 'phone',
+    'notes': 'notes', 'заметки': 'notes', 'bellikler': 'notes',
+}
+
+
+class ImportResult:
+    """Итог импорта: сколько создано, сколько дублей и ошибки по строкам"""
+
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def _map_header(header):
+    return [COLUMN_ALIASES.get(str(title or '').strip().lower()) for title in header]
+
+
+def _rows_as_dicts(rows):
+    """(номер строки, dict) по первой строке-заголовку"""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = _map_header(header)
+    if 'name' not in fields or 'phone' not in fields:
+        raise ValueError('В файле должны быть колонки «Имя» и «Телефон»')
+    for line, row in enumerate(rows, start=2):
+        data = {}
+        for field, value in zip(fields, row):
+            if field:
+                data[field] = '' if value is None else str(value).strip()
+        if any(data.values()):
+            yield line, data
+
+
+def _csv_encoding(fileobj):
+    """
+    UTF-8, если начало файла им читается, иначе Windows-1251 — так
+    сохраняет CSV Excel в русской Windows.
+    """
+    head = fileobj.read(ENCODING_SAMPLE_SIZE)
+    fileobj.seek(0)
+    try:
+        # final=False: символ, разрезанный границей выборки, — не ошибка
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'cp1251'
+    return 'utf-8-sig'
+
+
+def read_csv(fileobj):
+    """Строки CSV из бинарного файла (UTF-8 или cp1251), без чтения файла целиком"""
+    text = io.TextIOWrapper(fileobj, encoding=_csv_encoding(fileobj), newline='')
+    try:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from _rows_as_dicts(csv.reader(text, dialect))
+    except UnicodeDecodeError:
+        # Файл начался как UTF-8, но дальше в нём другая кодировка
+        raise ValueError(ENCODING_ERROR) from None
+
+
+def read_xlsx(fileobj):
+    """
+    Строки первого листа XLSX в read-only режиме openpyxl. Книга
+    закрывается, когда строки дочитаны (read-only держит файл открытым).
+    """
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError):
+        # Повреждённый файл или CSV/XLS, переименованный в .xlsx
+        raise ValueError('Файл не является книгой Excel (.xlsx)')
+    try:
+        yield from _rows_as_dicts(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def limit_rows(rows, max_rows):
+    """
+    Строки файла списком, если их не больше max_rows; иначе ValueError
+    до импорта, чтобы большой файл не загрузился наполовину.
+    """
+    rows = list(islice(rows, max_rows + 1))
+    if len(rows) > max_rows:
+        raise ValueError(
+            f'В файле больше {max_rows} строк: разделите его на части '
+            f'или загрузите командой manage.py import_clients'
+        )
+    return iter(rows)
+
+
+def read_rows(fileobj, filename):
+    """Выбирает парсер по расширению файла"""
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(fileobj)
+    return read_csv(fileobj)
+
+
+def import_clients(profile, rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Импортирует клиентов пачками.
+
+    Каждая строка проверяется правилами ClientForm, дубли по телефону
+    (внутри файла и с уже существующими клиентами бизнеса) пропускаются.
+    Каждая пачка вставляется bulk_create в своей транзакции, поэтому
+    ошибка в строке не прерывает импорт остального файла.
+    """
+    result = ImportResult()
+    seen_phones = set()
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        valid = []
+        for line, data in batch:
+            form = ClientForm(data)
+            if not form.is_valid():
+                message = '; '.join(
+                    f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()
+                )
+                result.add_error(line, message)
+                continue
+            valid.append(form.cleaned_data)
+
+        phones = {data['phone'] for data in valid}
+        existing = set(
+            Client.objects.filter(business=profile, phone__in=phones).values_list('phone', flat=True)
+        )
+
+        new_clients = []
+        for data in valid:
+            phone = data['phone']
+            if phone in existing or phone in seen_phones:
+                result.duplicates += 1
+                continue
+            seen_phones.add(phone)
+            new_clients.append(Client(business=profile, **data))
+
+        with transaction.atomic():
+            Client.objects.bulk_create(new_clients, batch_size=batch_size)
+            # bulk_create не шлёт post_save — счётчик обновляем сами
+            counters.add(profile.pk, clients_count=len(new_clients))
+        result.created += len(new_clients)
+
+    if result.created:
+        # bulk_create не шлёт post_save — сбрасываем кэш аналитики вручную
+        transaction.on_commit(lambda: bump_generation(profile.pk))
+
+    return result
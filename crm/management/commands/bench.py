@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from crm.bench import DEFAULT_REPEAT, DEFAULT_THRESHOLD, DEFAULT_WARMUP, compare, default_profile, run_bench
+
+
+class Command(BaseCommand):
+    help = 'Замеряет p50/p95/p99 и число SQL-запросов каждой страницы crm и сравнивает с базовой линией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Владелец бизнеса; по умолчанию первый из seed_load')
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Замеров на страницу')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help='Прогревочных запросов на страницу')
+        parser.add_argument('--view', action='append', dest='views', help='Только эта страница (можно несколько раз)')
+        parser.add_argument('--output', help='Куда записать результат JSON (по умолчанию stdout)')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Допустимый рост p95 (0.2 = +20%%)')
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = User.objects.filter(username=options['username']).select_related('businessprofile').first()
+            profile = getattr(user, 'businessprofile', None) if user else None
+        else:
+            profile = default_profile()
+        if profile is None:
+            raise CommandError('Бизнес не найден: укажите --username или запустите seed_load')
+
+        results = run_bench(profile, repeat=options['repeat'], warmup=options['warmup'], only=options['views'])
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fileobj:
+                fileobj.write(report)
+        else:
+            self.stdout.write(report)
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as fileobj:
+                baseline = json.load(fileobj)
+            regressions = compare(results, baseline, options['threshold'])
+            for name, description in regressions:
+                self.stderr.write(f'{name}: {description}')
+            if regressions:
+                raise CommandError(f'Регрессий: {len(regressions)}')
+            self.stderr.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from crm.bench import (
+    DEFAULT_CONCURRENCY, DEFAULT_DURATION, DEFAULT_WORKERS, SERVER_MODES, default_profile, run_server_bench,
+)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность gunicorn в режимах WSGI и ASGI на async-страницах crm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Владелец бизнеса; по умолчанию первый из seed_load')
+        parser.add_argument('--mode', action='append', dest='modes', choices=SERVER_MODES,
+                            help='Только этот режим (можно несколько раз)')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Параллельных соединений')
+        parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='Секунд нагрузки на режим')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Воркеров gunicorn')
+        parser.add_argument('--output', help='Куда записать результат JSON (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = User.objects.filter(username=options['username']).select_related('businessprofile').first()
+            profile = getattr(user, 'businessprofile', None) if user else None
+        else:
+            profile = default_profile()
+        if profile is None:
+            raise CommandError('Бизнес не найден: укажите --username или запустите seed_load')
+
+        try:
+            results = run_server_bench(
+                profile,
+                modes=options['modes'] or SERVER_MODES,
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                workers=options['workers'],
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fileobj:
+                fileobj.write(report)
+        else:
+            self.stdout.write(report)
+        for mode, result in results.items():
+            if result['errors']:
+                self.stderr.write(self.style.WARNING(f"{mode}: ошибок {result['errors']} (не 200 или обрыв соединения)"))
+        if 'wsgi' in results and 'asgi' in results and results['wsgi']['requests_per_sec']:
+            ratio = results['asgi']['requests_per_sec'] / results['wsgi']['requests_per_sec']
+            self.stderr.write(f'ASGI / WSGI: {ratio:.2f}x')
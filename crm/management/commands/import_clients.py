@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.imports import IMPORT_BATCH_SIZE, import_clients, read_rows
+from crm.models import BusinessProfile
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт клиентов бизнеса из CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('business_id', type=int, help='ID профиля бизнеса')
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            profile = BusinessProfile.objects.get(pk=options['business_id'])
+        except BusinessProfile.DoesNotExist:
+            raise CommandError(f"Бизнес {options['business_id']} не найден")
+
+        with open(options['path'], 'rb') as fileobj:
+            try:
+                result = import_clients(
+                    profile,
+                    read_rows(fileobj, options['path']),
+                    batch_size=options['batch_size'],
+                )
+            except ValueError as exc:
+                raise CommandError(str(exc))
+
+        for line, message in result.errors:
+            self.stderr.write(f'Строка {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено: {result.created}, дубликатов: {result.duplicates}, ошибок: {result.error_count}'
+        ))
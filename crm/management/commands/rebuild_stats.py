@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from crm.rollup import rebuild_business_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневную сводку BusinessDailyStats по заявкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, action='append', dest='business_ids',
+                            help='ID бизнеса (можно указать несколько раз); по умолчанию все')
+
+    def handle(self, *args, **options):
+        count = rebuild_business_stats(options['business_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано строк сводки: {count}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from crm.timesheet import rebuild_timesheet
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает табель WorkDay по завершённым рабочим сессиям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, action='append', dest='business_ids',
+                            help='ID бизнеса (можно указать несколько раз); по умолчанию все')
+
+    def handle(self, *args, **options):
+        count = rebuild_timesheet(options['business_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано строк табеля: {count}'))
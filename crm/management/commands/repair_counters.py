@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from crm.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики клиентов и заявок в BusinessProfile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, action='append', dest='business_ids',
+                            help='ID бизнеса (можно указать несколько раз); по умолчанию все')
+
+    def handle(self, *args, **options):
+        count = repair_counters(options['business_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено профилей: {count}'))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from crm.exports import claim_next_job, fail_stale_jobs, process_job
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь фоновых экспортов (ExportJob)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь и выйти')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Пауза при пустой очереди, сек.')
+
+    def handle(self, *args, **options):
+        stale_checked = False
+        while True:
+            # Процесс живёт долго: битое или старое соединение не должно его ронять
+            close_old_connections()
+            try:
+                if not stale_checked:
+                    stale = fail_stale_jobs()
+                    stale_checked = True
+                    if stale:
+                        self.stdout.write(f'Брошенных экспортов помечено failed: {stale}')
+                job = claim_next_job()
+            except DatabaseError as exc:
+                self.stderr.write(f'Очередь экспортов недоступна: {exc}')
+                time.sleep(options['sleep'])
+                continue
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f'Экспорт #{job.pk} ({job.kind}, бизнес {job.business_id})...')
+            process_job(job)
+            job.refresh_from_db()
+            self.stdout.write(f'Экспорт #{job.pk}: {job.status}')
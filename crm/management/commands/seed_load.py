@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from crm.seed import seed_load
+
+
+class Command(BaseCommand):
+    help = 'Создаёт синтетические бизнесы с клиентами, заявками, сотрудниками и перепиской для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=1, help='Сколько бизнесов создать')
+        parser.add_argument('--clients', type=int, default=1000, help='Клиентов на бизнес')
+        parser.add_argument('--orders-per-client', type=float, default=3.0, help='Среднее число заявок клиента')
+        parser.add_argument('--comments-per-order', type=float, default=0.5, help='Среднее число комментариев заявки')
+        parser.add_argument('--employees', type=int, default=10, help='Сотрудников на бизнес (включая владельца)')
+        parser.add_argument('--messages', type=int, default=2000, help='Сообщений чата на бизнес')
+        parser.add_argument('--work-days', type=int, default=90, help='За сколько дней создать рабочие сессии')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней разбросать клиентов и заявки')
+        parser.add_argument('--prefix', default='load', help='Префикс имён пользователей-владельцев')
+        parser.add_argument('--password', default='load12345', help='Пароль владельцев')
+        parser.add_argument('--seed', type=int, default=None, help='Seed генератора для воспроизводимости')
+
+    def handle(self, *args, **options):
+        usernames, stats = seed_load(
+            tenants=options['tenants'],
+            clients=options['clients'],
+            orders_per_client=options['orders_per_client'],
+            comments_per_order=options['comments_per_order'],
+            employees=options['employees'],
+            messages=options['messages'],
+            work_days=options['work_days'],
+            days=options['days'],
+            prefix=options['prefix'],
+            password=options['password'],
+            seed=options['seed'],
+        )
+        self.stdout.write(', '.join(f'{name}: {count}' for name, count in stats.items()))
+        self.stdout.write(self.style.SUCCESS(f'Владельцы: {", ".join(usernames)}'))
@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм (верхние, включительно), как в prometheus_client
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (тип, описание, корзины)
+METRICS = {
+    'crm_http_requests_total': ('counter', 'Обработанные запросы', None),
+    'crm_http_request_duration_seconds': ('histogram', 'Время ответа', LATENCY_BUCKETS),
+    'crm_http_request_db_seconds': ('histogram', 'Время SQL-запросов за запрос', LATENCY_BUCKETS),
+    'crm_http_request_db_queries_total': ('counter', 'Число SQL-запросов', None),
+    'crm_http_response_size_bytes': ('histogram', 'Размер тела ответа', SIZE_BUCKETS),
+}
+
+
+class MetricsRegistry:
+    """
+    Метрики одного процесса. Запись — только словарь в памяти под
+    блокировкой (единицы микросекунд); не чаще раза в flush_interval
+    секунд снимок пишется в METRICS_DIR/<pid>.json, откуда /metrics
+    суммирует все воркеры gunicorn.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.pid = os.getpid()
+        self.path = Path(directory) / f'{self.pid}.json' if directory else None
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels): [счётчики по корзинам..., +Inf, сумма]
+        self.histograms = {}
+        self.last_flush = 0.0
+        self._resume()
+
+    def _resume(self):
+        # Файл с тем же pid остался от завершившегося воркера: продолжаем
+        # его значения, чтобы счётчики не уменьшались
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except ValueError:
+            return
+        for name, labels, value in data.get('counters', []):
+            self.counters[name, tuple(map(tuple, labels))] = value
+        for name, labels, values in data.get('histograms', []):
+            self.histograms[name, tuple(map(tuple, labels))] = values
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(buckets) + 2)
+            values[bisect_left(buckets, value)] += 1
+            values[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Пишет снимок в файл процесса (атомарно через rename)"""
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < self.flush_interval:
+            return
+        self.last_flush = now
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+
+def clear_snapshots(directory=None):
+    """
+    Удаляет снимки воркеров из METRICS_DIR. Вызывается при старте
+    gunicorn (on_starting в gunicorn.conf.py): иначе в сумму попадут
+    воркеры прошлого деплоя, а новый воркер с тем же pid продолжит
+    чужие счётчики.
+    """
+    directory = directory or getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return
+    for path in Path(directory).glob('*'):
+        if path.suffix in ('.json', '.tmp'):
+            path.unlink(missing_ok=True)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Реестр текущего процесса; после fork (gunicorn --preload) — новый"""
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                _registry = MetricsRegistry(
+                    getattr(settings, 'METRICS_DIR', None),
+                    getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0),
+                )
+    return _registry
+
+
+def record_request(view, method, status, duration, db_duration=None, db_queries=None, size=None):
+    registry = get_registry()
+    labels = (('view', view),)
+    registry.inc('crm_http_requests_total', (('view', view), ('method', method), ('status', str(status))))
+    registry.observe('crm_http_request_duration_seconds', labels, duration)
+    if db_duration is not None:
+        registry.observe('crm_http_request_db_seconds', labels, db_duration)
+        registry.inc('crm_http_request_db_queries_total', labels, db_queries)
+    if size is not None:
+        registry.observe('crm_http_response_size_bytes', labels, size)
+    registry.flush()
+
+
+def _merge(total, snapshot):
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for name, labels, values in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        current = total['histograms'].get(key)
+        if current is None or len(current) != len(values):
+            total['histograms'][key] = list(values)
+        else:
+            total['histograms'][key] = [a + b for a, b in zip(current, values)]
+
+
+def collect():
+    """Сумма метрик всех процессов (или только текущего без METRICS_DIR)"""
+    registry = get_registry()
+    total = {'counters': {}, 'histograms': {}}
+    if registry.path is None:
+        _merge(total, registry.snapshot())
+        return total
+
+    registry.flush(force=True)
+    for path in registry.path.parent.glob('*.json'):
+        try:
+            _merge(total, json.loads(path.read_text(encoding='utf-8')))
+        except (FileNotFoundError, ValueError):
+            continue
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(total):
+    """Текстовый формат Prometheus 0.0.4"""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(total['counters'].items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (metric, labels), values in sorted(total['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(values[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
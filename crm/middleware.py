@@ -1,44 +1,276 @@
+import cProfile
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.utils import translation
 from django.shortcuts import redirect
-from django.urls import reverse
 
+from .metrics import record_request
+from .profiling import save_profile
+from .querystats import QueryStats
+from .slowlog import save_slow_queries
+from .tenant import aget_tenant, get_tenant
+
+
+query_logger = logging.getLogger('crm.queries')
 
-class UserLanguageMiddleware:
+
+class DualModeMiddleware:
+    """
+    Основа middleware, работающих и под WSGI, и под ASGI: при асинхронной
+    цепочке Django вызывает __acall__ без переходов sync_to_async /
+    async_to_sync вокруг каждого middleware.
+    """
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
-
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+    
     def __call__(self, request):
-        if request.user.is_authenticated:
-            try:
-                lang = request.user.businessprofile.language
-                translation.activate(lang)
-                request.LANGUAGE_CODE = lang
-            except:
-                pass
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class TenantMiddleware(DualModeMiddleware):
+    """
+    Определяет бизнес пользователя один раз за запрос (с кэшем на
+    TENANT_CACHE_TIMEOUT), включает его язык и проверяет подписку.
+    Результат доступен как request.tenant.
+    """
+    
+    # Пропускаем для неавторизованных и админов
+    allowed_paths = ['/login/', '/register/', '/logout/', '/blocked/', '/admin/']
+    
+    def handle(self, request):
+        user = request.user
+        tenant = get_tenant(user) if user.is_authenticated else None
+        return self._attach(request, user, tenant) or self.get_response(request)
+    
+    async def __acall__(self, request):
+        user = await request.auser()
+        tenant = await aget_tenant(user) if user.is_authenticated else None
+        # Шаблоны и контекст-процессоры читают request.user синхронно:
+        # ленивый объект полез бы в БД прямо из event loop
+        request.user = user
+        return self._attach(request, user, tenant) or await self.get_response(request)
+    
+    def _attach(self, request, user, tenant):
+        """Заполняет request.tenant; редирект, если подписка закончилась"""
+        request.tenant = tenant
+        
+        # Пользователь уже загружен: login_required у async-views берёт
+        # его через request.auser() — без повторного запроса
+        async def auser():
+            return user
+        request.auser = auser
+        
+        if tenant is None:
+            return None
+        # Связь user.businessprofile уже загружена — шаблоны и старый
+        # код не делают лишний запрос
+        user.businessprofile = tenant.profile
+        translation.activate(tenant.language)
+        request.LANGUAGE_CODE = tenant.language
+        
+        if (
+            not user.is_superuser
+            and not tenant.subscription_valid
+            and not any(request.path.startswith(p) for p in self.allowed_paths)
+        ):
+            return redirect('blocked')
+        return None
+
+
+class MetricsMiddleware(DualModeMiddleware):
+    """
+    Время ответа, время и число SQL-запросов (из QueryStatsMiddleware,
+    поэтому стоит перед ним) и размер ответа по имени маршрута — в
+    crm.metrics, откуда их отдаёт /metrics. Запросы без маршрута (404)
+    идут под view="<unmatched>", чтобы сканеры не плодили метки.
+    """
+    
+    def handle(self, request):
+        start = time.perf_counter()
         response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start)
+        return response
+    
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start)
         return response
+    
+    def _record(self, request, response, duration):
+        match = request.resolver_match
+        stats = getattr(request, 'query_stats', None)
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        record_request(
+            match.view_name if match else '<unmatched>',
+            request.method,
+            response.status_code,
+            duration,
+            db_duration=stats.duration if stats else None,
+            db_queries=stats.count if stats else None,
+            size=size,
+        )
 
 
-class SubscriptionCheckMiddleware:
-    """Проверка активности подписки"""
+class QueryStatsMiddleware(DualModeMiddleware):
+    """
+    Считает SQL-запросы запроса через connection.execute_wrapper: число,
+    время в БД и повторяющиеся формы (признак N+1). Итог доступен как
+    request.query_stats, пишется в лог crm.queries одной JSON-строкой
+    и (при QUERY_STATS_HEADERS) в заголовки ответа. Запросы дольше
+    SLOW_QUERY_MS сохраняются в SlowQuery с view и бизнесом.
+    """
     
     def __init__(self, get_response):
-        self.get_response = get_response
+        super().__init__(get_response)
+        self.headers = getattr(settings, 'QUERY_STATS_HEADERS', False)
+        self.warn_queries = getattr(settings, 'QUERY_STATS_WARN_QUERIES', 50)
+        slow_ms = getattr(settings, 'SLOW_QUERY_MS', 0)
+        self.slow_threshold = slow_ms / 1000 if slow_ms > 0 else None
+        self.stack_depth = getattr(settings, 'SLOW_QUERY_STACK_DEPTH', 8)
     
-    def __call__(self, request):
-        # Пропускаем для неавторизованных и админов
-        allowed_paths = ['/login/', '/register/', '/logout/', '/blocked/', '/admin/']
+    def handle(self, request):
+        stats = request.query_stats = QueryStats(self.slow_threshold, self.stack_depth)
+        with stats.record():
+            response = self.get_response(request)
+        if stats.slow:
+            self._save_slow(request, stats)
+        self._report(request, response, stats)
+        return response
+    
+    async def __acall__(self, request):
+        stats = request.query_stats = QueryStats(self.slow_threshold, self.stack_depth)
+        # Соединения с БД привязаны к потоку: счётчик подключается в том
+        # потоке sync_to_async, где async ORM выполнит запросы этого запроса
+        recording = ExitStack()
+        await sync_to_async(recording.enter_context)(stats.record())
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recording.close)()
+        if stats.slow:
+            await sync_to_async(self._save_slow)(request, stats)
+        self._report(request, response, stats)
+        return response
+    
+    def _save_slow(self, request, stats):
+        match = request.resolver_match
+        tenant = getattr(request, 'tenant', None)
+        save_slow_queries(
+            stats.slow,
+            view=match.view_name if match else request.path,
+            business_id=tenant.business_id if tenant else None,
+        )
+    
+    def _report(self, request, response, stats):
+        match = request.resolver_match
+        duplicates = stats.duplicates
+        if self.headers:
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time'] = str(stats.duration_ms)
+            response['X-DB-Duplicates'] = str(sum(n - 1 for n in duplicates.values()))
+            response['Server-Timing'] = f'db;dur={stats.duration_ms};desc="{stats.count} queries"'
         
-        if any(request.path.startswith(p) for p in allowed_paths):
+        level = logging.WARNING if duplicates or stats.count > self.warn_queries else logging.INFO
+        if query_logger.isEnabledFor(level):
+            query_logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'queries': stats.count,
+                'db_ms': stats.duration_ms,
+                'duplicates': [
+                    {'sql': shape, 'count': n}
+                    for shape, n in sorted(duplicates.items(), key=lambda item: -item[1])[:5]
+                ],
+            }, ensure_ascii=False))
+
+
+class ProfilingMiddleware(DualModeMiddleware):
+    """
+    Профилирует cProfile выборку запросов: долю PROFILING_SAMPLE_RATE
+    (0 — выключено) и любой запрос суперпользователя с заголовком
+    PROFILING_HEADER. Профиль с именем view и id бизнеса сохраняется в
+    кольцевой буфер PROFILE_ROOT (см. crm.profiling), его id отдаётся
+    в заголовке X-Profile-Id. Стоит после TenantMiddleware; для потоковых
+    ответов профилируется только код до первого байта. Под ASGI cProfile
+    видит только поток event loop: запросы ORM из потока sync_to_async
+    в профиль не попадают, а корутины соседних запросов — попадают.
+    """
+    
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.header = getattr(settings, 'PROFILING_HEADER', 'X-Profile')
+    
+    def _wanted(self, request):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(request.headers.get(self.header)) and user is not None and user.is_superuser
+    
+    def handle(self, request):
+        if not self._wanted(request):
             return self.get_response(request)
         
-        if request.user.is_authenticated and not request.user.is_superuser:
-            try:
-                profile = request.user.businessprofile
-                if not profile.is_subscription_valid():
-                    return redirect('blocked')
-            except:
-                pass
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Уже работает другой профилировщик (отладчик, coverage)
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        self._save(request, response, profiler, start)
+        return response
+    
+    async def __acall__(self, request):
+        if not self._wanted(request):
+            return await self.get_response(request)
         
-        return self.get_response(request)
-
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Профилировщик уже включён (в т.ч. соседним запросом в этом же цикле)
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        await sync_to_async(self._save)(request, response, profiler, start)
+        return response
+    
+    def _save(self, request, response, profiler, start):
+        match = request.resolver_match
+        tenant = getattr(request, 'tenant', None)
+        response['X-Profile-Id'] = save_profile(profiler, {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'business_id': tenant.business_id if tenant else None,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+        })
@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-18 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_business(apps, schema_editor):
+    """Order.business = client.business одним UPDATE"""
+    Client = apps.get_model('crm', 'Client')
+    Order = apps.get_model('crm', 'Order')
+    Order.objects.update(
+        business_id=Subquery(Client.objects.filter(pk=OuterRef('client_id')).values('business_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL не даёт менять таблицу (NOT NULL ниже) в одной транзакции
+    # с UPDATE внешнего ключа: отложенные проверки ещё не выполнены
+    atomic = False
+
+    dependencies = [
+        ('crm', '0008_employeeinvitation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['business', '-created_at'], name='client_business_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='crm.businessprofile'),
+        ),
+        migrations.RunPython(copy_business, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='crm.businessprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['business', '-created_at', '-id'], name='order_business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['business', 'status', '-created_at', '-id'], name='order_business_status_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Индексы для поиска клиентов: pg_trgm на PostgreSQL, FTS5 на SQLite
+
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS crm_client_name_trgm ON crm_client USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS crm_client_phone_trgm ON crm_client USING gin (UPPER(phone::text) gin_trgm_ops)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS crm_client_name_trgm',
+    'DROP INDEX IF EXISTS crm_client_phone_trgm',
+]
+
+# Внимание: SQLite пересоздаёт таблицу при ALTER, и триггеры при этом
+# теряются. Миграции, меняющие crm_client, должны повторить SQLITE_FORWARD.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS crm_client_fts USING fts5("
+    "name, phone, content='crm_client', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS crm_client_fts_ai AFTER INSERT ON crm_client BEGIN "
+    "INSERT INTO crm_client_fts(rowid, name, phone) VALUES (new.id, new.name, new.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_client_fts_ad AFTER DELETE ON crm_client BEGIN "
+    "INSERT INTO crm_client_fts(crm_client_fts, rowid, name, phone) VALUES ('delete', old.id, old.name, old.phone); END",
+    "CREATE TRIGGER IF NOT EXISTS crm_client_fts_au AFTER UPDATE OF name, phone ON crm_client BEGIN "
+    "INSERT INTO crm_client_fts(crm_client_fts, rowid, name, phone) VALUES ('delete', old.id, old.name, old.phone); "
+    "INSERT INTO crm_client_fts(rowid, name, phone) VALUES (new.id, new.name, new.phone); END",
+    "INSERT INTO crm_client_fts(crm_client_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS crm_client_fts_ai',
+    'DROP TRIGGER IF EXISTS crm_client_fts_ad',
+    'DROP TRIGGER IF EXISTS crm_client_fts_au',
+    'DROP TABLE IF EXISTS crm_client_fts',
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_order_client_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0 on 2026-10-18 02:43
+
+import django.db.models.deletion
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite пересоздаёт crm_client при добавлении updated_at, и триггеры FTS
+# из 0010 теряются — ставим их заново
+search_index = import_module('crm.migrations.0010_client_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_client_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(
+            search_index._run({'sqlite': search_index.SQLITE_FORWARD}),
+            migrations.RunPython.noop,
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='Дата изменения'),
+        ),
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('clients', 'Клиенты'), ('orders', 'Заявки')], max_length=20, verbose_name='Тип')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Отпечаток данных')),
+                ('rows_total', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('rows_done', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('file', models.CharField(blank=True, max_length=255, verbose_name='Файл')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершение')),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='crm.businessprofile')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='exportjob_queue_idx'), models.Index(fields=['business', 'kind', 'fingerprint'], name='exportjob_cache_idx')],
+            },
+        ),
+    ]
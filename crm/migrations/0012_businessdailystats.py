@@ -0,0 +1,90 @@
+# Generated by Django 6.0 on 2026-10-18 02:46
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.utils.timezone import localdate
+
+
+# Копия crm.rollup на момент миграции: миграция не должна зависеть от
+# того, как этот модуль изменится позже
+STATUS_FIELDS = {
+    'new': 'new_count',
+    'in_progress': 'in_progress_count',
+    'done': 'done_count',
+}
+
+
+def contribution(business_id, state):
+    """Вклад одной заявки: {(business_id, day): {поле: delta}}"""
+    _, status, price, completed_at, created_at = state
+    result = defaultdict(lambda: defaultdict(int))
+    if created_at is None:
+        return result
+
+    field = STATUS_FIELDS.get(status)
+    if field:
+        result[(business_id, localdate(created_at))][field] += 1
+
+    if status == 'done':
+        if price:
+            result[(business_id, localdate(completed_at or created_at))]['revenue'] += price
+        if completed_at:
+            key = (business_id, localdate(completed_at))
+            result[key]['completed_count'] += 1
+            result[key]['completed_seconds'] += int((completed_at - created_at).total_seconds())
+    return result
+
+
+def merge(target, source):
+    for key, fields in source.items():
+        for name, value in fields.items():
+            target[key][name] += value
+
+
+def populate(apps, schema_editor):
+    """Заполняет сводку по уже существующим заявкам"""
+    Order = apps.get_model('crm', 'Order')
+    BusinessDailyStats = apps.get_model('crm', 'BusinessDailyStats')
+
+    rows = defaultdict(lambda: defaultdict(int))
+    orders = Order.objects.values_list(
+        'client__business_id', 'client_id', 'status', 'price', 'completed_at', 'created_at',
+    )
+    for business_id, *state in orders.iterator(chunk_size=2000):
+        merge(rows, contribution(business_id, tuple(state)))
+
+    BusinessDailyStats.objects.bulk_create(
+        [BusinessDailyStats(business_id=business_id, day=day, **fields) for (business_id, day), fields in rows.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusinessDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('new_count', models.IntegerField(default=0, verbose_name='Новые')),
+                ('in_progress_count', models.IntegerField(default=0, verbose_name='В работе')),
+                ('done_count', models.IntegerField(default=0, verbose_name='Завершены')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Доход')),
+                ('completed_count', models.IntegerField(default=0, verbose_name='Завершено с датой')),
+                ('completed_seconds', models.BigIntegerField(default=0, verbose_name='Суммарная длительность, сек.')),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='crm.businessprofile')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('business', 'day')},
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 02:49
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate(apps, schema_editor):
+    """Начальные значения счётчиков по существующим данным"""
+    BusinessProfile = apps.get_model('crm', 'BusinessProfile')
+    Client = apps.get_model('crm', 'Client')
+    Order = apps.get_model('crm', 'Order')
+
+    def count(queryset, business_field):
+        return Coalesce(Subquery(
+            queryset.filter(**{business_field: OuterRef('pk')}).order_by()
+            .values(business_field).annotate(n=Count('pk')).values('n'),
+            output_field=IntegerField(),
+        ), 0)
+
+    BusinessProfile.objects.update(
+        clients_count=count(Client.objects.all(), 'business'),
+        orders_new_count=count(Order.objects.filter(status='new'), 'client__business'),
+        orders_in_progress_count=count(Order.objects.filter(status='in_progress'), 'client__business'),
+        orders_done_count=count(Order.objects.filter(status='done'), 'client__business'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_businessdailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businessprofile',
+            name='clients_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Клиентов'),
+        ),
+        migrations.AddField(
+            model_name='businessprofile',
+            name='orders_done_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Завершённых заявок'),
+        ),
+        migrations.AddField(
+            model_name='businessprofile',
+            name='orders_in_progress_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Заявок в работе'),
+        ),
+        migrations.AddField(
+            model_name='businessprofile',
+            name='orders_new_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Новых заявок'),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
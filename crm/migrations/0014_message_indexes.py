@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_businessprofile_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'is_read'], name='message_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'recipient', 'created_at'], name='message_conversation_idx'),
+        ),
+    ]
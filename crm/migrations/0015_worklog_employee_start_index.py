@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0014_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='worklog',
+            index=models.Index(fields=['employee', 'start_time'], name='worklog_employee_start_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+def close_duplicate_sessions(apps, schema_editor):
+    """
+    Оставляет у сотрудника одну открытую сессию (самую позднюю); старшие
+    закрываются моментом начала следующей, иначе ограничение не создать.
+    """
+    WorkLog = apps.get_model('crm', 'WorkLog')
+    open_logs = WorkLog.objects.filter(end_time__isnull=True).order_by('employee_id', '-start_time')
+    previous = None
+    for log in open_logs.iterator():
+        if previous is not None and previous.employee_id == log.employee_id:
+            log.end_time = previous.start_time
+            log.save(update_fields=['end_time'])
+        previous = log
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0015_worklog_employee_start_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='worklog',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_time__isnull', True)), fields=('employee',), name='worklog_one_open_session'),
+        ),
+    ]
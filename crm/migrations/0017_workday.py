@@ -0,0 +1,86 @@
+# Generated by Django 6.0 on 2026-10-18 02:59
+
+import crm.models
+import django.db.models.deletion
+import zoneinfo
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Копия crm.timesheet на момент миграции: миграция не должна зависеть от
+# того, как этот модуль изменится позже
+def zone(name):
+    return zoneinfo.ZoneInfo(name or settings.TIME_ZONE)
+
+
+def split_by_day(start, end, tz):
+    """{день: секунды} для [start, end), разрезанного по полуночам в поясе tz"""
+    result = defaultdict(int)
+    cursor = start
+    while cursor < end:
+        day = cursor.astimezone(tz).date()
+        midnight = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+        boundary = min(end, midnight)
+        elapsed = boundary.astimezone(dt_timezone.utc) - cursor.astimezone(dt_timezone.utc)
+        result[day] += int(elapsed.total_seconds())
+        cursor = boundary
+    return result
+
+
+def contribution(state, tz):
+    """Вклад завершённой сессии: {(employee_id, day): секунды}"""
+    employee_id, start, end = state
+    if end is None or start is None:
+        return {}
+    return {(employee_id, day): seconds for day, seconds in split_by_day(start, end, tz).items()}
+
+
+def populate(apps, schema_editor):
+    """Заполняет табель по уже завершённым сессиям"""
+    WorkLog = apps.get_model('crm', 'WorkLog')
+    WorkDay = apps.get_model('crm', 'WorkDay')
+
+    rows = defaultdict(int)
+    sessions = WorkLog.objects.filter(end_time__isnull=False).values_list(
+        'employee_id', 'start_time', 'end_time', 'employee__business__timezone',
+    )
+    for employee_id, start, end, tz_name in sessions.iterator(chunk_size=2000):
+        for key, seconds in contribution((employee_id, start, end), zone(tz_name)).items():
+            rows[key] += seconds
+
+    WorkDay.objects.bulk_create(
+        [WorkDay(employee_id=employee_id, day=day, seconds=seconds) for (employee_id, day), seconds in rows.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0016_worklog_one_open_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businessprofile',
+            name='timezone',
+            field=models.CharField(blank=True, max_length=64, validators=[crm.models.validate_timezone], verbose_name='Часовой пояс'),
+        ),
+        migrations.CreateModel(
+            name='WorkDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('seconds', models.BigIntegerField(default=0, verbose_name='Отработано, сек.')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='work_days', to='crm.employee')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('employee', 'day')},
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
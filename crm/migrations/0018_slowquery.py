@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0017_workday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(db_index=True, max_length=32, verbose_name='Отпечаток')),
+                ('sql', models.TextField(verbose_name='SQL без параметров')),
+                ('params_shape', models.CharField(blank=True, max_length=500, verbose_name='Параметры')),
+                ('duration_ms', models.FloatField(verbose_name='Длительность, мс')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='View')),
+                ('business_id', models.IntegerField(blank=True, null=True, verbose_name='ID бизнеса')),
+                ('stack', models.TextField(blank=True, verbose_name='Стек')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+    ]
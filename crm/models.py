@@ -1,7 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.contrib.auth.models import User
 import uuid
 import secrets
+import zoneinfo
+
+
+def validate_timezone(value):
+    if value and value not in zoneinfo.available_timezones():
+        raise ValidationError(f'Неизвестный часовой пояс: {value}')
 
 
 class BusinessProfile(models.Model):
@@ -18,14 +26,40 @@ class BusinessProfile(models.Model):
     is_active = models.BooleanField('Активен', default=False)
     subscription_end = models.DateField('Подписка до', null=True, blank=True)
     phone = models.CharField('Телефон', max_length=50, blank=True)
+    # Границы рабочих дней в табеле; пусто — settings.TIME_ZONE
+    timezone = models.CharField('Часовой пояс', max_length=64, blank=True, validators=[validate_timezone])
     notes = models.TextField('Заметки админа', blank=True)
     created_at = models.DateTimeField('Дата регистрации', auto_now_add=True)
     # Максимальное число сотрудников для этого бизнеса (по умолчанию 20)
     max_employees = models.PositiveIntegerField('Максимум сотрудников', default=20)
     
+    # Денормализованные счётчики для главной страницы (см. crm/counters.py,
+    # восстановление — команда repair_counters)
+    clients_count = models.IntegerField('Клиентов', default=0, editable=False)
+    orders_new_count = models.IntegerField('Новых заявок', default=0, editable=False)
+    orders_in_progress_count = models.IntegerField('Заявок в работе', default=0, editable=False)
+    orders_done_count = models.IntegerField('Завершённых заявок', default=0, editable=False)
+    
+    COUNTER_FIELDS = ('clients_count', 'orders_new_count', 'orders_in_progress_count', 'orders_done_count')
+    
     def __str__(self):
         return self.business_name
     
+    def save(self, *args, **kwargs):
+        # Счётчики меняются только через F()-обновления: обычное сохранение
+        # профиля не должно затирать их значениями, прочитанными раньше
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
+    @property
+    def tzinfo(self):
+        """Пояс бизнеса для границ рабочих дней"""
+        return zoneinfo.ZoneInfo(self.timezone or settings.TIME_ZONE)
+    
     def is_subscription_valid(self):
         from datetime import date
         if not self.is_active:
@@ -42,12 +76,25 @@ class Client(models.Model):
     phone = models.CharField('Телефон', max_length=50)
     notes = models.TextField('Заметки', blank=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, null=True)
     
     def __str__(self):
         return f"{self.name} ({self.phone})"
     
+    def save(self, *args, **kwargs):
+        # Счётчики бизнеса обновляются сигналами в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['business', '-created_at'], name='client_business_created_idx'),
+        ]
 
 
 class Order(models.Model):
@@ -59,17 +106,40 @@ class Order(models.Model):
     ]
     
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='orders')
+    # Копия client.business: список заявок бизнеса фильтруется и
+    # сортируется по одному индексу, без JOIN с клиентами. Отдельный
+    # индекс не нужен — business первым стоит в составных индексах ниже
+    business = models.ForeignKey(
+        BusinessProfile, on_delete=models.CASCADE, related_name='orders', editable=False, db_index=False,
+    )
     service = models.CharField('Услуга', max_length=200)
     status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='new')
     price = models.DecimalField('Цена', max_digits=10, decimal_places=2, null=True, blank=True)
     completed_at = models.DateTimeField('Дата завершения', null=True, blank=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True, null=True)
     
     def __str__(self):
         return f"{self.service} - {self.client.name}"
     
+    def save(self, *args, **kwargs):
+        self.business_id = self.client.business_id
+        # Сводка и счётчики бизнеса обновляются сигналами в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # order_list: заявки бизнеса и keyset-пагинация по (created_at, id)
+            models.Index(fields=['business', '-created_at', '-id'], name='order_business_created_idx'),
+            # Фильтр по статусу с той же сортировкой
+            models.Index(fields=['business', 'status', '-created_at', '-id'], name='order_business_status_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -124,6 +194,12 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Непрочитанные входящие (счётчики во входящих)
+            models.Index(fields=['recipient', 'is_read'], name='message_unread_idx'),
+            # Переписка пары сотрудников по времени (последнее сообщение, история)
+            models.Index(fields=['sender', 'recipient', 'created_at'], name='message_conversation_idx'),
+        ]
 
 class WorkLog(models.Model):
     """Логирование времени работы сотрудника"""
@@ -151,6 +227,19 @@ class WorkLog(models.Model):
     
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            # Отчёты по диапазонам start_time и история сотрудника
+            models.Index(fields=['employee', 'start_time'], name='worklog_employee_start_idx'),
+        ]
+        constraints = [
+            # Не больше одной открытой сессии на сотрудника; заодно индекс
+            # для поиска открытой сессии
+            models.UniqueConstraint(
+                fields=['employee'],
+                condition=models.Q(end_time__isnull=True),
+                name='worklog_one_open_session',
+            ),
+        ]
 
 
 class EmployeeInvitation(models.Model):
@@ -181,4 +270,115 @@ class EmployeeInvitation(models.Model):
     
     class Meta:
         ordering = ['-created_at']
-        unique_together = ['business', 'email']
\ No newline at end of file
+        unique_together = ['business', 'email']
+
+
+class ExportJob(models.Model):
+    """Фоновая задача экспорта (очередь в БД, обрабатывается run_export_worker)"""
+    KIND_CHOICES = [
+        ('clients', 'Клиенты'),
+        ('orders', 'Заявки'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    business = models.ForeignKey(BusinessProfile, on_delete=models.CASCADE, related_name='export_jobs')
+    kind = models.CharField('Тип', max_length=20, choices=KIND_CHOICES)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Отпечаток данных бизнеса на момент постановки в очередь
+    fingerprint = models.CharField('Отпечаток данных', max_length=64)
+    rows_total = models.PositiveIntegerField('Всего строк', default=0)
+    rows_done = models.PositiveIntegerField('Обработано строк', default=0)
+    file = models.CharField('Файл', max_length=255, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    started_at = models.DateTimeField('Начало', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершение', null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+    
+    @property
+    def progress(self):
+        """Процент выполнения"""
+        if self.status == 'done':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, int(self.rows_done * 100 / self.rows_total))
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_queue_idx'),
+            models.Index(fields=['business', 'kind', 'fingerprint'], name='exportjob_cache_idx'),
+        ]
+
+
+class BusinessDailyStats(models.Model):
+    """
+    Дневная сводка по заявкам бизнеса (поддерживается сигналами Order,
+    пересчитывается командой rebuild_stats).
+
+    Счётчики по статусам относятся к дню создания заявки, доход — к дню
+    завершения (или создания, если дата завершения не указана),
+    длительности — к дню завершения.
+    """
+    business = models.ForeignKey(BusinessProfile, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField('День')
+    new_count = models.IntegerField('Новые', default=0)
+    in_progress_count = models.IntegerField('В работе', default=0)
+    done_count = models.IntegerField('Завершены', default=0)
+    revenue = models.DecimalField('Доход', max_digits=14, decimal_places=2, default=0)
+    completed_count = models.IntegerField('Завершено с датой', default=0)
+    completed_seconds = models.BigIntegerField('Суммарная длительность, сек.', default=0)
+    
+    def __str__(self):
+        return f"{self.business} {self.day}"
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['business', 'day']
+
+class WorkDay(models.Model):
+    """
+    Табель: отработанное сотрудником время за календарный день в поясе
+    бизнеса. Сессия через полночь делится между днями. Учитываются только
+    завершённые сессии (crm/timesheet.py), пересчёт — rebuild_timesheet.
+    """
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='work_days')
+    day = models.DateField('День')
+    seconds = models.BigIntegerField('Отработано, сек.', default=0)
+    
+    def __str__(self):
+        return f"{self.employee} {self.day}"
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['employee', 'day']
+
+
+class SlowQuery(models.Model):
+    """
+    Медленный SQL-запрос (дольше SLOW_QUERY_MS) с view и бизнесом, из
+    которых он пришёл. Таблица ограничена SLOW_QUERY_KEEP строками,
+    старые удаляются при записи новых (crm/slowlog.py).
+    """
+    fingerprint = models.CharField('Отпечаток', max_length=32, db_index=True)
+    sql = models.TextField('SQL без параметров')
+    params_shape = models.CharField('Параметры', max_length=500, blank=True)
+    duration_ms = models.FloatField('Длительность, мс')
+    view = models.CharField('View', max_length=200, blank=True)
+    business_id = models.IntegerField('ID бизнеса', null=True, blank=True)
+    stack = models.TextField('Стек', blank=True)
+    created_at = models.DateTimeField('Время', auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.view} {self.duration_ms} мс"
+    
+    class Meta:
+        ordering = ['-id']
@@ -0,0 +1,81 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(created_at, pk):
+    """Курсор вида base64('<created_at>|<id>')"""
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор; при ошибке возвращает None (первая страница)"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """Страница keyset-пагинации по (<поле даты>, id) в порядке убывания"""
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_paginate(queryset, cursor, per_page=50, field='created_at'):
+    """
+    Возвращает страницу после курсора без OFFSET.
+
+    Запрос всегда читает не больше per_page + 1 строк, поэтому время
+    ответа не зависит от номера страницы и общего числа записей.
+    field — поле даты, по которому сортируются записи (вместе с id).
+    """
+    position = decode_cursor(cursor)
+    rows = list(_after(queryset, position, field)[:per_page + 1])
+    return _page(rows, position, per_page, field)
+
+
+async def akeyset_paginate(queryset, cursor, per_page=50, field='created_at'):
+    """keyset_paginate для async-views"""
+    position = decode_cursor(cursor)
+    rows = [row async for row in _after(queryset, position, field)[:per_page + 1]]
+    return _page(rows, position, per_page, field)
+
+
+def _after(queryset, position, field):
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if position:
+        value, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+        )
+    return queryset
+
+
+def _page(rows, position, per_page, field):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+
+    return KeysetPage(rows, next_cursor, is_first=position is None)
@@ -0,0 +1,123 @@
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Сколько функций показывать на странице профиля
+TOP_FUNCTIONS = 40
+SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}
+
+_PROFILE_ID = re.compile(r'^[0-9]{19}-[0-9a-f]{8}$')
+
+
+def profile_root():
+    return Path(settings.PROFILE_ROOT)
+
+
+def _new_profile_id():
+    # Время в начале имени: сортировка по имени = по времени записи
+    return f'{time.time_ns():019d}-{uuid.uuid4().hex[:8]}'
+
+
+def profile_path(profile_id, suffix='.prof'):
+    """Путь к файлу профиля; None для некорректного id (защита от ../)"""
+    if not _PROFILE_ID.match(profile_id or ''):
+        return None
+    return profile_root() / f'{profile_id}{suffix}'
+
+
+def _write_atomic(path, write):
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def save_profile(profiler, meta, keep=None):
+    """
+    Сохраняет cProfile в кольцевой буфер PROFILE_ROOT: .prof (формат
+    pstats) и .json с метаданными. Файлы пишутся через rename, поэтому
+    несколько воркеров не видят недописанных профилей. Возвращает id.
+    """
+    root = profile_root()
+    root.mkdir(parents=True, exist_ok=True)
+    profile_id = _new_profile_id()
+    meta = {**meta, 'id': profile_id, 'created_at': time.time()}
+
+    _write_atomic(profile_path(profile_id), lambda path: profiler.dump_stats(str(path)))
+    _write_atomic(
+        profile_path(profile_id, '.json'),
+        lambda path: path.write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8'),
+    )
+    prune(keep if keep is not None else settings.PROFILE_KEEP)
+    return profile_id
+
+
+def _profile_ids():
+    root = profile_root()
+    if not root.is_dir():
+        return []
+    return sorted(path.stem for path in root.glob('*.json') if _PROFILE_ID.match(path.stem))
+
+
+def prune(keep):
+    """Удаляет самые старые профили сверх keep"""
+    ids = _profile_ids()
+    for profile_id in ids[:max(len(ids) - keep, 0)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                profile_path(profile_id, suffix).unlink()
+            except FileNotFoundError:
+                # Уже удалил соседний воркер
+                pass
+
+
+def load_meta(profile_id):
+    path = profile_path(profile_id, '.json')
+    if path is None:
+        return None
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def list_profiles():
+    """Метаданные сохранённых профилей, сначала новые"""
+    profiles = []
+    for profile_id in reversed(_profile_ids()):
+        meta = load_meta(profile_id)
+        if meta is not None:
+            profiles.append(meta)
+    return profiles
+
+
+def top_functions(profile_id, sort='cumulative', limit=TOP_FUNCTIONS):
+    """
+    Самые дорогие функции профиля:
+    [{'function', 'calls', 'tottime', 'cumtime'}] по убыванию sort;
+    None, если .prof уже удалён (prune соседнего воркера).
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        return None
+    try:
+        stats = pstats.Stats(str(path))
+    except FileNotFoundError:
+        return None
+    column = SORT_KEYS.get(sort, SORT_KEYS['cumulative'])
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:limit]
+    return [
+        {
+            'function': pstats.func_std_string(func),
+            'calls': calls,
+            'tottime': round(tottime * 1000, 2),
+            'cumtime': round(cumtime * 1000, 2),
+        }
+        for func, (_, calls, tottime, cumtime, _) in rows
+    ]
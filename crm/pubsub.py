@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class InProcessPubSub:
+    """
+    Уведомления внутри одного процесса. Публиковать можно из любого
+    потока (синхронные view), подписчики ждут в своём event loop.
+    Подходит для одного воркера; для нескольких — DatabasePollingPubSub
+    или собственный бэкенд (Redis и т.п.) с тем же интерфейсом.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Цикл подписчика уже закрыт
+                pass
+
+    def subscribe(self, channel):
+        """Асинхронный контекстный менеджер подписки на канал"""
+        return _Subscription(self, channel)
+
+    def _add(self, channel, entry):
+        with self._lock:
+            self._subscribers[channel].add(entry)
+
+    def _remove(self, channel, entry):
+        with self._lock:
+            self._subscribers[channel].discard(entry)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+
+class _Subscription:
+    def __init__(self, pubsub, channel):
+        self._pubsub = pubsub
+        self._channel = channel
+        self._entry = None
+
+    async def __aenter__(self):
+        self._entry = (asyncio.get_running_loop(), asyncio.Event())
+        self._pubsub._add(self._channel, self._entry)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._pubsub._remove(self._channel, self._entry)
+
+    async def wait(self, timeout):
+        """True — было уведомление, False — истёк таймаут"""
+        event = self._entry[1]
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+
+class DatabasePollingPubSub:
+    """
+    Бэкенд без общей шины: подписчик просто просыпается каждые
+    CHAT_POLL_INTERVAL секунд и перечитывает БД. Работает при любом
+    числе воркеров ценой задержки до интервала опроса.
+    """
+
+    def __init__(self):
+        self.interval = getattr(settings, 'CHAT_POLL_INTERVAL', 2.0)
+
+    def publish(self, channel):
+        pass
+
+    def subscribe(self, channel):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def wait(self, timeout):
+        await asyncio.sleep(min(self.interval, timeout))
+        return True
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_pubsub():
+    """Бэкенд из settings.CHAT_PUBSUB_BACKEND (один на процесс)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.CHAT_PUBSUB_BACKEND)()
+    return _backend
+
+
+def employee_channel(employee_id):
+    return f'chat:{employee_id}'
+
+
+def notify_employee(employee_id):
+    get_pubsub().publish(employee_channel(employee_id))
@@ -0,0 +1,89 @@
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    «Форма» запроса: литералы и списки IN (%s, %s, ...) сворачиваются,
+    чтобы одинаковые запросы с разными параметрами совпадали.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def app_stack(limit=8):
+    """
+    Последние limit кадров кода проекта (без Django, библиотек и самого
+    счётчика) — откуда в views/модулях пришёл запрос.
+    """
+    root = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(root)
+        and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return ''.join(traceback.format_list(frames[-limit:]))
+
+
+class QueryStats:
+    """
+    Счётчик запросов для connection.execute_wrapper: число запросов,
+    суммарное время в БД и повторы одинаковых по форме запросов.
+    Запросы дольше slow_threshold секунд (если задан) копятся в slow
+    как (sql, params, many, секунды, стек).
+    """
+
+    def __init__(self, slow_threshold=None, stack_depth=8):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.slow_threshold = slow_threshold
+        self.stack_depth = stack_depth
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.duration += elapsed
+            self.count += 1
+            self.shapes[fingerprint(sql)] += 1
+            if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+                self.slow.append((sql, params, many, elapsed, app_stack(self.stack_depth)))
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+    @property
+    def duplicates(self):
+        """{форма запроса: сколько раз выполнен}, только повторявшиеся"""
+        return {shape: n for shape, n in self.shapes.items() if n > 1}
+
+    @contextmanager
+    def record(self):
+        """
+        Подключает счётчик ко всем соединениям на время блока
+        (как assertNumQueries, но без DEBUG и без хранения SQL).
+        """
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
@@ -0,0 +1,165 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.timezone import localdate
+
+from .models import BusinessDailyStats, Client, Order
+
+
+STATUS_FIELDS = {
+    'new': 'new_count',
+    'in_progress': 'in_progress_count',
+    'done': 'done_count',
+}
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def order_state(order):
+    """Поля заявки, от которых зависит её вклад в сводку"""
+    return (order.client_id, order.status, order.price, order.completed_at, order.created_at)
+
+
+def contribution(business_id, state):
+    """
+    Вклад одной заявки: {(business_id, day): {поле: delta}}.
+    Правила те же, что в rebuild_business_stats.
+    """
+    _, status, price, completed_at, created_at = state
+    result = defaultdict(lambda: defaultdict(int))
+    if created_at is None:
+        return result
+
+    field = STATUS_FIELDS.get(status)
+    if field:
+        result[(business_id, localdate(created_at))][field] += 1
+
+    if status == 'done':
+        if price:
+            result[(business_id, localdate(completed_at or created_at))]['revenue'] += price
+        if completed_at:
+            key = (business_id, localdate(completed_at))
+            result[key]['completed_count'] += 1
+            result[key]['completed_seconds'] += int((completed_at - created_at).total_seconds())
+    return result
+
+
+def apply_deltas(deltas, create=True):
+    """
+    Прибавляет дельты к строкам сводки атомарными UPDATE ... SET x = x + d.
+    Строка создаётся только при create=True: при удалении заявки её строка
+    уже есть (или удаляется каскадом вместе с бизнесом).
+    """
+    with transaction.atomic():
+        for (business_id, day), fields in deltas.items():
+            changes = {name: F(name) + value for name, value in fields.items() if value}
+            if not changes:
+                continue
+            rows = BusinessDailyStats.objects.filter(business_id=business_id, day=day)
+            if not rows.update(**changes) and create:
+                BusinessDailyStats.objects.get_or_create(business_id=business_id, day=day)
+                rows.update(**changes)
+
+
+def merge(target, source, sign=1):
+    for key, fields in source.items():
+        for name, value in fields.items():
+            target[key][name] += sign * value
+
+
+def business_id_for_client(client_id, order=None):
+    """business_id клиента, по возможности без запроса"""
+    if order is not None and order.client_id == client_id and Order.client.is_cached(order):
+        return order.client.business_id
+    return Client.objects.filter(pk=client_id).values_list('business_id', flat=True).first()
+
+
+def order_changed(order, old_state):
+    """Пересчитывает вклад изменённой (или новой) заявки"""
+    new_state = order_state(order)
+    if new_state == old_state:
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old_state is not None:
+        merge(deltas, contribution(business_id_for_client(old_state[0], order), old_state), sign=-1)
+    merge(deltas, contribution(business_id_for_client(order.client_id, order), new_state))
+    apply_deltas(deltas)
+
+
+def order_deleted(order, old_state):
+    """Убирает вклад удалённой заявки"""
+    if old_state is None:
+        return
+    business_id = business_id_for_client(old_state[0], order)
+    if business_id is None:
+        # Бизнес удалён целиком — его сводка удалена каскадом
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    merge(deltas, contribution(business_id, old_state), sign=-1)
+    apply_deltas(deltas, create=False)
+
+
+def rebuild_business_stats(business_ids=None):
+    """
+    Полный пересчёт сводки тремя GROUP BY-запросами и bulk_create.
+    business_ids=None — для всех бизнесов.
+    """
+    orders = Order.objects.all()
+    if business_ids is not None:
+        orders = orders.filter(business_id__in=business_ids)
+
+    rows = defaultdict(lambda: defaultdict(int))
+
+    by_created = (
+        orders.annotate(day=TruncDate('created_at'))
+        .values('business_id', 'day')
+        .annotate(
+            new_count=Count('id', filter=Q(status='new')),
+            in_progress_count=Count('id', filter=Q(status='in_progress')),
+            done_count=Count('id', filter=Q(status='done')),
+        )
+    )
+    for item in by_created:
+        key = (item['business_id'], item['day'])
+        for name in ('new_count', 'in_progress_count', 'done_count'):
+            rows[key][name] += item[name]
+
+    by_revenue_day = (
+        orders.filter(status='done', price__isnull=False)
+        .annotate(day=TruncDate(Coalesce('completed_at', 'created_at')))
+        .values('business_id', 'day')
+        .annotate(revenue=Sum('price'))
+    )
+    for item in by_revenue_day:
+        rows[(item['business_id'], item['day'])]['revenue'] += item['revenue'] or Decimal('0')
+
+    by_completed = (
+        orders.filter(status='done', completed_at__isnull=False)
+        .annotate(day=TruncDate('completed_at'))
+        .values('business_id', 'day')
+        .annotate(
+            completed_count=Count('id'),
+            completed_duration=Sum(ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField())),
+        )
+    )
+    for item in by_completed:
+        key = (item['business_id'], item['day'])
+        rows[key]['completed_count'] += item['completed_count']
+        rows[key]['completed_seconds'] += int(item['completed_duration'].total_seconds())
+
+    with transaction.atomic():
+        existing = BusinessDailyStats.objects.all()
+        if business_ids is not None:
+            existing = existing.filter(business_id__in=business_ids)
+        existing.delete()
+        BusinessDailyStats.objects.bulk_create(
+            [
+                BusinessDailyStats(business_id=business_id, day=day, **fields)
+                for (business_id, day), fields in rows.items()
+            ],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+    return len(rows)
@@ -0,0 +1,30 @@
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+# Триграммный токенайзер FTS5 не находит подстроки короче трёх символов
+FTS_MIN_LENGTH = 3
+
+
+def search_clients(queryset, term):
+    """
+    Поиск клиентов по имени или телефону.
+
+    PostgreSQL: обычный icontains, его обслуживает GIN-индекс pg_trgm
+    по UPPER(name) / UPPER(phone) (миграция 0010).
+    SQLite: теневая таблица FTS5 crm_client_fts с триграммным токенайзером,
+    которую поддерживают триггеры на crm_client.
+    """
+    term = term.strip()
+    if not term:
+        return queryset
+
+    if connection.vendor == 'sqlite' and len(term) >= FTS_MIN_LENGTH:
+        phrase = '"%s"' % term.replace('"', '""')
+        return queryset.filter(id__in=RawSQL(
+            'SELECT rowid FROM crm_client_fts WHERE crm_client_fts MATCH %s',
+            (phrase,),
+        ))
+
+    return queryset.filter(Q(name__icontains=term) | Q(phone__icontains=term))
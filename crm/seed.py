@@ -0,0 +1,223 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_generation
+from .counters import repair_counters
+from .models import BusinessProfile, Client, Comment, Employee, Message, Order, WorkLog
+from .rollup import rebuild_business_stats
+from .timesheet import rebuild_timesheet
+
+
+SEED_BATCH_SIZE = 1000
+
+FIRST_NAMES = ['Аман', 'Мерген', 'Айна', 'Огулджан', 'Сердар', 'Лейли', 'Иван', 'Мария', 'Алексей', 'Ольга', 'Дмитрий', 'Наталья']
+LAST_NAMES = ['Аманов', 'Бердыев', 'Гельдыева', 'Оразов', 'Иванов', 'Петрова', 'Сидоров', 'Кузнецова', 'Смирнов', 'Попова']
+SERVICES = ['Ремонт телефона', 'Замена экрана', 'Диагностика', 'Чистка ноутбука', 'Установка ПО', 'Доставка', 'Консультация', 'Гарантийный ремонт']
+COMMENTS = ['Клиент перезвонит', 'Ждём запчасть', 'Согласовано с клиентом', 'Готово к выдаче', 'Нужна предоплата']
+MESSAGES = ['Привет!', 'Клиент пришёл', 'Посмотри заявку', 'Готово', 'Созвонимся?', 'Запчасть приехала', 'Ок']
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Временно отключает auto_now_add у created_at, чтобы bulk_create
+    сохранил сгенерированные даты (только для команд, не для веб-процесса).
+    """
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _past(rng, now, days, skew=2.0):
+    """Момент за последние days дней; skew > 1 — чаще недавние"""
+    return now - timedelta(days=days * rng.random() ** skew, seconds=rng.randrange(86400))
+
+
+def _count(rng, mean):
+    """Неотрицательное целое с экспоненциальным распределением и средним mean"""
+    return int(rng.expovariate(1 / mean)) if mean > 0 else 0
+
+
+def _name(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _order_fields(rng, now, created_at):
+    age = now - created_at
+    if age > timedelta(days=14):
+        status = rng.choices(['done', 'in_progress', 'new'], weights=[90, 7, 3])[0]
+    else:
+        status = rng.choices(['new', 'in_progress', 'done'], weights=[40, 35, 25])[0]
+    price = Decimal(round(rng.lognormvariate(7, 0.8), -1)) if rng.random() < 0.9 else None
+    completed_at = None
+    if status == 'done':
+        completed_at = min(now, created_at + timedelta(hours=rng.expovariate(1 / 72)))
+    return {'status': status, 'price': price, 'completed_at': completed_at}
+
+
+def _seed_clients(rng, profile, now, options, stats):
+    phone_base = 60000000 + profile.pk * 100000
+    remaining = options['clients']
+    while remaining > 0:
+        size = min(remaining, SEED_BATCH_SIZE)
+        remaining -= size
+
+        clients = []
+        for i in range(size):
+            first, last = _name(rng)
+            clients.append(Client(
+                business=profile,
+                name=f'{first} {last}',
+                phone=f'+993 {phone_base + stats["clients"] + i}',
+                notes=rng.choice(['', '', '', 'Постоянный клиент', 'Оптовик']),
+                created_at=_past(rng, now, options['days']),
+            ))
+        Client.objects.bulk_create(clients, batch_size=SEED_BATCH_SIZE)
+        stats['clients'] += len(clients)
+
+        orders = []
+        for client in clients:
+            for _ in range(_count(rng, options['orders_per_client'])):
+                created_at = client.created_at + (now - client.created_at) * rng.random()
+                orders.append(Order(
+                    client=client,
+                    business_id=client.business_id,
+                    service=rng.choice(SERVICES),
+                    created_at=created_at,
+                    **_order_fields(rng, now, created_at),
+                ))
+        Order.objects.bulk_create(orders, batch_size=SEED_BATCH_SIZE)
+        stats['orders'] += len(orders)
+
+        comments = [
+            Comment(order=order, text=rng.choice(COMMENTS),
+                    created_at=order.created_at + timedelta(hours=rng.expovariate(1 / 24)))
+            for order in orders
+            for _ in range(_count(rng, options['comments_per_order']))
+        ]
+        Comment.objects.bulk_create(comments, batch_size=SEED_BATCH_SIZE)
+        stats['comments'] += len(comments)
+
+
+def _seed_employees(rng, profile, owner, count, stats):
+    employees = [Employee(
+        business=profile, user=owner, first_name=owner.username, last_name='',
+        role='admin', email=owner.email,
+    )]
+    for _ in range(count - 1):
+        first, last = _name(rng)
+        employees.append(Employee(
+            business=profile, first_name=first, last_name=last,
+            role=rng.choices(['manager', 'specialist'], weights=[20, 80])[0],
+        ))
+    Employee.objects.bulk_create(employees)
+    stats['employees'] += len(employees)
+    return employees
+
+
+def _seed_messages(rng, employees, now, count, stats):
+    if len(employees) < 2:
+        return
+    # Переписка неравномерна: первые сотрудники пишут намного чаще
+    weights = [1 / (rank + 1) for rank in range(len(employees))]
+    remaining = count
+    while remaining > 0:
+        size = min(remaining, SEED_BATCH_SIZE)
+        remaining -= size
+        batch = []
+        for _ in range(size):
+            sender, recipient = rng.choices(employees, weights=weights, k=2)
+            if sender is recipient:
+                recipient = employees[(employees.index(sender) + 1) % len(employees)]
+            created_at = _past(rng, now, 90)
+            batch.append(Message(
+                sender=sender, recipient=recipient, text=rng.choice(MESSAGES),
+                is_read=now - created_at > timedelta(days=1), created_at=created_at,
+            ))
+        # id растёт вместе со временем, как у настоящих сообщений
+        batch.sort(key=lambda message: message.created_at)
+        Message.objects.bulk_create(batch, batch_size=SEED_BATCH_SIZE)
+        stats['messages'] += len(batch)
+
+
+def _seed_work_logs(rng, employees, now, days, stats):
+    tz = timezone.get_current_timezone()
+    today = timezone.localdate()
+    batch = []
+    for employee in employees:
+        for offset in range(days, 0, -1):
+            day = today - timedelta(days=offset)
+            if day.weekday() >= 5 or rng.random() < 0.1:
+                continue
+            # Изредка ночная смена, переходящая через полночь
+            hour = 20 if rng.random() < 0.05 else rng.uniform(8, 10)
+            start = datetime.combine(day, time.min, tzinfo=tz) + timedelta(hours=hour)
+            end = start + timedelta(hours=rng.gauss(8, 1))
+            batch.append(WorkLog(employee=employee, start_time=start, end_time=min(end, now), created_at=start))
+            if len(batch) >= SEED_BATCH_SIZE:
+                WorkLog.objects.bulk_create(batch)
+                stats['work_logs'] += len(batch)
+                batch = []
+    WorkLog.objects.bulk_create(batch)
+    stats['work_logs'] += len(batch)
+
+
+def seed_load(tenants=1, clients=1000, orders_per_client=3.0, comments_per_order=0.5,
+              employees=10, messages=2000, work_days=90, days=365,
+              prefix='load', password='load12345', seed=None):
+    """
+    Синтетические данные для нагрузочных замеров: tenants бизнесов, у
+    каждого clients клиентов, заявки/комментарии/сообщения/рабочие сессии
+    с правдоподобными распределениями. Всё пишется bulk_create, поэтому
+    сводки, счётчики и табель затем пересчитываются целиком.
+    Возвращает (имена пользователей, статистика).
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    options = {
+        'clients': clients, 'orders_per_client': orders_per_client,
+        'comments_per_order': comments_per_order, 'days': days,
+    }
+    stats = dict.fromkeys(['tenants', 'clients', 'orders', 'comments', 'employees', 'messages', 'work_logs'], 0)
+    hashed_password = make_password(password)
+    start = User.objects.filter(username__startswith=f'{prefix}-').count() + 1
+
+    usernames, business_ids = [], []
+    with explicit_timestamps(Client, Order, Comment, Message, WorkLog):
+        for number in range(start, start + tenants):
+            with transaction.atomic():
+                owner = User.objects.create(
+                    username=f'{prefix}-{number}', email=f'{prefix}-{number}@example.com',
+                    password=hashed_password,
+                )
+                profile = BusinessProfile.objects.create(
+                    user=owner, business_name=f'Нагрузка {number}', is_active=True,
+                )
+                _seed_clients(rng, profile, now, options, stats)
+                staff = _seed_employees(rng, profile, owner, max(employees, 1), stats)
+                _seed_messages(rng, staff, now, messages, stats)
+                _seed_work_logs(rng, staff, now, work_days, stats)
+            usernames.append(owner.username)
+            business_ids.append(profile.pk)
+            stats['tenants'] += 1
+
+    # bulk_create не шлёт сигналы: сводки, счётчики, табель и кэш — вручную
+    rebuild_business_stats(business_ids)
+    repair_counters(business_ids)
+    rebuild_timesheet(business_ids)
+    for business_id in business_ids:
+        bump_generation(business_id)
+
+    return usernames, stats
@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import counters, rollup, timesheet
+from .cache import bump_generation
+from .models import BusinessProfile, Client, Employee, Message, Order, WorkLog
+from .pubsub import notify_employee
+from .tenant import invalidate_tenant
+
+
+@receiver(post_init, sender=Order)
+def remember_order_state(sender, instance, **kwargs):
+    """Запоминаем состояние заявки при загрузке, чтобы считать дельты"""
+    instance._stats_state = rollup.order_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Order)
+def update_stats_on_order_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_state = None if created else instance._stats_state
+    rollup.order_changed(instance, old_state)
+
+    old_status = old_state[1] if old_state else None
+    if old_status != instance.status:
+        business_id = rollup.business_id_for_client(instance.client_id, instance)
+        counters.add(business_id, **counters.status_deltas(old_status, instance.status))
+
+    instance._stats_state = rollup.order_state(instance)
+
+
+@receiver(post_delete, sender=Order)
+def update_stats_on_order_delete(sender, instance, **kwargs):
+    old_state = instance._stats_state
+    rollup.order_deleted(instance, old_state)
+    if old_state:
+        business_id = rollup.business_id_for_client(old_state[0], instance)
+        counters.add(business_id, **counters.status_deltas(old_state[1], None))
+
+
+@receiver(post_save, sender=Client)
+def count_client_on_save(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.add(instance.business_id, clients_count=1)
+
+
+@receiver(post_delete, sender=Client)
+def count_client_on_delete(sender, instance, **kwargs):
+    counters.add(instance.business_id, clients_count=-1)
+
+
+@receiver(post_init, sender=WorkLog)
+def remember_session_state(sender, instance, **kwargs):
+    instance._timesheet_state = timesheet.session_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=WorkLog)
+def update_timesheet_on_session_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    timesheet.session_changed(instance, instance._timesheet_state)
+    instance._timesheet_state = timesheet.session_state(instance)
+
+
+@receiver(post_delete, sender=WorkLog)
+def update_timesheet_on_session_delete(sender, instance, **kwargs):
+    timesheet.session_deleted(instance, instance._timesheet_state)
+
+
+# Инвалидация кэша аналитики. Обработчики подключены после обновления
+# сводки, а поколение меняется только после коммита, чтобы параллельный
+# запрос не закэшировал старые цифры под новым поколением.
+
+def _bump_after_commit(business_id):
+    if business_id is not None:
+        transaction.on_commit(lambda: bump_generation(business_id))
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_business_cache(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_after_commit(instance.business_id)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_business_cache_for_order(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_after_commit(rollup.business_id_for_client(instance.client_id, instance))
+
+
+@receiver(post_save, sender=BusinessProfile)
+@receiver(post_delete, sender=BusinessProfile)
+def invalidate_tenant_context(sender, instance, **kwargs):
+    invalidate_tenant(instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+def notify_chat_participants(sender, instance, created, raw=False, **kwargs):
+    """Будим SSE/long-poll подписчиков обоих участников после коммита"""
+    if created and not raw:
+        sender_id, recipient_id = instance.sender_id, instance.recipient_id
+        transaction.on_commit(lambda: (notify_employee(recipient_id), notify_employee(sender_id)))
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import SlowQuery
+from .querystats import fingerprint
+
+
+logger = logging.getLogger('crm.queries')
+
+# Сколько элементов параметров описывать поимённо
+PARAMS_SHAPE_ITEMS = 20
+
+
+def _value_shape(value):
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def params_shape(params, many=False):
+    """
+    Типы параметров без значений: «int, str, list[120]». Значения не
+    сохраняем — в них могут быть персональные данные клиентов.
+    """
+    if params is None:
+        return ''
+    if many:
+        params = list(params)
+        return f'many × {len(params)}: ' + params_shape(params[0] if params else ())
+    if isinstance(params, dict):
+        items = [f'{key}: {_value_shape(value)}' for key, value in params.items()]
+    else:
+        items = [_value_shape(value) for value in params]
+    if len(items) > PARAMS_SHAPE_ITEMS:
+        items = items[:PARAMS_SHAPE_ITEMS] + [f'… всего {len(items)}']
+    return ', '.join(items)[:500]
+
+
+def fingerprint_hash(normalized_sql):
+    return hashlib.md5(normalized_sql.encode()).hexdigest()
+
+
+def save_slow_queries(entries, view='', business_id=None, keep=None):
+    """
+    Записывает медленные запросы запроса (QueryStats.slow) и обрезает
+    таблицу до keep (SLOW_QUERY_KEEP) последних строк. Ошибка записи
+    не должна ломать ответ — только предупреждение в лог.
+    """
+    if not entries:
+        return
+    keep = keep if keep is not None else settings.SLOW_QUERY_KEEP
+    rows = []
+    for sql, params, many, duration, stack in entries:
+        normalized = fingerprint(sql)
+        rows.append(SlowQuery(
+            fingerprint=fingerprint_hash(normalized),
+            sql=normalized,
+            params_shape=params_shape(params, many),
+            duration_ms=round(duration * 1000, 2),
+            view=view or '',
+            business_id=business_id,
+            stack=stack,
+        ))
+    try:
+        with transaction.atomic():
+            SlowQuery.objects.bulk_create(rows)
+            # id растёт со временем: всё старше keep-й с конца строки — лишнее
+            cutoff = SlowQuery.objects.order_by('-pk').values_list('pk', flat=True)[keep:keep + 1].first()
+            if cutoff is not None:
+                SlowQuery.objects.filter(pk__lte=cutoff).delete()
+    except DatabaseError:
+        logger.warning('Не удалось сохранить медленные запросы', exc_info=True)
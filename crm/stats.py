@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils.timezone import localtime, now
+
+from .counters import alive_counters, live_counters
+from .models import BusinessDailyStats, Employee
+
+
+# Сколько последних месяцев показывать на графике дохода
+MONTHS_BACK = 6
+
+
+def last_months(count=MONTHS_BACK):
+    """Первые дни последних count месяцев (включая текущий), по возрастанию"""
+    month = localtime(now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = []
+    for _ in range(count):
+        months.append(month)
+        month = (month - timedelta(days=1)).replace(day=1)
+    return list(reversed(months))
+
+
+TOTALS = {
+    'new': Coalesce(Sum('new_count'), 0),
+    'in_progress': Coalesce(Sum('in_progress_count'), 0),
+    'done': Coalesce(Sum('done_count'), 0),
+    'revenue': Sum('revenue'),
+    'completed_count': Sum('completed_count'),
+    'completed_seconds': Sum('completed_seconds'),
+}
+
+
+def order_totals(profile):
+    """
+    Счётчики по статусам, доход и среднее время выполнения из дневной
+    сводки: стоимость зависит от числа дней, а не заявок.
+    """
+    return _finish_totals(BusinessDailyStats.objects.filter(business=profile).aggregate(**TOTALS))
+
+
+async def aorder_totals(profile):
+    """order_totals для async-views"""
+    return _finish_totals(await BusinessDailyStats.objects.filter(business=profile).aaggregate(**TOTALS))
+
+
+def _finish_totals(totals):
+    totals['total'] = totals['new'] + totals['in_progress'] + totals['done']
+    totals['revenue'] = totals['revenue'] or 0
+    if totals['completed_count']:
+        totals['avg_days'] = round(totals['completed_seconds'] / totals['completed_count'] / 86400, 1)
+    else:
+        totals['avg_days'] = 0
+    return totals
+
+
+def _revenue_rows(profile, months):
+    return (
+        BusinessDailyStats.objects.filter(business=profile, day__gte=months[0].date())
+        .annotate(month=TruncMonth('day'))
+        .values('month')
+        .annotate(total=Sum('revenue'))
+        .values_list('month', 'total')
+    )
+
+
+def _revenue_series(rows, months):
+    by_month = {month: revenue or 0 for month, revenue in rows}
+    return [float(by_month.get(month.date(), 0)) for month in months]
+
+
+def revenue_by_month(profile, months):
+    """Доход по месяцам — один GROUP BY по TruncMonth над сводкой"""
+    return _revenue_series(_revenue_rows(profile, months), months)
+
+
+async def arevenue_by_month(profile, months):
+    """revenue_by_month для async-views"""
+    return _revenue_series([row async for row in _revenue_rows(profile, months)], months)
+
+
+def _analytics(totals, counters, employees_count, revenue, months):
+    return {
+        'total_clients': counters['clients_count'],
+        'total_orders': totals['total'],
+        'total_revenue': float(totals['revenue']),
+        'avg_execution_time': totals['avg_days'],
+        'orders_new': totals['new'],
+        'orders_in_progress': totals['in_progress'],
+        'orders_done': totals['done'],
+        'employees_count': employees_count,
+        'revenue_by_month': revenue,
+        'months_labels': [month.strftime('%b') for month in months],
+    }
+
+
+def business_analytics(profile):
+    """Все цифры страницы аналитики за фиксированное число запросов (4)"""
+    months = last_months()
+    return _analytics(
+        order_totals(profile),
+        live_counters(profile.pk),
+        Employee.objects.filter(business=profile).count(),
+        revenue_by_month(profile, months),
+        months,
+    )
+
+
+async def abusiness_analytics(profile):
+    """
+    business_analytics для async-views. Запросы идут по очереди: async ORM
+    выполняет их в одном потоке на одном соединении, asyncio.gather
+    ничего не распараллелил бы.
+    """
+    months = last_months()
+    totals = await aorder_totals(profile)
+    counters = await alive_counters(profile.pk)
+    employees_count = await Employee.objects.filter(business=profile).acount()
+    revenue = await arevenue_by_month(profile, months)
+    return _analytics(totals, counters, employees_count, revenue, months)
+
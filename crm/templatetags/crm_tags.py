@@ -0,0 +1,12 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def hours_minutes(value):
+    """timedelta -> «7h 05m»"""
+    if not value:
+        return '0h 00m'
+    minutes = int(value.total_seconds()) // 60
+    return f'{minutes // 60}h {minutes % 60:02d}m'
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import BusinessProfile
+
+
+# Как долго держать контекст бизнеса пользователя в кэше (сек.)
+TENANT_CACHE_TIMEOUT = getattr(settings, 'TENANT_CACHE_TIMEOUT', 60)
+
+
+class TenantContext:
+    """Бизнес текущего пользователя: профиль, язык и состояние подписки"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.business_id = profile.pk
+        self.language = profile.language
+        self.subscription_valid = profile.is_subscription_valid()
+
+
+def _tenant_key(user_id):
+    return f'crm:tenant:{user_id}'
+
+
+def get_tenant(user):
+    """
+    Контекст бизнеса для пользователя, из кэша или одним запросом.
+    None — у пользователя нет профиля бизнеса.
+    """
+    key = _tenant_key(user.pk)
+    tenant = cache.get(key)
+    if tenant is None:
+        profile = BusinessProfile.objects.filter(user_id=user.pk).first()
+        tenant = TenantContext(profile) if profile else False
+        cache.set(key, tenant, TENANT_CACHE_TIMEOUT)
+    return tenant or None
+
+
+async def aget_tenant(user):
+    """get_tenant для async-пути TenantMiddleware"""
+    key = _tenant_key(user.pk)
+    tenant = await cache.aget(key)
+    if tenant is None:
+        profile = await BusinessProfile.objects.filter(user_id=user.pk).afirst()
+        tenant = TenantContext(profile) if profile else False
+        await cache.aset(key, tenant, TENANT_CACHE_TIMEOUT)
+    return tenant or None
+
+
+def invalidate_tenant(user_id):
+    cache.delete(_tenant_key(user_id))
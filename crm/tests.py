@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import asyncio
+import runpy
+import threading
+import io
+import logging
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from openpyxl import load_workbook
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.urls.resolvers import URLPattern
+from django.utils.timezone import now
+
+from .models import BusinessProfile, BusinessDailyStats, Client, Comment, Order, Employee, ExportJob, Message, SlowQuery, WorkDay, WorkLog
+from .bench import bench_routes, compare, default_profile, run_bench
+from .chat import event_stream, inbox
+from .counters import repair_counters
+from .imports import import_clients, read_rows
+from .exports import claim_next_job, export_storage, fail_stale_jobs, order_export, process_job, request_export
+from .pagination import decode_cursor, keyset_paginate
+from .metrics import MetricsRegistry, collect as collect_metrics, get_registry, render as render_metrics
+from .profiling import list_profiles, load_meta, top_functions
+from .querystats import fingerprint
+from .pubsub import DatabasePollingPubSub, InProcessPubSub
+from .rollup import rebuild_business_stats
+from .search import search_clients
+from .seed import seed_load
+from .slowlog import save_slow_queries
+from .stats import abusiness_analytics, business_analytics
+from .tenant import get_tenant
+from .timesheet import rebuild_timesheet, split_by_day, zone
+from .worktime import day_range, stop_session
+
+
+# Шаблоны в тестах рендерятся без collectstatic — статика без манифеста
+PLAIN_STATIC_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def make_business(username='owner'):
+    user = User.objects.create_user(username, password='pass12345')
+    profile = BusinessProfile.objects.create(user=user, business_name='Test', is_active=True)
+    return user, profile
+
+
+def make_orders(profile, count):
+    client = Client.objects.create(business=profile, name='Client', phone=str(count))
+    for i in range(count):
+        order = Order.objects.create(
+            client=client,
+            service=f'Service {i}',
+            status=('new', 'in_progress', 'done')[i % 3],
+            price=Decimal('100.00'),
+        )
+        if order.status == 'done':
+            order.completed_at = order.created_at + timedelta(days=2)
+            order.save()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, STORAGES=PLAIN_STATIC_STORAGES)
+class CrmTestCase(TestCase):
+    """Страницы без HTTPS-редиректа и collectstatic; чистый кэш и бизнес владельца"""
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.profile = make_business()
+
+
+class QueryBudgetMixin:
+    """
+    Бюджет SQL-запросов по имени URL из crm/urls.py. Число запросов берёт
+    QueryStatsMiddleware (request.query_stats), поэтому учитываются и
+    шаблоны, и middleware; повторы запросов попадают в текст ошибки.
+    """
+    QUERY_BUDGETS = {}
+
+    def assertWithinQueryBudget(self, url_name, *args, **params):
+        budget = self.QUERY_BUDGETS[url_name]
+        response = self.client.get(reverse(url_name, args=args), params)
+        stats = response.wsgi_request.query_stats
+        self.assertLessEqual(
+            stats.count, budget,
+            f'{url_name}: {stats.count} SQL-запросов при бюджете {budget}; повторы: {stats.duplicates}',
+        )
+        return response
+
+
+class AnalyticsQueryCountTests(CrmTestCase):
+    # session + user + 4 запроса статистики (профиль — из кэша TenantMiddleware)
+    EXPECTED_QUERIES = 6
+
+    def setUp(self):
+        super().setUp()
+        Employee.objects.create(business=self.profile, first_name='A', last_name='B')
+        self.client.force_login(self.user)
+        get_tenant(self.user)
+
+    def test_query_count_does_not_depend_on_data_size(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_orders(self.profile, 3)
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            self.client.get(reverse('analytics'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_orders(self.profile, 30)
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(reverse('analytics'))
+
+        self.assertEqual(response.context['total_orders'], 33)
+        self.assertEqual(response.context['orders_done'], 11)
+        self.assertEqual(response.context['total_revenue'], 1100.0)
+        self.assertEqual(response.context['avg_execution_time'], 2.0)
+        self.assertEqual(response.context['employees_count'], 1)
+        self.assertEqual(response.context['total_clients'], 2)
+
+    def test_cached_until_business_data_changes(self):
+        self.client.get(reverse('analytics'))
+        with self.assertNumQueries(self.EXPECTED_QUERIES - 4):
+            self.client.get(reverse('analytics'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_orders(self.profile, 3)
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(reverse('analytics'))
+        self.assertEqual(response.context['total_orders'], 3)
+
+    def test_revenue_by_month_covers_last_six_months(self):
+        make_orders(self.profile, 3)
+        order = Order.objects.get(status='done')
+        order.completed_at = now()
+        order.save()
+        response = self.client.get(reverse('analytics'))
+        self.assertEqual(response.context['revenue_by_month'], '[0.0, 0.0, 0.0, 0.0, 0.0, 100.0]')
+
+
+class DailyStatsRollupTests(CrmTestCase):
+    def snapshot(self):
+        return sorted(
+            BusinessDailyStats.objects.filter(business=self.profile)
+            .exclude(new_count=0, in_progress_count=0, done_count=0, revenue=0, completed_count=0)
+            .values_list('day', 'new_count', 'in_progress_count', 'done_count', 'revenue', 'completed_count', 'completed_seconds')
+        )
+
+    def test_incremental_updates_match_rebuild(self):
+        make_orders(self.profile, 9)
+        order = Order.objects.filter(status='new').first()
+        order.status = 'done'
+        order.completed_at = order.created_at + timedelta(days=1)
+        order.save()
+        Order.objects.filter(status='in_progress').first().delete()
+        Client.objects.create(business=self.profile, name='Other', phone='1').orders.create(service='x')
+
+        incremental = self.snapshot()
+        rebuild_business_stats([self.profile.pk])
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_deleting_business_with_orders(self):
+        make_orders(self.profile, 3)
+        self.user.delete()
+        self.assertFalse(BusinessDailyStats.objects.exists())
+
+
+class BusinessCountersTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        get_tenant(self.user)
+
+    def counters(self):
+        self.profile.refresh_from_db()
+        return [getattr(self.profile, name) for name in BusinessProfile.COUNTER_FIELDS]
+
+    def test_counters_follow_writes(self):
+        make_orders(self.profile, 6)
+        order = Order.objects.filter(status='new').first()
+        order.status = 'in_progress'
+        order.save()
+        Order.objects.filter(status='done').first().delete()
+        self.assertEqual(self.counters(), [1, 1, 3, 1])
+
+        self.profile.business_name = 'Renamed'
+        self.profile.save()
+        self.assertEqual(self.counters(), [1, 1, 3, 1])
+
+        Client.objects.get().delete()
+        self.assertEqual(self.counters(), [0, 0, 0, 0])
+
+    def test_repair_matches_incremental(self):
+        make_orders(self.profile, 5)
+        expected = self.counters()
+        BusinessProfile.objects.update(clients_count=0, orders_new_count=0, orders_in_progress_count=0, orders_done_count=0)
+        repair_counters()
+        self.assertEqual(self.counters(), expected)
+
+    def test_dashboard_runs_no_aggregate_queries(self):
+        make_orders(self.profile, 3)
+        # session + user + счётчики по PK
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['clients_count'], 1)
+        self.assertEqual(response.context['orders_new'], 1)
+
+
+class TenantMiddlewareTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_profile_is_cached_between_requests(self):
+        # session + user + профиль + сотрудники
+        with self.assertNumQueries(4):
+            self.client.get(reverse('employee_list'))
+        # session + user + сотрудники; профиль уже в кэше
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('employee_list'))
+        self.assertEqual(response.wsgi_request.tenant.business_id, self.profile.pk)
+
+    def test_profile_save_invalidates_subscription_state(self):
+        self.client.get(reverse('dashboard'))
+        self.profile.is_active = False
+        self.profile.save()
+        response = self.client.get(reverse('dashboard'))
+        self.assertRedirects(response, reverse('blocked'), fetch_redirect_response=False)
+
+
+class ChatDeliveryTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.me = Employee.objects.create(business=self.profile, user=self.user, first_name='Me', last_name='A')
+        self.other = Employee.objects.create(business=self.profile, first_name='Other', last_name='B')
+        self.client.force_login(self.user)
+
+    @override_settings(SERVER_MODE='asgi')
+    def test_send_and_poll(self):
+        response = self.client.post(reverse('chat_send', args=[self.other.pk]), {'text': 'Привет'})
+        self.assertEqual(response.status_code, 201)
+        sent_id = response.json()['id']
+
+        reply = Message.objects.create(sender=self.other, recipient=self.me, text='Ответ')
+        response = self.client.get(reverse('chat_poll', args=[self.other.pk]), {'after': sent_id})
+        self.assertEqual([m['id'] for m in response.json()['messages']], [reply.pk])
+        reply.refresh_from_db()
+        self.assertTrue(reply.is_read)
+
+    def test_empty_message_is_rejected(self):
+        response = self.client.post(reverse('chat_send', args=[self.other.pk]), {'text': '  '})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_inbox_in_one_query(self):
+        third = Employee.objects.create(business=self.profile, first_name='Third', last_name='C')
+        Message.objects.create(sender=self.other, recipient=self.me, text='one')
+        Message.objects.create(sender=self.other, recipient=self.me, text='two')
+        Message.objects.create(sender=third, recipient=self.me, text='read', is_read=True)
+        Message.objects.create(sender=self.me, recipient=third, text='latest')
+
+        with self.assertNumQueries(1):
+            rows = [(e.pk, e.last_message_text, e.unread_count) for e in inbox(self.me)]
+        self.assertEqual(rows, [(third.pk, 'latest', 0), (self.other.pk, 'two', 2)])
+        self.assertContains(self.client.get(reverse('chat_list')), 'Вы: latest')
+
+    def test_history_pages_mark_only_delivered_as_read(self):
+        ids = [Message.objects.create(sender=self.other, recipient=self.me, text=str(i)).pk for i in range(5)]
+
+        with patch('crm.chat.HISTORY_PAGE_SIZE', 2):
+            response = self.client.get(reverse('chat_detail', args=[self.other.pk]))
+            self.assertEqual([m.pk for m in response.context['chat_messages']], ids[3:])
+            self.assertEqual(list(Message.objects.filter(is_read=False).order_by('pk').values_list('pk', flat=True)), ids[:3])
+
+            page = self.client.get(reverse('chat_history', args=[self.other.pk]), {'before_id': ids[3]}).json()
+            self.assertEqual([m['id'] for m in page['messages']], ids[1:3])
+            self.assertTrue(page['has_more'])
+
+        page = self.client.get(reverse('chat_history', args=[self.other.pk]), {'after_id': ids[2]}).json()
+        self.assertEqual([m['id'] for m in page['messages']], ids[3:])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(list(Message.objects.filter(is_read=False).values_list('pk', flat=True)), [ids[0]])
+
+    def test_wsgi_mode_uses_short_polling(self):
+        # Под WSGI долгие соединения заняли бы воркер: SSE и long-poll выключены
+        self.assertEqual(self.client.get(reverse('chat_stream', args=[self.other.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('chat_poll', args=[self.other.pk])).status_code, 404)
+        response = self.client.get(reverse('chat_detail', args=[self.other.pk]))
+        self.assertFalse(response.context['realtime'])
+        self.assertContains(response, 'const realtime = false;')
+
+        reply = Message.objects.create(sender=self.other, recipient=self.me, text='Ответ')
+        page = self.client.get(reverse('chat_history', args=[self.other.pk]), {'after_id': reply.pk - 1}).json()
+        self.assertEqual([m['id'] for m in page['messages']], [reply.pk])
+
+    def test_chat_page_title_and_single_script(self):
+        body = self.client.get(reverse('chat_detail', args=[self.other.pk])).content.decode()
+        self.assertIn('<title>Чат с Other</title>', body)
+        self.assertEqual(body.count('const streamUrl'), 1)
+
+    async def test_stream_pings_on_time_with_polling_backend(self):
+        # DatabasePollingPubSub.wait всегда возвращает True — пинг не должен от этого зависеть
+        events = []
+        with patch('crm.chat.get_pubsub', return_value=DatabasePollingPubSub()), \
+                patch('crm.chat.STREAM_HEARTBEAT', 0.05), patch('crm.chat.STREAM_LIFETIME', 0.3), \
+                self.settings(CHAT_POLL_INTERVAL=0.01):
+            async for event in event_stream(self.me, self.other, 0):
+                events.append(event)
+        self.assertEqual(events[0], 'retry: 3000\n\n')
+        self.assertGreaterEqual(events.count(': ping\n\n'), 3)
+
+    def test_in_process_pubsub_wakes_subscriber_from_another_thread(self):
+        pubsub = InProcessPubSub()
+
+        async def scenario():
+            async with pubsub.subscribe('chat:1') as subscription:
+                self.assertFalse(await subscription.wait(0.01))
+                threading.Thread(target=pubsub.publish, args=('chat:1',)).start()
+                self.assertTrue(await subscription.wait(5))
+
+        asyncio.run(scenario())
+
+
+class WorkTimeReportTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = Employee.objects.create(business=self.profile, user=self.user, first_name='Admin', role='admin')
+        self.worker = Employee.objects.create(business=self.profile, first_name='Worker')
+        self.client.force_login(self.user)
+
+        self.day = now().date() - timedelta(days=1)
+        day_start, day_end = day_range(self.day)
+        for start, hours in ((day_start + timedelta(hours=9), 3), (day_start + timedelta(hours=14), 2)):
+            WorkLog.objects.create(employee=self.worker, start_time=start, end_time=start + timedelta(hours=hours))
+        # Начата до выбранного дня — в отчёт не попадает
+        WorkLog.objects.create(employee=self.worker, start_time=day_start - timedelta(hours=1), end_time=day_start + timedelta(hours=1))
+        WorkLog.objects.create(employee=self.admin, start_time=day_end - timedelta(hours=1), end_time=day_end)
+
+    def test_daily_report_totals(self):
+        response = self.client.get(reverse('work_time_report'), {'date': self.day.isoformat()})
+        self.assertEqual(
+            [(employee.pk, total) for employee, total in response.context['employee_totals']],
+            [(self.admin.pk, timedelta(hours=1)), (self.worker.pk, timedelta(hours=5))],
+        )
+        self.assertEqual(len(response.context['work_logs']), 3)
+        self.assertContains(response, '5h 00m')
+
+    def test_employee_month_totals(self):
+        response = self.client.get(reverse('employee_work_time', args=[self.worker.pk]), {'month': self.day.strftime('%Y-%m')})
+        # Табель делит сессию через полночь: 3 + 2 часа плюс час после полуночи
+        self.assertIn((self.day, timedelta(hours=6)), response.context['daily_totals'])
+
+
+class WorkSessionTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.employee = Employee.objects.create(business=self.profile, user=self.user, first_name='Me')
+        self.client.force_login(self.user)
+
+    def test_start_and_stop_are_idempotent(self):
+        self.assertEqual(self.client.post(reverse('start_work')).status_code, 201)
+        self.assertEqual(self.client.post(reverse('start_work')).status_code, 409)
+        self.assertEqual(WorkLog.objects.filter(end_time__isnull=True).count(), 1)
+
+        response = self.client.post(reverse('end_work'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['active'])
+        self.assertEqual(self.client.post(reverse('end_work')).status_code, 409)
+        self.assertFalse(WorkLog.objects.filter(end_time__isnull=True).exists())
+
+    def test_status_translations_are_escaped_for_js(self):
+        def gettext_lazy(message):
+            return f"It's\n{message}" if message.startswith('Рабочий день') else message
+
+        with patch('django.template.base.gettext_lazy', gettext_lazy):
+            body = self.client.get(reverse('dashboard')).content.decode()
+        self.assertIn("status.textContent = 'It\\u0027s\\u000AРабочий день начат ✓';", body)
+
+    def test_database_rejects_second_open_session(self):
+        WorkLog.objects.create(employee=self.employee, start_time=now())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WorkLog.objects.create(employee=self.employee, start_time=now())
+
+
+class TimesheetTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile.timezone = 'Asia/Ashgabat'
+        self.profile.save()
+        self.employee = Employee.objects.create(business=self.profile, first_name='Night')
+        self.day = date(2026, 3, 10)
+        self.evening = datetime(2026, 3, 10, 22, 0, tzinfo=self.profile.tzinfo)
+
+    def snapshot(self):
+        return list(WorkDay.objects.exclude(seconds=0).order_by('day').values_list('day', 'seconds'))
+
+    def test_session_over_midnight_is_split_in_business_timezone(self):
+        WorkLog.objects.create(employee=self.employee, start_time=self.evening)
+        stop_session(self.employee, at=self.evening + timedelta(hours=3))
+        self.assertEqual(self.snapshot(), [(self.day, 7200), (self.day + timedelta(days=1), 3600)])
+
+    def test_split_by_day_counts_real_seconds_across_dst(self):
+        # 29.03.2026 в Берлине длится 23 часа (переход на летнее время)
+        start = datetime(2026, 3, 28, 20, 0, tzinfo=dt_timezone.utc)
+        days = split_by_day(start, start + timedelta(hours=32), zone('Europe/Berlin'))
+        self.assertEqual(dict(days), {
+            date(2026, 3, 28): 3 * 3600,
+            date(2026, 3, 29): 23 * 3600,
+            date(2026, 3, 30): 6 * 3600,
+        })
+
+    def test_incremental_updates_match_rebuild(self):
+        log = WorkLog.objects.create(employee=self.employee, start_time=self.evening, end_time=self.evening + timedelta(hours=1))
+        log.end_time = self.evening + timedelta(hours=5)
+        log.save()
+        other = WorkLog.objects.create(employee=self.employee, start_time=self.evening - timedelta(days=1),
+                                       end_time=self.evening - timedelta(hours=20))
+        other.delete()
+        WorkLog.objects.create(employee=self.employee, start_time=self.evening + timedelta(days=2),
+                               end_time=self.evening + timedelta(days=2, hours=1))
+
+        incremental = self.snapshot()
+        rebuild_timesheet([self.profile.pk])
+        self.assertEqual(incremental, self.snapshot())
+
+
+class ExportJobTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.export_root.cleanup)
+        overrider = override_settings(EXPORT_ROOT=self.export_root.name)
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        make_orders(self.profile, 3)
+
+    def test_same_data_reuses_job_and_changes_make_new_one(self):
+        job = request_export(self.profile, 'orders')
+        self.assertEqual(request_export(self.profile, 'orders').pk, job.pk)
+        make_orders(self.profile, 1)
+        self.assertNotEqual(request_export(self.profile, 'orders').pk, job.pk)
+
+    def test_worker_builds_file_and_tracks_progress(self):
+        job = request_export(self.profile, 'orders')
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status), (job.pk, 'running'))
+        self.assertIsNone(claim_next_job())
+        process_job(claimed)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_total, job.rows_done), ('done', 3, 3))
+        with export_storage().open(job.file, 'rb') as fileobj:
+            rows = list(load_workbook(fileobj, read_only=True).active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(request_export(self.profile, 'orders').pk, job.pk)
+
+    def test_stale_running_job_is_failed_and_replaced(self):
+        job = request_export(self.profile, 'orders')
+        claim_next_job()
+        # Свежая running-задача ещё может завершиться — её и отдаём
+        self.assertEqual(request_export(self.profile, 'orders').pk, job.pk)
+
+        ExportJob.objects.filter(pk=job.pk).update(started_at=now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT + 1))
+        replacement = request_export(self.profile, 'orders')
+        self.assertNotEqual(replacement.pk, job.pk)
+        self.assertEqual(replacement.status, 'pending')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_worker_start_fails_abandoned_jobs(self):
+        job = request_export(self.profile, 'clients')
+        ExportJob.objects.filter(pk=job.pk).update(
+            status='running', started_at=now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT + 1),
+        )
+        call_command('run_export_worker', once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(fail_stale_jobs(), 0)
+
+    def test_gunicorn_runs_worker_next_to_web(self):
+        # Файлы пишутся в EXPORT_ROOT веб-контейнера — воркер запускает сам gunicorn
+        hooks = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+        server = type('Server', (), {'log': logging.getLogger('gunicorn.test')})()
+        with patch('subprocess.Popen') as popen:
+            hooks['when_ready'](server)
+            self.assertEqual(popen.call_args.args[0][-2:], [str(settings.BASE_DIR / 'manage.py'), 'run_export_worker'])
+            popen.return_value.poll.return_value = None
+            hooks['on_exit'](server)
+            popen.return_value.terminate.assert_called_once()
+        with patch('subprocess.Popen') as popen, patch.dict(hooks['when_ready'].__globals__, EXPORT_WORKER_IN_WEB=False):
+            hooks['when_ready'](server)
+            popen.assert_not_called()
+
+
+class ClientImportTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def import_csv(self, text, **kwargs):
+        return import_clients(self.profile, read_rows(io.BytesIO(text.encode()), 'clients.csv'), **kwargs)
+
+    def test_duplicates_in_file_and_in_business_are_skipped(self):
+        Client.objects.create(business=self.profile, name='Old', phone='100')
+        result = self.import_csv('Имя;Телефон;Заметки\nOld;100;\nNew;200;vip\nCopy;200;\n')
+        self.assertEqual((result.created, result.duplicates, result.error_count), (1, 2, 0))
+        self.assertEqual(Client.objects.get(phone='200').notes, 'vip')
+
+    def test_row_errors_are_reported_with_line_numbers(self):
+        result = self.import_csv(f'name,phone\n,1\nAnn,{"9" * 60}\nBob,3\n\nEve,4\n')
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [2, 3])
+        self.assertIn('phone', result.errors[1][1])
+
+    def test_missing_columns_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'Имя'):
+            self.import_csv('foo,bar\n1,2\n')
+
+    def test_batches_use_fixed_queries_and_update_counters(self):
+        rows = ''.join(f'Client {i},{i}\n' for i in range(5))
+        # 3 пачки по 2 строки, на каждую: SELECT дублей, SAVEPOINT, INSERT,
+        # UPDATE счётчика, RELEASE — число запросов не зависит от строк в пачке
+        with self.assertNumQueries(15):
+            result = self.import_csv('name,phone\n' + rows, batch_size=2)
+        self.assertEqual(result.created, 5)
+        self.assertEqual(BusinessProfile.objects.get(pk=self.profile.pk).clients_count, 5)
+
+    @override_settings(CLIENT_IMPORT_MAX_ROWS=2)
+    def test_web_import_rejects_files_over_row_cap(self):
+        upload = SimpleUploadedFile('clients.csv', 'Имя,Телефон\nA,1\nB,2\nC,3\n'.encode())
+        response = self.client.post(reverse('client_import'), {'file': upload}, follow=True)
+        self.assertContains(response, 'В файле больше 2 строк')
+        self.assertFalse(Client.objects.exists())
+
+        upload = SimpleUploadedFile('clients.csv', 'Имя,Телефон\nA,1\nB,2\n'.encode())
+        response = self.client.post(reverse('client_import'), {'file': upload})
+        self.assertEqual(response.context['result'].created, 2)
+
+    def test_corrupt_xlsx_is_reported_not_500(self):
+        upload = SimpleUploadedFile('clients.xlsx', b'name,phone\nAnn,1\n')
+        response = self.client.post(reverse('client_import'), {'file': upload}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Файл не является книгой Excel')
+        self.assertFalse(Client.objects.exists())
+
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as broken:
+            broken.write(b'not a zip')
+            broken.flush()
+            with self.assertRaisesMessage(CommandError, 'Файл не является книгой Excel'):
+                call_command('import_clients', self.profile.pk, broken.name, stdout=io.StringIO())
+
+    def test_cp1251_csv_from_excel(self):
+        upload = SimpleUploadedFile('clients.csv', 'Имя;Телефон\nАнна;1\n'.encode('cp1251'))
+        response = self.client.post(reverse('client_import'), {'file': upload})
+        self.assertEqual(response.context['result'].created, 1)
+        self.assertTrue(Client.objects.filter(name='Анна').exists())
+
+    def test_mixed_encoding_is_reported_in_words(self):
+        # Начало файла — UTF-8, строка за пределами выборки — cp1251
+        head = 'Имя,Телефон\n' + ''.join(f'Клиент {i},{i}\n' for i in range(5000))
+        data = head.encode() + 'Анна,x\n'.encode('cp1251')
+        upload = SimpleUploadedFile('clients.csv', data)
+        response = self.client.post(reverse('client_import'), {'file': upload}, follow=True)
+        self.assertContains(response, 'UTF-8 или Windows-1251')
+        self.assertNotContains(response, 'codec')
+
+
+class ExportTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        make_orders(self.profile, 5)
+        _, other = make_business('other')
+        make_orders(other, 2)
+        self.client.force_login(self.user)
+
+    def download(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_orders_xlsx(self):
+        wb = load_workbook(io.BytesIO(self.download('export_orders')), read_only=True)
+        rows = list(wb['Заявки'].iter_rows(values_only=True))
+        self.assertEqual(rows[0], ('Клиент', 'Телефон', 'Услуга', 'Статус', 'Цена', 'Дата'))
+        self.assertEqual([row[2] for row in rows[1:]], [f'Service {i}' for i in range(4, -1, -1)])
+        self.assertEqual(rows[-1][3], 'Новая')
+        self.assertEqual(rows[-1][4], 100)
+
+    def test_rows_are_read_with_one_query_whatever_the_size(self):
+        spec = order_export(self.profile)
+        with self.assertNumQueries(1):
+            rows = list(spec.rows())
+        self.assertEqual(len(rows), 5)
+        make_orders(self.profile, 20)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(spec.rows())), 25)
+
+    def test_clients_csv(self):
+        Client.objects.create(business=self.profile, name='Ann, "A"', phone='1', notes='строка\nвторая')
+        lines = self.download('export_clients', format='csv').decode().splitlines()
+        self.assertEqual(lines[0], 'Имя,Телефон,Заметки,Дата добавления')
+        self.assertEqual(lines[1], '"Ann, ""A""",1,"строка')
+        self.assertEqual(lines[2], f'вторая",{now().strftime("%d.%m.%Y")}')
+        self.assertEqual(len(lines), 4)
+
+    def test_orders_parquet_keeps_column_types(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(io.BytesIO(self.download('export_orders', format='parquet')))
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.schema.field('Цена').type, pa.float64())
+        self.assertEqual(table.schema.field('Дата').type, pa.date32())
+        self.assertEqual(table.column('Статус').to_pylist()[-1], 'Новая')
+
+    def test_zero_price_is_kept(self):
+        import pyarrow.parquet as pq
+
+        client = Client.objects.create(business=self.profile, name='Free', phone='0')
+        Order.objects.create(client=client, service='Бесплатно', status='done', price=Decimal('0'))
+        Order.objects.create(client=client, service='Без цены')
+        table = pq.read_table(io.BytesIO(self.download('export_orders', format='parquet')))
+        prices = dict(zip(table.column('Услуга').to_pylist(), table.column('Цена').to_pylist()))
+        self.assertEqual((prices['Бесплатно'], prices['Без цены']), (0.0, None))
+        body = self.download('export_orders', format='csv').decode()
+        self.assertIn('Free,0,Бесплатно,Завершена,0.0,', body)
+        self.assertIn('Free,0,Без цены,Новая,,', body)
+
+    def test_unknown_format_is_404(self):
+        self.assertEqual(self.client.get(reverse('export_orders'), {'format': 'pdf'}).status_code, 404)
+
+
+class PayrollExportTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = Employee.objects.create(business=self.profile, user=self.user, first_name='Ann', last_name='Admin', role='admin')
+        self.worker = Employee.objects.create(business=self.profile, first_name='Bob', last_name='Worker')
+        self.idle = Employee.objects.create(business=self.profile, first_name='Cid', last_name='Idle')
+        WorkDay.objects.bulk_create([
+            WorkDay(employee=self.worker, day=date(2026, 5, 1), seconds=8 * 3600),
+            WorkDay(employee=self.worker, day=date(2026, 5, 2), seconds=4 * 3600),
+            WorkDay(employee=self.worker, day=date(2026, 6, 1), seconds=3600),
+            WorkDay(employee=self.admin, day=date(2026, 5, 3), seconds=1800),
+        ])
+        self.client.force_login(self.user)
+
+    def test_workbook_has_summary_and_sheet_per_employee(self):
+        with self.assertNoLogs('crm.queries', 'WARNING'):
+            response = self.client.get(reverse('export_payroll'), {'start': '2026-05-01', 'end': '2026-05-31'})
+        wb = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assertEqual(wb.sheetnames, ['Итого', 'Admin Ann', 'Idle Cid', 'Worker Bob'])
+        summary = list(wb['Итого'].iter_rows(min_row=2, values_only=True))
+        self.assertEqual([row[2:] for row in summary], [(1, 0.5), (0, 0), (2, 12)])
+        self.assertEqual(
+            list(wb['Worker Bob'].iter_rows(min_row=2, values_only=True)),
+            [('01.05.2026', 8), ('02.05.2026', 4)],
+        )
+
+    def test_owner_without_employee_row_can_export(self):
+        Employee.objects.filter(pk=self.admin.pk).update(user=None)
+        response = self.client.get(reverse('export_payroll'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        # Чат создаёт владельцу запись сотрудника с ролью manager — доступ остаётся
+        self.client.get(reverse('chat_list'))
+        self.assertTrue(Employee.objects.filter(user=self.user, role='manager').exists())
+        self.assertEqual(self.client.get(reverse('export_payroll'), {'format': 'csv'}).status_code, 200)
+
+    def test_csv_sections(self):
+        response = self.client.get(reverse('export_payroll'), {'start': '2026-05-01', 'end': '2026-06-30', 'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[:1], ['Итого'])
+        self.assertIn('Worker Bob', lines)
+        self.assertIn('01.06.2026,1.0', lines)
+
+    async def test_asgi_streams_export_without_buffering(self):
+        params = {'start': '2026-05-01', 'end': '2026-06-30', 'format': 'csv'}
+        def get_csv():
+            return b''.join(self.client.get(reverse('export_payroll'), params).streaming_content)
+        expected = await sync_to_async(get_csv)()
+        await self.async_client.aforce_login(self.user)
+        with self.settings(SERVER_MODE='asgi'):
+            for fmt in ('csv', 'xlsx'):
+                with self.subTest(fmt):
+                    response = await self.async_client.get(reverse('export_payroll'), {**params, 'format': fmt})
+                    self.assertTrue(response.is_async)
+                    content = b''.join([chunk async for chunk in response.streaming_content])
+                    if fmt == 'csv':
+                        self.assertEqual(content, expected)
+                    else:
+                        self.assertEqual(load_workbook(io.BytesIO(content)).sheetnames[0], 'Итого')
+
+
+class ClientSearchTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.anna = Client.objects.create(business=self.profile, name='Анна Петрова', phone='+7 900 111-22-33')
+        self.boris = Client.objects.create(business=self.profile, name='Борис "Бо" Ли', phone='+7 900 444-55-66')
+        _, other = make_business('other')
+        Client.objects.create(business=other, name='Анна Чужая', phone='+7 900 111-22-33')
+        self.clients = Client.objects.filter(business=self.profile)
+        self.client.force_login(self.user)
+
+    def search(self, term):
+        return sorted(client.pk for client in search_clients(self.clients, term))
+
+    def test_name_and_phone_substrings(self):
+        self.assertEqual(self.search('петров'), [self.anna.pk])
+        self.assertEqual(self.search('444-55'), [self.boris.pk])
+        self.assertEqual(self.search('+7 900'), [self.anna.pk, self.boris.pk])
+        # Короче трёх символов — обычный icontains
+        self.assertEqual(self.search('Ли'), [self.boris.pk])
+        self.assertEqual(self.search('"Бо"'), [self.boris.pk])
+        self.assertEqual(self.search('  '), [self.anna.pk, self.boris.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.anna.name = 'Анна Сидорова'
+        self.anna.save()
+        self.assertEqual(self.search('петров'), [])
+        self.assertEqual(self.search('сидор'), [self.anna.pk])
+        self.anna.delete()
+        self.assertEqual(self.search('сидор'), [])
+
+    def test_client_list_annotates_order_counts(self):
+        for service in ('A', 'B', 'C'):
+            Order.objects.create(client=self.anna, service=service)
+        response = self.client.get(reverse('client_list'), {'search': 'анна'})
+        self.assertEqual([(c.pk, c.orders_count) for c in response.context['page']], [(self.anna.pk, 3)])
+
+
+class OrderPaginationTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        make_orders(self.profile, 7)
+        _, other = make_business('other')
+        make_orders(other, 3)
+        # Одинаковое время создания: порядок и границы страниц решает id
+        Order.objects.update(created_at=now().replace(microsecond=0))
+        self.orders = Order.objects.filter(business=self.profile)
+        self.client.force_login(self.user)
+
+    def walk(self, queryset, per_page):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(queryset, cursor, per_page=per_page)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_ties_on_created_at_are_split_by_id(self):
+        pages = self.walk(self.orders, per_page=3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([page.is_first for page in pages], [True, False, False])
+        ids = [order.pk for page in pages for order in page]
+        self.assertEqual(ids, sorted(self.orders.values_list('pk', flat=True), reverse=True))
+        last = pages[0].object_list[-1]
+        self.assertEqual(decode_cursor(pages[0].next_cursor), (last.created_at, last.pk))
+
+    def test_exact_multiple_has_no_empty_last_page(self):
+        pages = self.walk(self.orders.exclude(pk=self.orders.first().pk), per_page=3)
+        self.assertEqual([len(page) for page in pages], [3, 3])
+        self.assertIsNone(pages[-1].next_cursor)
+
+    def test_broken_cursor_starts_from_first_page(self):
+        page = keyset_paginate(self.orders, 'not-a-cursor', per_page=3)
+        self.assertTrue(page.is_first)
+        self.assertEqual(page.object_list[0].pk, self.orders.order_by('-id').first().pk)
+
+    def test_page_query_uses_business_index(self):
+        # Страница читается по индексу бизнеса без JOIN для фильтра, поэтому
+        # её цена не зависит от числа заявок других бизнесов
+        for status, index in (('', 'order_business_created_idx'), ('new', 'order_business_status_idx')):
+            with self.subTest(status=status or 'all'):
+                orders = Order.objects.filter(business=self.profile).select_related('client')
+                if status:
+                    orders = orders.filter(status=status)
+                page = orders.order_by('-created_at', '-id')[:51]
+                if connection.vendor == 'sqlite':
+                    self.assertIn(f'USING INDEX {index}', page.explain())
+                self.assertNotIn('crm_client', str(page.query).split(' WHERE ')[1])
+
+    def test_order_keeps_business_of_its_client(self):
+        _, other = make_business('third')
+        order = self.orders.first()
+        order.client = Client.objects.create(business=other, name='Moved', phone='1')
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).business_id, other.pk)
+
+    @patch('crm.views.ORDERS_PER_PAGE', 2)
+    def test_order_list_filters_by_status_across_pages(self):
+        seen, params = [], {'status': 'new'}
+        while True:
+            page = self.client.get(reverse('order_list'), params).context['page']
+            seen += page.object_list
+            if not page.has_next:
+                break
+            params['cursor'] = page.next_cursor
+        expected = self.orders.filter(status='new').order_by('-id')
+        self.assertEqual([order.pk for order in seen], list(expected.values_list('pk', flat=True)))
+        self.assertTrue(all(order.client.business_id == self.profile.pk for order in seen))
+
+
+class QueryBudgetTests(QueryBudgetMixin, CrmTestCase):
+    # Бюджеты при данных из setUp; N+1 в шаблоне их превышает
+    QUERY_BUDGETS = {
+        'dashboard': 3,
+        'client_list': 3,
+        'client_detail': 5,
+        'client_add': 2,
+        'client_edit': 3,
+        'order_list': 3,
+        'order_detail': 5,
+        'order_add': 3,
+        'order_edit': 4,
+        'analytics': 6,
+        'employee_list': 3,
+        'employee_add': 2,
+        'employee_edit': 3,
+        'chat_list': 4,
+        # + UPDATE непрочитанных при первом открытии
+        'chat_detail': 7,
+        'chat_history': 5,
+        'work_time_report': 6,
+        'employee_work_time': 7,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.me = Employee.objects.create(business=self.profile, user=self.user, first_name='Me', role='admin')
+        self.others = [Employee.objects.create(business=self.profile, first_name=f'E{i}') for i in range(4)]
+        for i in range(6):
+            client = Client.objects.create(business=self.profile, name=f'C{i}', phone=str(i))
+            for _ in range(3):
+                order = Order.objects.create(client=client, service='s', status='done', price=Decimal('10'))
+                Comment.objects.create(order=order, text='x')
+        for employee in self.others:
+            for _ in range(3):
+                Message.objects.create(sender=employee, recipient=self.me, text='hi')
+                Message.objects.create(sender=self.me, recipient=employee, text='yo')
+            WorkLog.objects.create(employee=employee, start_time=now() - timedelta(hours=3), end_time=now() - timedelta(hours=1))
+        self.client.force_login(self.user)
+        get_tenant(self.user)
+
+    def test_budget_names_exist_in_urls(self):
+        from .urls import urlpatterns
+        names = {p.name for p in urlpatterns if isinstance(p, URLPattern)}
+        self.assertEqual(set(self.QUERY_BUDGETS) - names, set())
+
+    def test_views_stay_within_query_budget(self):
+        client = Client.objects.first()
+        order = Order.objects.first()
+        employee = self.others[0]
+        args = {
+            'client_detail': [client.pk], 'client_edit': [client.pk], 'order_add': [client.pk],
+            'order_detail': [order.pk], 'order_edit': [order.pk], 'employee_edit': [employee.pk],
+            'chat_detail': [employee.pk], 'chat_history': [employee.pk], 'employee_work_time': [employee.pk],
+        }
+        for name in self.QUERY_BUDGETS:
+            with self.subTest(name):
+                response = self.assertWithinQueryBudget(name, *args.get(name, []))
+                self.assertEqual(response.status_code, 200)
+
+    def test_fingerprint_folds_parameters(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s)  AND name = 'y' LIMIT 1"),
+        )
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class SeedLoadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seeded_business_is_consistent(self):
+        usernames, stats = seed_load(clients=30, employees=4, messages=40, work_days=10, days=60, seed=1)
+        self.assertEqual(usernames, ['load-1'])
+        profile = BusinessProfile.objects.get(user__username='load-1')
+        self.assertEqual(stats['clients'], 30)
+        self.assertEqual(Order.objects.filter(business=profile).count(), stats['orders'])
+        self.assertEqual(Message.objects.filter(sender__business=profile).count(), 40)
+        # Сгенерированные даты сохранились, а не заменились на «сейчас»
+        self.assertLess(Client.objects.filter(business=profile).order_by('created_at').first().created_at,
+                        now() - timedelta(days=1))
+
+        # Счётчики, сводки и табель уже пересчитаны после bulk_create
+        profile.refresh_from_db()
+        counters = (profile.clients_count, profile.orders_new_count, profile.orders_done_count)
+        repair_counters([profile.pk])
+        profile.refresh_from_db()
+        self.assertEqual(counters, (profile.clients_count, profile.orders_new_count, profile.orders_done_count))
+        self.assertEqual(
+            sum(WorkDay.objects.filter(employee__business=profile).values_list('seconds', flat=True)),
+            sum(
+                int((log.end_time - log.start_time).total_seconds())
+                for log in WorkLog.objects.filter(employee__business=profile)
+            ),
+        )
+
+        # Повторный запуск не конфликтует с уже созданными владельцами
+        usernames, _ = seed_load(clients=1, employees=1, messages=0, work_days=0, seed=2)
+        self.assertEqual(usernames, ['load-2'])
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_bench_measures_views_and_compares_with_baseline(self):
+        seed_load(clients=5, employees=2, messages=5, work_days=3, days=30, seed=1)
+        profile = default_profile()
+        names = {name for name, _ in bench_routes(profile)}
+        self.assertIn('client_detail', names)
+        self.assertNotIn('logout', names)
+
+        results = run_bench(profile, repeat=3, warmup=0, only=['dashboard', 'client_detail'])
+        self.assertEqual(set(results), {'dashboard', 'client_detail'})
+        self.assertEqual(results['dashboard']['status'], 200)
+        self.assertGreater(results['client_detail']['queries'], 0)
+
+        baseline = {'dashboard': {'p95_ms': results['dashboard']['p95_ms'] * 10, 'queries': 0}}
+        self.assertEqual([name for name, _ in compare(results, baseline)], ['dashboard'])
+
+
+@override_settings(PROFILING_SAMPLE_RATE=0.0)
+class ProfilingTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(PROFILE_ROOT=self.tmp.name, PROFILE_KEEP=3)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin, _ = make_business('root')
+        self.admin.is_staff = self.admin.is_superuser = True
+        self.admin.save()
+
+    def test_header_profiles_only_superuser_requests(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('analytics'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('dashboard'), HTTP_X_PROFILE='1')
+        meta = load_meta(response['X-Profile-Id'])
+        self.assertEqual(meta['view'], 'dashboard')
+        self.assertTrue(top_functions(meta['id']))
+
+    def test_sampled_profiles_are_kept_in_ring_buffer(self):
+        self.client.force_login(self.user)
+        with override_settings(PROFILING_SAMPLE_RATE=1.0):
+            ids = [self.client.get(reverse('dashboard'))['X-Profile-Id'] for _ in range(5)]
+        stored = [meta['id'] for meta in list_profiles()]
+        self.assertEqual(stored, ids[:1:-1])
+        self.assertEqual(list_profiles()[0]['business_id'], self.profile.pk)
+
+    def test_admin_pages_are_superuser_only(self):
+        self.client.force_login(self.admin)
+        profile_id = self.client.get(reverse('dashboard'), HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.assertContains(self.client.get(reverse('crm_profile_list')), profile_id[:10])
+        self.assertContains(self.client.get(reverse('crm_profile_detail', args=[profile_id]), {'sort': 'tottime'}), 'dashboard')
+        response = self.client.get(reverse('crm_profile_download', args=[profile_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('crm_profile_detail', args=['..'])).status_code, 404)
+
+        staff = User.objects.create_user('staff', password='pass12345', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('crm_profile_list')).status_code, 403)
+
+    def test_pruned_profile_file_is_404(self):
+        self.client.force_login(self.admin)
+        profile_id = self.client.get(reverse('dashboard'), HTTP_X_PROFILE='1')['X-Profile-Id']
+        # .json ещё на месте, а .prof уже удалил prune соседнего воркера
+        Path(self.tmp.name, f'{profile_id}.prof').unlink()
+        self.assertIsNone(top_functions(profile_id))
+        self.assertEqual(self.client.get(reverse('crm_profile_detail', args=[profile_id])).status_code, 404)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch('crm.metrics._registry', MetricsRegistry(self.tmp.name, flush_interval=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_recorded_per_url_name(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard'))
+        self.client.get('/no-such-page/')
+        body = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('crm_http_requests_total{view="dashboard",method="GET",status="200"} 1', body)
+        self.assertIn('crm_http_request_duration_seconds_count{view="dashboard"} 1', body)
+        self.assertIn('crm_http_request_duration_seconds_bucket{view="dashboard",le="+Inf"} 1', body)
+        self.assertIn('crm_http_request_db_seconds_count{view="dashboard"} 1', body)
+        self.assertIn('crm_http_response_size_bytes_count{view="dashboard"} 1', body)
+        self.assertIn('view="<unmatched>"', body)
+
+    def test_snapshots_of_all_workers_are_summed(self):
+        other = MetricsRegistry(self.tmp.name)
+        other.path = other.path.with_name('999999.json')
+        other.observe('crm_http_request_duration_seconds', (('view', 'dashboard'),), 0.02)
+        other.flush(force=True)
+        get_registry().observe('crm_http_request_duration_seconds', (('view', 'dashboard'),), 3.0)
+
+        body = render_metrics(collect_metrics())
+        self.assertIn('crm_http_request_duration_seconds_bucket{view="dashboard",le="0.025"} 1', body)
+        self.assertIn('crm_http_request_duration_seconds_bucket{view="dashboard",le="5.0"} 2', body)
+        self.assertIn('crm_http_request_duration_seconds_sum{view="dashboard"} 3.02', body)
+
+    def test_gunicorn_start_clears_old_snapshots(self):
+        stale = MetricsRegistry(self.tmp.name)
+        stale.path = stale.path.with_name('999999.json')
+        stale.inc('crm_http_requests_total', (('view', 'dashboard'),), 5)
+        stale.flush(force=True)
+
+        hooks = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+        with override_settings(METRICS_DIR=self.tmp.name):
+            hooks['on_starting'](None)
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+@override_settings(SLOW_QUERY_KEEP=1000)
+class SlowQueryLogTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        make_orders(self.profile, 3)
+        self.client.force_login(self.user)
+
+    def test_slow_queries_are_attributed_to_view_and_tenant(self):
+        with override_settings(SLOW_QUERY_MS=1e-6):
+            self.client.get(reverse('client_list'))
+        rows = SlowQuery.objects.filter(view='client_list')
+        self.assertTrue(rows.exists())
+        self.assertEqual(set(rows.values_list('business_id', flat=True)), {self.profile.pk})
+        # Стек виден только у синхронных views: запросы async-views идут
+        # в потоке sync_to_async, где кадров корутины нет
+        self.assertIn('views.py', rows.exclude(stack='').first().stack)
+        # Сам журнал в журнал не попадает
+        self.assertFalse(SlowQuery.objects.filter(sql__contains='crm_slowquery').exists())
+
+    def test_fast_queries_are_not_logged(self):
+        with override_settings(SLOW_QUERY_MS=60000):
+            self.client.get(reverse('order_list'))
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_table_is_capped_and_params_have_no_values(self):
+        sql = 'SELECT * FROM crm_client WHERE id IN (%s, %s) AND name = %s'
+        entries = [(sql, [1, 2, 'Иван'], False, 0.5, '')] * 5
+        save_slow_queries(entries, view='client_list', keep=3)
+        self.assertEqual(SlowQuery.objects.count(), 3)
+        row = SlowQuery.objects.first()
+        self.assertEqual(row.params_shape, 'int, int, str')
+        self.assertNotIn('Иван', row.params_shape)
+        self.assertIn('(...)', row.sql)
+
+    def test_admin_groups_by_fingerprint(self):
+        save_slow_queries([
+            ('SELECT 1 FROM crm_order WHERE id = %s', [1], False, 0.3, ''),
+            ('SELECT 1 FROM crm_order WHERE id = %s', [2], False, 0.2, ''),
+            ('SELECT 2 FROM crm_client', [], False, 0.1, ''),
+        ], view='order_list')
+        response = self.client.get(reverse('admin:crm_slowquery_grouped'))
+        self.assertEqual([group['count'] for group in response.context['groups']], [2, 1])
+        # Changelist админки сам делает COUNT(*) дважды — предупреждение ожидаемо
+        with self.assertLogs('crm.queries', 'WARNING'):
+            response = self.client.get(reverse('admin:crm_slowquery_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+class StaticAssetsTests(CrmTestCase):
+    def test_pages_use_vendored_assets(self):
+        self.client.force_login(self.user)
+        body = self.client.get(reverse('dashboard')).content.decode()
+        self.assertNotIn('cdn.jsdelivr.net', body)
+        for asset in ('bootstrap/css/bootstrap.min.css', 'bootstrap/js/bootstrap.bundle.min.js',
+                      'bootstrap-icons/bootstrap-icons.min.css', 'bootstrap-icons/fonts/bootstrap-icons.woff2'):
+            with self.subTest(asset):
+                self.assertIn(f'/static/crm/vendor/{asset}', body)
+                self.assertIsNotNone(finders.find(f'crm/vendor/{asset}'))
+
+    def test_icon_font_preload_matches_url_in_hashed_css(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, STORAGES={
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'},
+        }):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            font = staticfiles_storage.stored_name('crm/vendor/bootstrap-icons/fonts/bootstrap-icons.woff2')
+            with staticfiles_storage.open(staticfiles_storage.stored_name('crm/vendor/bootstrap-icons/bootstrap-icons.min.css')) as css:
+                # Тот же URL, что у <link rel=preload>, иначе шрифт качается дважды
+                self.assertIn(f'url("fonts/{font.rsplit("/", 1)[1]}")', css.read().decode())
+
+    def test_whitenoise_is_installed_once(self):
+        self.assertEqual(settings.MIDDLEWARE.count('whitenoise.middleware.WhiteNoiseMiddleware'), 1)
+
+
+class AsyncViewsTests(CrmTestCase):
+    def setUp(self):
+        super().setUp()
+        make_orders(self.profile, 6)
+        self.me = Employee.objects.create(business=self.profile, user=self.user, first_name='Me', last_name='A')
+        self.other = Employee.objects.create(business=self.profile, first_name='Other', last_name='B')
+        Message.objects.create(sender=self.other, recipient=self.me, text='Привет')
+
+    async def test_async_views_through_asgi_handler(self):
+        await self.async_client.aforce_login(self.user)
+        for name, args in [('dashboard', []), ('order_list', []), ('analytics', []),
+                           ('chat_list', []), ('chat_detail', [self.other.pk])]:
+            with self.subTest(name):
+                response = await self.async_client.get(reverse(name, args=args))
+                self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.get(reverse('chat_detail', args=[self.other.pk]))
+        self.assertEqual(response.context['contacts'], [self.other])
+        self.assertFalse(await Message.objects.filter(is_read=False).aexists())
+
+    async def test_async_analytics_matches_sync(self):
+        expected = await sync_to_async(business_analytics)(self.profile)
+        self.assertEqual(await abusiness_analytics(self.profile), expected)
+
+    async def test_middlewares_run_natively_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        await sync_to_async(self.client.force_login)(self.user)
+        sync_response = await sync_to_async(self.client.get)(reverse('analytics'))
+        await cache.aclear()
+        response = await self.async_client.get(reverse('analytics'))
+        request = response.asgi_request
+        self.assertEqual(request.tenant.business_id, self.profile.pk)
+        # Счётчик подключён в потоке async ORM: видит те же запросы, что и под WSGI
+        self.assertEqual(request.query_stats.count, sync_response.wsgi_request.query_stats.count)
+        self.assertGreater(request.query_stats.count, 0)
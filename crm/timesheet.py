@@ -0,0 +1,137 @@
+import zoneinfo
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Employee, WorkDay, WorkLog
+
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def session_state(log):
+    """Поля сессии, от которых зависит её вклад в табель"""
+    return (log.employee_id, log.start_time, log.end_time)
+
+
+def zone(name):
+    """Пояс из BusinessProfile.timezone; пусто — settings.TIME_ZONE"""
+    return zoneinfo.ZoneInfo(name or settings.TIME_ZONE)
+
+
+def business_tz(employee_id):
+    """Часовой пояс бизнеса сотрудника"""
+    return zone(Employee.objects.filter(pk=employee_id).values_list('business__timezone', flat=True).first())
+
+
+def split_by_day(start, end, tz):
+    """
+    {день: секунды} для интервала [start, end), разрезанного по полуночам
+    в поясе tz (с учётом перехода на летнее время).
+    """
+    result = defaultdict(int)
+    cursor = start
+    while cursor < end:
+        day = cursor.astimezone(tz).date()
+        midnight = datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+        boundary = min(end, midnight)
+        # Разность в UTC: у двух моментов с одним ZoneInfo Python вычитает
+        # показания часов и теряет час перехода на летнее/зимнее время
+        elapsed = boundary.astimezone(dt_timezone.utc) - cursor.astimezone(dt_timezone.utc)
+        result[day] += int(elapsed.total_seconds())
+        cursor = boundary
+    return result
+
+
+def contribution(state, tz):
+    """Вклад завершённой сессии: {(employee_id, day): секунды}"""
+    employee_id, start, end = state
+    if end is None or start is None:
+        return {}
+    return {(employee_id, day): seconds for day, seconds in split_by_day(start, end, tz).items()}
+
+
+def apply_deltas(deltas, create=True):
+    """Прибавляет секунды к строкам табеля атомарными UPDATE ... SET x = x + d"""
+    with transaction.atomic():
+        for (employee_id, day), seconds in deltas.items():
+            if not seconds:
+                continue
+            rows = WorkDay.objects.filter(employee_id=employee_id, day=day)
+            if not rows.update(seconds=F('seconds') + seconds) and create:
+                WorkDay.objects.get_or_create(employee_id=employee_id, day=day)
+                rows.update(seconds=F('seconds') + seconds)
+
+
+def session_changed(log, old_state):
+    """Пересчитывает вклад сессии после закрытия или правки"""
+    new_state = session_state(log)
+    if new_state == old_state:
+        return
+    deltas = defaultdict(int)
+    if old_state is not None and old_state[2] is not None:
+        for key, seconds in contribution(old_state, business_tz(old_state[0])).items():
+            deltas[key] -= seconds
+    if log.end_time is not None:
+        for key, seconds in contribution(new_state, business_tz(log.employee_id)).items():
+            deltas[key] += seconds
+    apply_deltas(deltas)
+
+
+def session_deleted(log, old_state):
+    """Убирает вклад удалённой сессии"""
+    if old_state is None or old_state[2] is None:
+        return
+    deltas = {key: -seconds for key, seconds in contribution(old_state, business_tz(old_state[0])).items()}
+    apply_deltas(deltas, create=False)
+
+
+def month_timesheet(employee, first_day, tz):
+    """
+    [(день, timedelta)] за месяц: строки WorkDay (до 31) плюс открытая
+    сессия, разрезанная по дням до текущего момента.
+    """
+    following = (first_day + timedelta(days=32)).replace(day=1)
+    days = defaultdict(int)
+    rows = employee.work_days.filter(day__gte=first_day, day__lt=following).values_list('day', 'seconds')
+    for day, seconds in rows:
+        days[day] += seconds
+
+    open_log = employee.work_logs.filter(end_time__isnull=True).first()
+    if open_log is not None:
+        for day, seconds in split_by_day(open_log.start_time, timezone.now(), tz).items():
+            if first_day <= day < following:
+                days[day] += seconds
+
+    return [(day, timedelta(seconds=days[day])) for day in sorted(days) if days[day]]
+
+
+def rebuild_timesheet(business_ids=None):
+    """
+    Полный пересчёт табеля по завершённым сессиям.
+    business_ids=None — для всех бизнесов.
+    """
+    logs = WorkLog.objects.filter(end_time__isnull=False)
+    if business_ids is not None:
+        logs = logs.filter(employee__business_id__in=business_ids)
+
+    rows = defaultdict(int)
+    sessions = logs.values_list('employee_id', 'start_time', 'end_time', 'employee__business__timezone')
+    for employee_id, start, end, tz_name in sessions.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        for key, seconds in contribution((employee_id, start, end), zone(tz_name)).items():
+            rows[key] += seconds
+
+    with transaction.atomic():
+        existing = WorkDay.objects.all()
+        if business_ids is not None:
+            existing = existing.filter(employee__business_id__in=business_ids)
+        existing.delete()
+        WorkDay.objects.bulk_create(
+            [WorkDay(employee_id=employee_id, day=day, seconds=seconds) for (employee_id, day), seconds in rows.items()],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+    return len(rows)
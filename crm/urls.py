@@ -15,6 +15,7 @@ urlpatterns = [
     # Клиенты
     path('clients/', views.client_list, name='client_list'),
     path('clients/add/', views.client_add, name='client_add'),
+    path('clients/import/', views.client_import, name='client_import'),
     path('clients/<int:pk>/', views.client_detail, name='client_detail'),
     path('clients/<int:pk>/edit/', views.client_edit, name='client_edit'),
     path('clients/<int:pk>/delete/', views.client_delete, name='client_delete'),
@@ -29,6 +30,10 @@ urlpatterns = [
     # Экспорт
     path('export/clients/', views.export_clients, name='export_clients'),
     path('export/orders/', views.export_orders, name='export_orders'),
+    path('export/payroll/', views.export_payroll, name='export_payroll'),
+    path('export/<str:kind>/jobs/', views.export_job_create, name='export_job_create'),
+    path('export/jobs/<int:pk>/', views.export_job_status, name='export_job_status'),
+    path('export/jobs/<int:pk>/download/', views.export_job_download, name='export_job_download'),
     
     # Аналитика
     path('analytics/', views.analytics, name='analytics'),
@@ -47,6 +52,10 @@ urlpatterns = [
     # Чат
     path('chat/', views.chat_list, name='chat_list'),
     path('chat/<int:employee_pk>/', views.chat_detail, name='chat_detail'),
+    path('chat/<int:employee_pk>/history/', views.chat_history, name='chat_history'),
+    path('chat/<int:employee_pk>/send/', views.chat_send, name='chat_send'),
+    path('chat/<int:employee_pk>/stream/', views.chat_stream, name='chat_stream'),
+    path('chat/<int:employee_pk>/poll/', views.chat_poll, name='chat_poll'),
     
     # Время работы
     path('work/start/', views.start_work, name='start_work'),
@@ -54,6 +63,9 @@ urlpatterns = [
     path('work/report/', views.work_time_report, name='work_time_report'),
     path('work/employee/<int:employee_pk>/', views.employee_work_time, name='employee_work_time'),
     
+    # Метрики Prometheus
+    path('metrics', views.metrics, name='metrics'),
+    
     # Язык
     path('language/<str:lang>/', views.change_language, name='change_language'),
 ]
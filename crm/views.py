@@ -1,17 +1,37 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, PasswordResetForm, SetPasswordForm
 from django.contrib.auth.models import User
 from django.db.models import Q, Sum, Count, Avg
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
 from django.utils import translation
 from django.utils.timezone import now
 from datetime import timedelta, datetime
-from openpyxl import Workbook
 import json
-from .models import BusinessProfile, Client, Order, Comment, Employee, Message, WorkLog, EmployeeInvitation
+import secrets
+from .models import BusinessProfile, Client, Order, Comment, Employee, Message, WorkLog, EmployeeInvitation, ExportJob
 from .forms import RegisterForm, ClientForm, OrderForm, CommentForm
+from .cache import acached_for_business
+from .chat import (
+    ahistory_page, event_stream, history_page, inbox, message_payload, parse_message_id, realtime_enabled,
+    wait_for_messages,
+)
+from .counters import alive_counters
+from .exports import EXPORTS, FORMATS, WORKBOOK_FORMATS, XLSX_CONTENT_TYPE, client_export, order_export, payroll_export, export_response, request_export, export_storage
+from .imports import import_clients, limit_rows, read_rows
+from .metrics import PROMETHEUS_CONTENT_TYPE, collect as collect_metrics, render as render_metrics
+from .pagination import akeyset_paginate, keyset_paginate
+from .search import search_clients
+from .stats import abusiness_analytics
+from .timesheet import month_timesheet
+from .worktime import day_range, logs_in_range, month_range, start_session, stop_session, totals_by_employee
+
+# Размер страницы для списков
+ORDERS_PER_PAGE = 50
+CLIENTS_PER_PAGE = 50
+WORK_LOGS_PER_PAGE = 50
 
 
 def register_view(request):
@@ -124,32 +144,34 @@ def password_reset_confirm_view(request, uid, token):
 
 
 @login_required
-def dashboard(request):
+async def dashboard(request):
     """Главная страница"""
-    profile = request.user.businessprofile
-    clients_count = Client.objects.filter(business=profile).count()
-    orders_new = Order.objects.filter(client__business=profile, status='new').count()
-    orders_in_progress = Order.objects.filter(client__business=profile, status='in_progress').count()
+    profile = request.tenant.profile
+    # Счётчики хранятся в профиле (без COUNT); профиль в request.tenant
+    # может быть из кэша, поэтому сами счётчики читаем свежими по PK
+    counts = await alive_counters(profile.pk)
     
     return render(request, 'crm/dashboard.html', {
         'profile': profile,
-        'clients_count': clients_count,
-        'orders_new': orders_new,
-        'orders_in_progress': orders_in_progress,
+        'clients_count': counts['clients_count'],
+        'orders_new': counts['orders_new_count'],
+        'orders_in_progress': counts['orders_in_progress_count'],
     })
 
 
 @login_required
 def client_list(request):
     """Список клиентов"""
-    profile = request.user.businessprofile
-    clients = Client.objects.filter(business=profile)
+    profile = request.tenant.profile
+    clients = Client.objects.filter(business=profile).annotate(orders_count=Count('orders'))
     
     search = request.GET.get('search', '')
     if search:
-        clients = clients.filter(Q(name__icontains=search) | Q(phone__icontains=search))
+        clients = search_clients(clients, search)
     
-    return render(request, 'crm/client_list.html', {'clients': clients, 'search': search})
+    page = keyset_paginate(clients, request.GET.get('cursor'), per_page=CLIENTS_PER_PAGE)
+    
+    return render(request, 'crm/client_list.html', {'clients': page, 'page': page, 'search': search})
 
 
 @login_required
@@ -159,7 +181,7 @@ def client_add(request):
         form = ClientForm(request.POST)
         if form.is_valid():
             client = form.save(commit=False)
-            client.business = request.user.businessprofile
+            client.business = request.tenant.profile
             client.save()
             return redirect('client_list')
     else:
@@ -167,10 +189,31 @@ def client_add(request):
     return render(request, 'crm/client_form.html', {'form': form, 'title': 'Добавить клиента'})
 
 
+@login_required
+def client_import(request):
+    """
+    Массовый импорт клиентов из CSV/XLSX. В запросе — не больше
+    CLIENT_IMPORT_MAX_ROWS строк, чтобы уложиться в таймаут воркера;
+    файлы больше загружает команда import_clients.
+    """
+    result = None
+    if request.method == 'POST' and request.FILES.get('file'):
+        upload = request.FILES['file']
+        try:
+            rows = limit_rows(read_rows(upload, upload.name), settings.CLIENT_IMPORT_MAX_ROWS)
+            result = import_clients(request.tenant.profile, rows)
+        except ValueError as exc:
+            from django.contrib import messages
+            messages.error(request, str(exc))
+    return render(request, 'crm/client_import.html', {
+        'result': result, 'max_rows': settings.CLIENT_IMPORT_MAX_ROWS,
+    })
+
+
 @login_required
 def client_edit(request, pk):
     """Редактировать клиента"""
-    client = get_object_or_404(Client, pk=pk, business=request.user.businessprofile)
+    client = get_object_or_404(Client, pk=pk, business=request.tenant.profile)
     if request.method == 'POST':
         form = ClientForm(request.POST, instance=client)
         if form.is_valid():
@@ -184,7 +227,7 @@ def client_edit(request, pk):
 @login_required
 def client_detail(request, pk):
     """Детали клиента и его заявки"""
-    client = get_object_or_404(Client, pk=pk, business=request.user.businessprofile)
+    client = get_object_or_404(Client, pk=pk, business=request.tenant.profile)
     orders = client.orders.all()
     return render(request, 'crm/client_detail.html', {'client': client, 'orders': orders})
 
@@ -192,7 +235,7 @@ def client_detail(request, pk):
 @login_required
 def client_delete(request, pk):
     """Удалить клиента"""
-    client = get_object_or_404(Client, pk=pk, business=request.user.businessprofile)
+    client = get_object_or_404(Client, pk=pk, business=request.tenant.profile)
     if request.method == 'POST':
         client.delete()
         return redirect('client_list')
@@ -202,7 +245,7 @@ def client_delete(request, pk):
 @login_required
 def order_add(request, client_pk):
     """Добавить заявку"""
-    client = get_object_or_404(Client, pk=client_pk, business=request.user.businessprofile)
+    client = get_object_or_404(Client, pk=client_pk, business=request.tenant.profile)
     if request.method == 'POST':
         form = OrderForm(request.POST)
         if form.is_valid():
@@ -218,7 +261,7 @@ def order_add(request, client_pk):
 @login_required
 def order_edit(request, pk):
     """Редактировать заявку"""
-    order = get_object_or_404(Order, pk=pk, client__business=request.user.businessprofile)
+    order = get_object_or_404(Order, pk=pk, business=request.tenant.profile)
     if request.method == 'POST':
         form = OrderForm(request.POST, instance=order)
         if form.is_valid():
@@ -232,7 +275,7 @@ def order_edit(request, pk):
 @login_required
 def order_detail(request, pk):
     """Детали заявки с комментариями"""
-    order = get_object_or_404(Order, pk=pk, client__business=request.user.businessprofile)
+    order = get_object_or_404(Order, pk=pk, business=request.tenant.profile)
     comments = order.comments.all()
     
     if request.method == 'POST':
@@ -251,7 +294,7 @@ def order_detail(request, pk):
 @login_required
 def order_delete(request, pk):
     """Удалить заявку"""
-    order = get_object_or_404(Order, pk=pk, client__business=request.user.businessprofile)
+    order = get_object_or_404(Order, pk=pk, business=request.tenant.profile)
     client_pk = order.client.pk
     if request.method == 'POST':
         order.delete()
@@ -260,74 +303,100 @@ def order_delete(request, pk):
 
 
 @login_required
-def order_list(request):
+async def order_list(request):
     """Список всех заявок"""
-    profile = request.user.businessprofile
-    orders = Order.objects.filter(client__business=profile)
+    profile = request.tenant.profile
+    orders = Order.objects.filter(business=profile).select_related('client')
     
     status = request.GET.get('status', '')
     if status:
         orders = orders.filter(status=status)
     
-    return render(request, 'crm/order_list.html', {'orders': orders, 'status': status})
+    # Keyset-пагинация: постоянное время ответа на любой странице
+    page = await akeyset_paginate(orders, request.GET.get('cursor'), per_page=ORDERS_PER_PAGE)
+    
+    return render(request, 'crm/order_list.html', {'orders': page, 'page': page, 'status': status})
+
+
+def _export_format(request):
+    """Формат экспорта из ?format= (xlsx по умолчанию)"""
+    fmt = request.GET.get('format', 'xlsx')
+    if fmt not in FORMATS:
+        raise Http404
+    return fmt
 
 
 @login_required
 def export_clients(request):
-    """Экспорт клиентов в Excel"""
-    profile = request.user.businessprofile
-    clients = Client.objects.filter(business=profile)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Клиенты"
-    ws.append(['Имя', 'Телефон', 'Заметки', 'Дата добавления'])
-    
-    for client in clients:
-        ws.append([client.name, client.phone, client.notes, client.created_at.strftime('%d.%m.%Y')])
-    
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=clients.xlsx'
-    wb.save(response)
-    return response
+    """Экспорт клиентов (xlsx, csv или parquet)"""
+    profile = request.tenant.profile
+    return export_response(client_export(profile), _export_format(request))
 
 
 @login_required
 def export_orders(request):
-    """Экспорт заявок в Excel"""
-    profile = request.user.businessprofile
-    orders = Order.objects.filter(client__business=profile)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Заявки"
-    ws.append(['Клиент', 'Телефон', 'Услуга', 'Статус', 'Цена', 'Дата'])
-    
-    status_map = {'new': 'Новая', 'in_progress': 'В работе', 'done': 'Завершена'}
-    
-    for order in orders:
-        ws.append([
-            order.client.name,
-            order.client.phone,
-            order.service,
-            status_map.get(order.status, order.status),
-            float(order.price) if order.price else '',
-            order.created_at.strftime('%d.%m.%Y')
-        ])
-    
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=orders.xlsx'
-    wb.save(response)
-    return response
+    """Экспорт заявок (xlsx, csv или parquet)"""
+    profile = request.tenant.profile
+    return export_response(order_export(profile), _export_format(request))
+
+
+def _export_job_json(job):
+    from django.urls import reverse
+    data = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'error': job.error,
+        'status_url': reverse('export_job_status', args=[job.pk]),
+    }
+    if job.status == 'done':
+        data['download_url'] = reverse('export_job_download', args=[job.pk])
+    return data
+
+
+@login_required
+def export_job_create(request, kind):
+    """Поставить экспорт в очередь (или вернуть готовый для тех же данных)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if kind not in EXPORTS:
+        raise Http404
+    job = request_export(request.tenant.profile, kind)
+    return JsonResponse(_export_job_json(job), status=202 if job.status != 'done' else 200)
+
+
+@login_required
+def export_job_status(request, pk):
+    """Статус и прогресс фонового экспорта"""
+    job = get_object_or_404(ExportJob, pk=pk, business=request.tenant.profile)
+    return JsonResponse(_export_job_json(job))
+
+
+@login_required
+def export_job_download(request, pk):
+    """Скачать готовый файл экспорта"""
+    job = get_object_or_404(ExportJob, pk=pk, business=request.tenant.profile, status='done')
+    storage = export_storage()
+    if not job.file or not storage.exists(job.file):
+        raise Http404
+    return FileResponse(
+        storage.open(job.file, 'rb'),
+        as_attachment=True,
+        filename=f'{job.kind}.xlsx',
+        content_type=XLSX_CONTENT_TYPE,
+    )
 
 
 @login_required
 def change_language(request, lang):
     """Смена языка интерфейса"""
     if lang in ['ru', 'tk', 'en']:
-        profile = request.user.businessprofile
+        profile = request.tenant.profile
         profile.language = lang
-        profile.save()
+        profile.save(update_fields=['language'])
         translation.activate(lang)
         request.session['_language'] = lang
         response = redirect(request.META.get('HTTP_REFERER', 'dashboard'))
@@ -339,65 +408,19 @@ def change_language(request, lang):
 # ==================== АНАЛИТИКА ====================
 
 @login_required
-def analytics(request):
+async def analytics(request):
     """Страница аналитики и статистики"""
-    profile = request.user.businessprofile
-    
-    # Основная статистика
-    total_clients = Client.objects.filter(business=profile).count()
-    total_orders = Order.objects.filter(client__business=profile).count()
-    total_revenue = Order.objects.filter(client__business=profile, status='done').aggregate(Sum('price'))['price__sum'] or 0
-    
-    # Статистика по статусам
-    orders_new = Order.objects.filter(client__business=profile, status='new').count()
-    orders_in_progress = Order.objects.filter(client__business=profile, status='in_progress').count()
-    orders_done = Order.objects.filter(client__business=profile, status='done').count()
-    
-    # Среднее время выполнения
-    completed_orders = Order.objects.filter(
-        client__business=profile, 
-        status='done', 
-        completed_at__isnull=False
-    )
-    if completed_orders.exists():
-        total_days = 0
-        for order in completed_orders:
-            days = (order.completed_at - order.created_at).days
-            total_days += days
-        avg_execution_time = round(total_days / completed_orders.count(), 1)
-    else:
-        avg_execution_time = 0
-    
-    # Доход по месяцам (последние 6 месяцев)
-    months_back = 6
-    revenue_by_month = []
-    months_labels = []
-    
-    for i in range(months_back, 0, -1):
-        date = now() - timedelta(days=30*i)
-        month_start = date.replace(day=1)
-        if i == 1:
-            month_end = now()
-        else:
-            month_end = (date.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        
-        revenue = Order.objects.filter(
-            client__business=profile,
-            status='done',
-            completed_at__range=[month_start, month_end]
-        ).aggregate(Sum('price'))['price__sum'] or 0
-        
-        revenue_by_month.append(float(revenue))
-        months_labels.append(month_start.strftime('%b'))
+    profile = request.tenant.profile
+    stats = await acached_for_business(profile.pk, 'analytics', lambda: abusiness_analytics(profile))
     
     # Распределение по статусам
     status_distribution = {
-        'Новые': orders_new,
-        'В работе': orders_in_progress,
-        'Завершены': orders_done,
+        'Новые': stats['orders_new'],
+        'В работе': stats['orders_in_progress'],
+        'Завершены': stats['orders_done'],
     }
     # Сотрудники и заполненность
-    employees_count = Employee.objects.filter(business=profile).count()
+    employees_count = stats['employees_count']
     max_employees = getattr(profile, 'max_employees', 20) or 20
     try:
         employees_percent = int((employees_count / max_employees) * 100)
@@ -406,18 +429,18 @@ def analytics(request):
     
     context = {
         'profile': profile,
-        'total_clients': total_clients,
-        'total_orders': total_orders,
-        'total_revenue': float(total_revenue),
-        'avg_execution_time': avg_execution_time,
-        'orders_new': orders_new,
-        'orders_in_progress': orders_in_progress,
-        'orders_done': orders_done,
+        'total_clients': stats['total_clients'],
+        'total_orders': stats['total_orders'],
+        'total_revenue': stats['total_revenue'],
+        'avg_execution_time': stats['avg_execution_time'],
+        'orders_new': stats['orders_new'],
+        'orders_in_progress': stats['orders_in_progress'],
+        'orders_done': stats['orders_done'],
         'employees_count': employees_count,
         'max_employees': max_employees,
         'employees_percent': employees_percent,
-        'revenue_by_month': json.dumps(revenue_by_month),
-        'months_labels': json.dumps(months_labels),
+        'revenue_by_month': json.dumps(stats['revenue_by_month']),
+        'months_labels': json.dumps(stats['months_labels']),
         'status_distribution': json.dumps(status_distribution),
     }
     
@@ -429,7 +452,7 @@ def analytics(request):
 @login_required
 def employee_list(request):
     """Список сотрудников"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     employees = Employee.objects.filter(business=profile)
     return render(request, 'crm/employee_list.html', {'employees': employees})
 
@@ -437,7 +460,7 @@ def employee_list(request):
 @login_required
 def employee_add(request):
     """Добавить сотрудника"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     if request.method == 'POST':
         first_name = request.POST.get('first_name')
         last_name = request.POST.get('last_name')
@@ -471,7 +494,7 @@ def employee_add(request):
 @login_required
 def employee_edit(request, pk):
     """Редактировать сотрудника"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     employee = get_object_or_404(Employee, pk=pk, business=profile)
     
     if request.method == 'POST':
@@ -494,7 +517,7 @@ def employee_edit(request, pk):
 @login_required
 def employee_delete(request, pk):
     """Удалить сотрудника"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     employee = get_object_or_404(Employee, pk=pk, business=profile)
     
     if request.method == 'POST':
@@ -519,7 +542,7 @@ def employee_delete(request, pk):
 @login_required
 def employee_invite(request):
     """Создать и отправить приглашение сотруднику"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     
     if request.method == 'POST':
         email = request.POST.get('email')
@@ -584,7 +607,7 @@ def employee_invite(request):
 @login_required
 def employee_invitations(request):
     """Список отправленных приглашений"""
-    profile = request.user.businessprofile
+    profile = request.tenant.profile
     invitations = EmployeeInvitation.objects.filter(business=profile).order_by('-created_at')
     
     return render(request, 'crm/employee_invitations.html', {'invitations': invitations})
@@ -655,15 +678,13 @@ def register_by_invitation(request, token):
 
 # ==================== ЧАТ ====================
 
-@login_required
-def chat_list(request):
-    """Список чатов"""
-    profile = request.user.businessprofile
+def _current_employee(request):
+    """Сотрудник текущего пользователя; создаётся автоматически, если записи нет"""
+    profile = request.tenant.profile
     try:
-        current_employee = Employee.objects.get(business=profile, user=request.user)
+        return Employee.objects.get(business=profile, user=request.user)
     except Employee.DoesNotExist:
-        # Если для текущего пользователя нет записи Employee, создаём её автоматически
-        current_employee = Employee.objects.create(
+        return Employee.objects.create(
             business=profile,
             user=request.user,
             first_name=(request.user.first_name or request.user.username),
@@ -672,138 +693,207 @@ def chat_list(request):
             role='manager',
             is_active=True,
         )
-    
-    # Получить все сообщения (входящие и исходящие)
-    conversations = Employee.objects.filter(business=profile).exclude(user=request.user)
-    
-    context = {
-        'conversations': conversations,
-        'current_employee': current_employee,
-    }
-    return render(request, 'crm/chat_list.html', context)
 
 
-@login_required
-def chat_detail(request, employee_pk):
-    """Детали чата с сотрудником"""
-    profile = request.user.businessprofile
-    
+async def _acurrent_employee(request):
+    """_current_employee для async-views"""
+    profile = request.tenant.profile
+    user = request.user
     try:
-        current_employee = Employee.objects.get(business=profile, user=request.user)
+        return await Employee.objects.aget(business=profile, user=user)
     except Employee.DoesNotExist:
-        # Автоматически создаём запись сотрудника для текущего пользователя
-        current_employee = Employee.objects.create(
+        return await Employee.objects.acreate(
             business=profile,
-            user=request.user,
-            first_name=(request.user.first_name or request.user.username),
-            last_name=(request.user.last_name or ''),
-            email=(request.user.email or ''),
+            user=user,
+            first_name=(user.first_name or user.username),
+            last_name=(user.last_name or ''),
+            email=(user.email or ''),
             role='manager',
             is_active=True,
         )
+
+
+def _chat_participants(request, employee_pk):
+    if request.tenant is None:
+        raise Http404
+    other_employee = get_object_or_404(Employee, pk=employee_pk, business=request.tenant.profile)
+    return _current_employee(request), other_employee
+
+
+async def _achat_participants(request, employee_pk):
+    """_chat_participants для async-views"""
+    if request.tenant is None:
+        raise Http404
+    other_employee = await aget_object_or_404(Employee, pk=employee_pk, business=request.tenant.profile)
+    return await _acurrent_employee(request), other_employee
+
+
+async def _acontacts(request):
+    """Коллеги для списка контактов чата (без самого пользователя)"""
+    employees = Employee.objects.filter(business=request.tenant.profile).exclude(user_id=request.user.pk)
+    return [employee async for employee in employees]
+
+
+@login_required
+async def chat_list(request):
+    """Входящие: коллеги с последним сообщением и числом непрочитанных"""
+    current_employee = await _acurrent_employee(request)
     
-    other_employee = get_object_or_404(Employee, pk=employee_pk, business=profile)
-    
-    # Получить все сообщения между этими двумя сотрудниками
-    messages = Message.objects.filter(
-        (Q(sender=current_employee, recipient=other_employee) | Q(sender=other_employee, recipient=current_employee))
-    ).order_by('created_at')
-    
-    # Отметить входящие сообщения как прочитанные
-    Message.objects.filter(sender=other_employee, recipient=current_employee, is_read=False).update(is_read=True)
+    context = {
+        'conversations': [employee async for employee in inbox(current_employee)],
+        'current_employee': current_employee,
+    }
+    return render(request, 'crm/chat_list.html', context)
+
+
+@login_required
+async def chat_detail(request, employee_pk):
+    """Детали чата с сотрудником"""
+    current_employee, other_employee = await _achat_participants(request, employee_pk)
     
     if request.method == 'POST':
-        text = request.POST.get('text')
+        # Отправка без JavaScript; страница с JS шлёт сообщения в chat_send
+        text = request.POST.get('text', '')
         if text.strip():
-            Message.objects.create(
+            await Message.objects.acreate(
                 sender=current_employee,
                 recipient=other_employee,
                 text=text
             )
             return redirect('chat_detail', employee_pk=employee_pk)
     
+    # Только последние сообщения; прочитанными отмечаются только они,
+    # более старые подгружает chat_history
+    messages, has_more = await ahistory_page(current_employee, other_employee)
+    contacts = await _acontacts(request)
     context = {
         'current_employee': current_employee,
         'other_employee': other_employee,
-        'messages': messages,
+        'contacts': contacts,
+        'realtime': realtime_enabled(),
+        'poll_interval_ms': int(settings.CHAT_SHORT_POLL_INTERVAL * 1000),
+        # Не 'messages': это имя занято сообщениями django.contrib.messages в base.html
+        'chat_messages': messages,
+        'has_more': has_more,
+        'first_message_id': messages[0].pk if messages else 0,
+        'last_message_id': messages[-1].pk if messages else 0,
     }
     return render(request, 'crm/chat_detail.html', context)
 
+
+@login_required
+def chat_history(request, employee_pk):
+    """Страница переписки в JSON: ?before_id= — старее, ?after_id= — новее"""
+    current_employee, other_employee = _chat_participants(request, employee_pk)
+    before_id = parse_message_id(request.GET.get('before_id'), default=None)
+    after_id = parse_message_id(request.GET.get('after_id'), default=None)
+    messages, has_more = history_page(current_employee, other_employee, before_id=before_id, after_id=after_id)
+    return JsonResponse({
+        'messages': [message_payload(m) for m in messages],
+        'has_more': has_more,
+    })
+
+
+@login_required
+def chat_send(request, employee_pk):
+    """Отправка сообщения, ответ — JSON сообщения"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    current_employee, other_employee = _chat_participants(request, employee_pk)
+    text = request.POST.get('text', '')
+    if not text.strip():
+        return JsonResponse({'error': 'Пустое сообщение'}, status=400)
+    message = Message.objects.create(sender=current_employee, recipient=other_employee, text=text)
+    # Подписчики получат уведомление после коммита (crm/signals.py)
+    return JsonResponse(message_payload(message), status=201)
+
+
+@login_required
+async def chat_stream(request, employee_pk):
+    """Новые сообщения переписки через Server-Sent Events (только под ASGI)"""
+    if not realtime_enabled():
+        raise Http404
+    current_employee, other_employee = await _achat_participants(request, employee_pk)
+    after_id = parse_message_id(request.headers.get('Last-Event-ID') or request.GET.get('after'))
+    response = StreamingHttpResponse(
+        event_stream(current_employee, other_employee, after_id),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+async def chat_poll(request, employee_pk):
+    """Long-poll для браузеров и прокси без поддержки SSE (только под ASGI)"""
+    if not realtime_enabled():
+        raise Http404
+    current_employee, other_employee = await _achat_participants(request, employee_pk)
+    after_id = parse_message_id(request.GET.get('after'))
+    messages = await wait_for_messages(current_employee, other_employee, after_id)
+    return JsonResponse({'messages': [message_payload(m) for m in messages]})
+
 # ==================== ВРЕМЯ РАБОТЫ ====================
 
+def _work_session_json(log, **extra):
+    return {
+        'active': log is not None and log.end_time is None,
+        'started_at': log.start_time.isoformat() if log else None,
+        'ended_at': log.end_time.isoformat() if log and log.end_time else None,
+        **extra,
+    }
+
+
+def _work_employee(request):
+    if request.tenant is None:
+        return None
+    return request.tenant.profile.employees.filter(user=request.user).first()
+
+
 @login_required
 def start_work(request):
-    """Начать рабочий день"""
-    try:
-        business = request.user.businessprofile
-        # Пытаемся найти сотрудника по user
-        try:
-            employee = business.employees.get(user=request.user)
-        except Employee.DoesNotExist:
-            # Если не найдено, возвращаемся назад с ошибкой
-            from django.contrib import messages
-            messages.error(request, 'Вы не добавлены как сотрудник компании')
-            return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
-        
-        # Проверяем, нет ли активной сессии работы
-        active_log = employee.work_logs.filter(end_time__isnull=True).first()
-        
-        if not active_log:
-            WorkLog.objects.create(
-                employee=employee,
-                start_time=now()
-            )
-            from django.contrib import messages
-            messages.success(request, f'Рабочий день начат! ✓')
-        else:
-            from django.contrib import messages
-            messages.warning(request, 'У вас уже есть активная рабочая сессия')
-            
-    except BusinessProfile.DoesNotExist:
-        pass
-    
-    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
+    """Начать рабочий день (JSON)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    employee = _work_employee(request)
+    if employee is None:
+        return JsonResponse({'error': 'Вы не добавлены как сотрудник компании'}, status=403)
+    
+    log = start_session(employee)
+    if log is None:
+        return JsonResponse(
+            _work_session_json(None, active=True, error='У вас уже есть активная рабочая сессия'),
+            status=409,
+        )
+    return JsonResponse(_work_session_json(log), status=201)
 
 
 @login_required
 def end_work(request):
-    """Завершить рабочий день"""
-    try:
-        business = request.user.businessprofile
-        # Пытаемся найти сотрудника по user
-        try:
-            employee = business.employees.get(user=request.user)
-        except Employee.DoesNotExist:
-            # Если не найдено, возвращаемся назад с ошибкой
-            from django.contrib import messages
-            messages.error(request, 'Вы не добавлены как сотрудник компании')
-            return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
-        
-        # Находим активную сессию работы
-        active_log = employee.work_logs.filter(end_time__isnull=True).first()
-        
-        if active_log:
-            active_log.end_time = now()
-            active_log.save()
-            from django.contrib import messages
-            messages.success(request, f'Рабочий день завершён! ✓')
-        else:
-            from django.contrib import messages
-            messages.warning(request, 'Нет активной рабочей сессии для завершения')
-            
-    except BusinessProfile.DoesNotExist:
-        pass
-    
-    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
+    """Завершить рабочий день (JSON)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    employee = _work_employee(request)
+    if employee is None:
+        return JsonResponse({'error': 'Вы не добавлены как сотрудник компании'}, status=403)
+    
+    log = stop_session(employee)
+    if log is None:
+        return JsonResponse(
+            _work_session_json(None, error='Нет активной рабочей сессии для завершения'),
+            status=409,
+        )
+    return JsonResponse(_work_session_json(log))
 
 
 @login_required
 def work_time_report(request):
     """Отчёт по времени работы сотрудников"""
-    business = request.user.businessprofile
+    business = request.tenant.profile
     
     # Проверяем подписку
-    if not business.is_subscription_valid():
+    if not request.tenant.subscription_valid:
         return redirect('blocked')
     
     # Только админ может смотреть все отчёты
@@ -814,8 +904,6 @@ def work_time_report(request):
     except Employee.DoesNotExist:
         return redirect('dashboard')
     
-    employees = business.employees.all()
-    
     # Получаем дату фильтрации (по умолчанию сегодня)
     from datetime import date
     filter_date = request.GET.get('date')
@@ -827,37 +915,72 @@ def work_time_report(request):
     else:
         filter_date = date.today()
     
-    # Получаем работу за выбранную дату
-    work_logs = WorkLog.objects.filter(
-        employee__business=business,
-        start_time__date=filter_date
-    ).select_related('employee').order_by('-start_time')
+    # Сессии, начатые в выбранный день: диапазон по start_time вместо __date
+    work_logs = logs_in_range(
+        WorkLog.objects.filter(employee__business=business), *day_range(filter_date, business.tzinfo),
+    )
+    
+    # Итоги по сотрудникам считает БД
+    totals = totals_by_employee(work_logs)
+    employee_totals = [
+        (employee, totals[employee.pk])
+        for employee in business.employees.filter(pk__in=totals).order_by('first_name', 'last_name')
+    ]
     
-    # Подсчитываем общее время работы по сотрудникам
-    employee_work_time = {}
-    for log in work_logs:
-        emp_id = log.employee.id
-        if emp_id not in employee_work_time:
-            employee_work_time[emp_id] = timedelta()
-        employee_work_time[emp_id] += log.duration
+    page = keyset_paginate(
+        work_logs.select_related('employee'), request.GET.get('cursor'),
+        per_page=WORK_LOGS_PER_PAGE, field='start_time',
+    )
     
     context = {
-        'employees': employees,
-        'work_logs': work_logs,
-        'employee_work_time': employee_work_time,
+        'work_logs': page,
+        'page': page,
+        'employee_totals': employee_totals,
         'filter_date': filter_date,
     }
     
     return render(request, 'crm/work_time_report.html', context)
 
 
+def _parse_day(value, default):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return default
+
+
+@login_required
+def export_payroll(request):
+    """Табель всех сотрудников за период (xlsx или csv): владелец бизнеса или админ"""
+    business = request.tenant.profile
+    if not request.tenant.subscription_valid:
+        return redirect('blocked')
+    # У владельца обычно нет записи Employee (или она с ролью manager после чата)
+    if request.user.pk != business.user_id and not business.employees.filter(user=request.user, role='admin').exists():
+        return redirect('dashboard')
+    
+    fmt = request.GET.get('format', 'xlsx')
+    if fmt not in WORKBOOK_FORMATS:
+        raise Http404
+    
+    # По умолчанию — текущий месяц по сегодняшний день
+    from django.utils.timezone import localdate
+    today = localdate(timezone=business.tzinfo)
+    start = _parse_day(request.GET.get('start'), today.replace(day=1))
+    end = _parse_day(request.GET.get('end'), today)
+    if end < start:
+        start, end = end, start
+    
+    return export_response(payroll_export(business, start, end), fmt, formats=WORKBOOK_FORMATS)
+
+
 @login_required
 def employee_work_time(request, employee_pk):
     """История времени работы конкретного сотрудника"""
-    business = request.user.businessprofile
+    business = request.tenant.profile
     
     # Проверяем подписку
-    if not business.is_subscription_valid():
+    if not request.tenant.subscription_valid:
         return redirect('blocked')
     
     employee = get_object_or_404(Employee, pk=employee_pk, business=business)
@@ -882,28 +1005,38 @@ def employee_work_time(request, employee_pk):
     else:
         filter_date = date.today()
     
-    # Получаем логи работы
-    start_of_month = filter_date.replace(day=1)
-    if filter_date.month == 12:
-        end_of_month = start_of_month.replace(year=start_of_month.year + 1, month=1, day=1) - timedelta(days=1)
-    else:
-        end_of_month = start_of_month.replace(month=start_of_month.month + 1, day=1) - timedelta(days=1)
-    
-    work_logs = employee.work_logs.filter(
-        start_time__date__gte=start_of_month,
-        start_time__date__lte=end_of_month
-    ).order_by('-start_time')
+    # Итоги по дням — из табеля WorkDay (до 31 строки), сессии месяца —
+    # полуоткрытый диапазон по start_time в поясе бизнеса
+    tz = business.tzinfo
+    daily_totals = month_timesheet(employee, filter_date.replace(day=1), tz)
+    work_logs = logs_in_range(employee.work_logs.all(), *month_range(filter_date, tz))
     
-    # Подсчитываем общее время работы в месяце
-    total_time = timedelta()
-    for log in work_logs:
-        total_time += log.duration
+    page = keyset_paginate(
+        work_logs, request.GET.get('cursor'),
+        per_page=WORK_LOGS_PER_PAGE, field='start_time',
+    )
     
     context = {
         'employee': employee,
-        'work_logs': work_logs,
-        'total_time': total_time,
+        'work_logs': page,
+        'page': page,
+        'total_time': sum((total for _, total in daily_totals), timedelta()),
+        'daily_totals': daily_totals,
         'filter_date': filter_date,
     }
     
-    return render(request, 'crm/employee_work_time.html', context)
\ No newline at end of file
+    return render(request, 'crm/employee_work_time.html', context)
+
+# ============================================
+# МЕТРИКИ
+# ============================================
+
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus (только с METRICS_TOKEN)"""
+    token = settings.METRICS_TOKEN
+    if not token:
+        # Без токена страницы нет: трафик по view не должен быть публичным
+        raise Http404
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(render_metrics(collect_metrics()), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,80 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from . import timesheet
+from .models import WorkLog
+
+
+def worked_duration():
+    """Длительность сессии в SQL; открытая сессия считается до текущего момента"""
+    return ExpressionWrapper(
+        Coalesce('end_time', Now()) - F('start_time'),
+        output_field=DurationField(),
+    )
+
+
+def _start_of_day(day, tz=None):
+    return timezone.make_aware(datetime.combine(day, time.min), tz)
+
+
+def day_range(day, tz=None):
+    """Полуоткрытый интервал [начало дня, начало следующего) в поясе tz (по умолчанию текущем)"""
+    return _start_of_day(day, tz), _start_of_day(day + timedelta(days=1), tz)
+
+
+def month_range(day, tz=None):
+    """Полуоткрытый интервал месяца, в котором лежит day"""
+    first = day.replace(day=1)
+    following = (first + timedelta(days=32)).replace(day=1)
+    return _start_of_day(first, tz), _start_of_day(following, tz)
+
+
+def logs_in_range(logs, start, end):
+    """
+    Сессии, начавшиеся в [start, end). Сравнение с голым start_time
+    (без __date) позволяет использовать индекс (employee, start_time).
+    """
+    return logs.filter(start_time__gte=start, start_time__lt=end)
+
+
+def totals_by_employee(logs):
+    """{employee_id: timedelta} одним GROUP BY"""
+    rows = logs.order_by().values('employee_id').annotate(total=Sum(worked_duration()))
+    return {row['employee_id']: row['total'] for row in rows}
+
+
+def start_session(employee, at=None):
+    """
+    Открывает рабочую сессию одним INSERT. Если открытая сессия уже есть,
+    вставку отклоняет частичный уникальный индекс — возвращаем None.
+    """
+    try:
+        with transaction.atomic():
+            return WorkLog.objects.create(employee=employee, start_time=at or timezone.now())
+    except IntegrityError:
+        return None
+
+
+def stop_session(employee, at=None):
+    """
+    Закрывает открытую сессию одним UPDATE ... RETURNING и возвращает её
+    (None, если открытой сессии нет). Повторный клик ничего не меняет.
+    Табель обновляется здесь же: сырой UPDATE не шлёт post_save.
+    """
+    table = connection.ops.quote_name(WorkLog._meta.db_table)
+    with transaction.atomic():
+        closed = list(WorkLog.objects.raw(
+            f'UPDATE {table} SET end_time = %s '
+            f'WHERE employee_id = %s AND end_time IS NULL RETURNING *',
+            [connection.ops.adapt_datetimefield_value(at or timezone.now()), employee.pk],
+        ))
+        if not closed:
+            return None
+        log = closed[0]
+        timesheet.session_changed(log, (log.employee_id, log.start_time, None))
+    log._timesheet_state = timesheet.session_state(log)
+    return log
@@ -1,6 +1,7 @@
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 import os
+import tempfile
 from decouple import config, Csv
 import dj_database_url
 
@@ -31,6 +32,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'crm.middleware.MetricsMiddleware',
+    'crm.middleware.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -38,8 +41,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'crm.middleware.UserLanguageMiddleware',
-    'crm.middleware.SubscriptionCheckMiddleware',
+    'crm.middleware.TenantMiddleware',
+    'crm.middleware.ProfilingMiddleware',
 ]
 
 
@@ -65,12 +68,17 @@ TEMPLATES = [
 WSGI_APPLICATION = 'crm_project.wsgi.application'
 
 
+# asgi — gunicorn с воркерами uvicorn (см. gunicorn.conf.py), wsgi — синхронные
+SERVER_MODE = config('SERVER_MODE', default='wsgi')
+
 # Database Configuration для Production (Railway) и Development
 if config('DATABASE_URL', default=None):
     DATABASES = {
         'default': dj_database_url.config(
             default=config('DATABASE_URL'),
-            conn_max_age=600
+            # Под ASGI соединения живут в потоках sync_to_async и не
+            # переиспользуются между запросами — постоянные не нужны
+            conn_max_age=config('CONN_MAX_AGE', default=0 if SERVER_MODE == 'asgi' else 600, cast=int),
         )
     }
 else:
@@ -118,14 +126,116 @@ LOCALE_PATHS = [
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Статику (включая Bootstrap и иконки из crm/static/crm/vendor) отдаёт
+# WhiteNoise: collectstatic добавляет хэш содержимого в имена файлов и
+# заранее сжимает их в .gz и .br (brotli — при установленном пакете
+# Brotli), а файлы с хэшем отдаются с Cache-Control: max-age=10 лет, immutable.
+# Тесты, рендерящие шаблоны без collectstatic, подменяют хранилище через
+# override_settings (см. PLAIN_STATIC_STORAGES в crm/tests.py).
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Готовые файлы фоновых экспортов. run_export_worker запускает gunicorn.conf.py
+# в том же контейнере, что и веб (EXPORT_WORKER_IN_WEB), — каталог общий
+EXPORT_ROOT = config('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+# Импорт клиентов через веб: больше строк — только командой import_clients
+CLIENT_IMPORT_MAX_ROWS = config('CLIENT_IMPORT_MAX_ROWS', default=5000, cast=int)
+# Задача в статусе running дольше этого (сек.) считается брошенной упавшим воркером
+EXPORT_JOB_TIMEOUT = config('EXPORT_JOB_TIMEOUT', default=1800, cast=int)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Whitenoise для serve static файлов
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+# Кэш (аналитика, главная страница, контекст бизнеса). Сигналы сбрасывают
+# ключи при изменениях, поэтому кэш должен быть общим для всех воркеров
+# gunicorn: по умолчанию файловый в CACHE_LOCATION, на нескольких серверах —
+# Redis/Memcached. locmem годится только для одного процесса.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)},
+    }
+}
+ANALYTICS_CACHE_TIMEOUT = config('ANALYTICS_CACHE_TIMEOUT', default=600, cast=int)
+# Контекст бизнеса пользователя (профиль, язык, подписка) в TenantMiddleware
+TENANT_CACHE_TIMEOUT = config('TENANT_CACHE_TIMEOUT', default=60, cast=int)
+
+# Число воркеров gunicorn (gunicorn.conf.py берёт его отсюда же)
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+
+# Доставка сообщений чата. SSE и long-poll держат соединение открытым,
+# поэтому работают только при SERVER_MODE=asgi; под WSGI страница чата
+# опрашивает chat_history раз в CHAT_SHORT_POLL_INTERVAL секунд.
+# InProcessPubSub будит ожидающие запросы только внутри своего процесса,
+# поэтому при нескольких воркерах по умолчанию DatabasePollingPubSub
+# (опрос БД раз в CHAT_POLL_INTERVAL секунд). Между выборками поток чата
+# закрывает соединение с БД: открытая вкладка не держит подключение, но
+# с DatabasePollingPubSub открывает новое раз в CHAT_POLL_INTERVAL секунд.
+CHAT_PUBSUB_BACKEND = config(
+    'CHAT_PUBSUB_BACKEND',
+    default='crm.pubsub.InProcessPubSub' if WEB_CONCURRENCY == 1 else 'crm.pubsub.DatabasePollingPubSub',
+)
+CHAT_POLL_INTERVAL = config('CHAT_POLL_INTERVAL', default=2.0, cast=float)
+CHAT_SHORT_POLL_INTERVAL = config('CHAT_SHORT_POLL_INTERVAL', default=5.0, cast=float)
+
+# Статистика SQL по запросам (crm.middleware.QueryStatsMiddleware): заголовки
+# X-DB-Queries / X-DB-Time / Server-Timing и JSON-строка в логгер crm.queries.
+# INFO — каждый запрос, WARNING — только с повторами запросов или больше
+# QUERY_STATS_WARN_QUERIES запросов.
+QUERY_STATS_HEADERS = config('QUERY_STATS_HEADERS', default=DEBUG, cast=bool)
+QUERY_STATS_WARN_QUERIES = config('QUERY_STATS_WARN_QUERIES', default=50, cast=int)
+# Журнал медленных запросов (crm.models.SlowQuery, смотреть в админке):
+# запросы дольше SLOW_QUERY_MS (0 — выключено), в таблице хранятся
+# последние SLOW_QUERY_KEEP, стек — SLOW_QUERY_STACK_DEPTH кадров кода проекта.
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=200, cast=int)
+SLOW_QUERY_KEEP = config('SLOW_QUERY_KEEP', default=10000, cast=int)
+SLOW_QUERY_STACK_DEPTH = config('SLOW_QUERY_STACK_DEPTH', default=8, cast=int)
+
+# Профилирование запросов (crm.middleware.ProfilingMiddleware): доля
+# случайных запросов (0 — выключено) и заголовок, которым суперпользователь
+# включает профиль для своего запроса. Профили хранятся кольцевым буфером
+# из PROFILE_KEEP файлов в PROFILE_ROOT, смотреть в /admin/profiles/.
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_HEADER = config('PROFILING_HEADER', default='X-Profile')
+PROFILE_ROOT = config('PROFILE_ROOT', default=str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = config('PROFILE_KEEP', default=200, cast=int)
+
+# Метрики Prometheus на /metrics (crm.metrics, crm.middleware.MetricsMiddleware).
+# Каждый воркер gunicorn раз в METRICS_FLUSH_INTERVAL секунд пишет свой
+# снимок в METRICS_DIR (общий каталог на машине), /metrics их суммирует.
+# Пустой METRICS_DIR — только метрики текущего процесса. /metrics требует
+# заголовок Authorization: Bearer <METRICS_TOKEN>; без токена отвечает 404.
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'crm_metrics'))
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=1.0, cast=float)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'crm.queries': {
+            'handlers': ['console'],
+            'level': config('QUERY_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
 
 # Production security settings
 if not DEBUG:
-    SECURE_SSL_REDIRECT = True
+    # bench_servers отключает редирект у локального gunicorn
+    SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=True, cast=bool)
+    # Prometheus обычно опрашивает воркеры напрямую по HTTP
+    SECURE_REDIRECT_EXEMPT = [r'^metrics$']
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
     SECURE_BROWSER_XSS_FILTER = True
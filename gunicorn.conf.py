@@ -0,0 +1,68 @@
+"""
+Настройки gunicorn. SERVER_MODE=wsgi (по умолчанию) — синхронные воркеры;
+SERVER_MODE=asgi — воркеры uvicorn: async-views и поток чата не держат
+воркер, пока ждут. Какой режим быстрее на своих данных и своей БД,
+показывает manage.py bench_servers.
+Адрес берётся из $PORT, число воркеров — из $WEB_CONCURRENCY.
+
+Очередь фоновых экспортов (manage.py run_export_worker) по умолчанию
+обрабатывает подпроцесс, который запускает мастер gunicorn: готовые файлы
+лежат в EXPORT_ROOT того же контейнера, откуда их отдаёт
+export_job_download. EXPORT_WORKER_IN_WEB=False — если воркер запущен
+отдельно с общим EXPORT_ROOT.
+"""
+# Не «from decouple import config»: config — имя настройки gunicorn
+import os
+import subprocess
+import sys
+
+import decouple
+
+
+SERVER_MODE = decouple.config('SERVER_MODE', default='wsgi')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'crm_project.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'crm_project.wsgi:application'
+    worker_class = 'sync'
+
+# Столько же воркеров видит settings.WEB_CONCURRENCY (выбор бэкенда чата)
+workers = decouple.config('WEB_CONCURRENCY', default=1, cast=int)
+
+# Синхронный воркер, занятый одним запросом дольше timeout секунд, перезапускается
+timeout = decouple.config('GUNICORN_TIMEOUT', default=60, cast=int)
+
+EXPORT_WORKER_IN_WEB = decouple.config('EXPORT_WORKER_IN_WEB', default=True, cast=bool)
+# Сколько ждать, пока воркер экспортов завершится при остановке
+EXPORT_WORKER_STOP_TIMEOUT = 10
+
+_export_worker = None
+
+
+def on_starting(server):
+    """Снимки метрик прошлого запуска не суммируются с новыми (crm.metrics)"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crm_project.settings')
+    from crm.metrics import clear_snapshots
+    clear_snapshots()
+
+
+def when_ready(server):
+    """Запускает воркер экспортов рядом с веб-воркерами"""
+    global _export_worker
+    if EXPORT_WORKER_IN_WEB:
+        manage = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py')
+        _export_worker = subprocess.Popen([sys.executable, manage, 'run_export_worker'])
+        server.log.info('Export worker started (pid %s)', _export_worker.pid)
+
+
+def on_exit(server):
+    """Останавливает воркер экспортов вместе с gunicorn"""
+    if _export_worker is None or _export_worker.poll() is not None:
+        return
+    _export_worker.terminate()
+    try:
+        _export_worker.wait(EXPORT_WORKER_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        _export_worker.kill()